@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+
+from time import time
+
+from bravo.chunk import Chunk
+from bravo.ibravo import ITerrainGenerator
+from bravo.plugin import retrieve_named_plugins
+
+def generated_chunk(i, generators):
+    chunk = Chunk(i, i)
+    for generator in generators:
+        generator.populate(chunk, i)
+    chunk.regenerate_heightmap()
+    return chunk
+
+def timed_regenerate(name, chunks, lazy=False):
+    times = []
+    for i in range(25):
+        before = time()
+        for chunk in chunks:
+            chunk.regenerate(lazy=lazy)
+        after = time()
+        t = (after - before) / len(chunks)
+        times.append(1 / t)
+    return name, times
+
+def boring_bench():
+    generators = retrieve_named_plugins(ITerrainGenerator,
+        ["boring", "safety"])
+    chunks = [generated_chunk(i, generators) for i in xrange(10)]
+    return timed_regenerate("regenerate_boring", chunks)
+
+def complex_bench():
+    generators = retrieve_named_plugins(ITerrainGenerator,
+        ["complex", "erosion", "watertable", "beaches", "grass", "safety"])
+    chunks = [generated_chunk(i, generators) for i in xrange(10)]
+    return timed_regenerate("regenerate_complex", chunks)
+
+def lazy_bench():
+    generators = retrieve_named_plugins(ITerrainGenerator,
+        ["complex", "erosion", "watertable", "beaches", "grass", "safety"])
+    chunks = [generated_chunk(i, generators) for i in xrange(10)]
+    return timed_regenerate("regenerate_lazy", chunks, lazy=True)
+
+benchmarks = [boring_bench, complex_bench, lazy_bench]
+
+if __name__ == "__main__":
+    for benchmark in benchmarks:
+        name, l = benchmark()
+        print "%s: %f chunks/second" % (name, sum(l) / len(l))
@@ -1,13 +1,17 @@
-from itertools import product
+from hashlib import sha1
+from struct import pack
+from time import time
 from warnings import warn
+from zlib import compressobj, decompress
 
-from numpy import int8, uint8, uint32, bool
-from numpy import cast, logical_not, logical_and, transpose, where, zeros, amax
-from numpy import vectorize
+from numpy import bool, uint8
+from numpy import asarray, concatenate, empty, fromstring, where, zeros
 
-from bravo.blocks import blocks, glowing_blocks
-from bravo.packets.beta import make_packet
-from bravo.utilities.bits import pack_nibbles
+from bravo.blocks import blocks
+from bravo.packets.beta import make_packet, packets_by_name
+from bravo.utilities.bits import NibbleArray
+from bravo.utilities.light import (LightQueue, column_skylight, glow_table,
+    regenerate_blocklight, regenerate_skylight)
 
 class ChunkWarning(Warning):
     """
@@ -15,59 +19,135 @@ class ChunkWarning(Warning):
     lethal, so the chunk is issuing a warning instead of an exception.
     """
 
-# Set up glow tables.
-# These tables provide glow maps for illuminated points.
-glow = [None] * 16
-for i in range(16):
-    dim = 2 * i + 1
-    glow[i] = zeros((dim, dim, dim), dtype=int8)
-    for x, y, z in product(xrange(dim), repeat=3):
-        distance = abs(x - i) + abs(y - i) + abs(z - i)
-        glow[i][ x,  y,  z] = i + 1 - distance
-    glow[i] = cast[uint8](glow[i].clip(0, 15))
-
-def composite_glow(target, strength, x, y, z):
+class Section(object):
     """
-    Composite a light source onto a lightmap.
+    A 16x16x16 slice of a chunk.
 
-    The exact operation is not quite unlike an add.
+    Sections hold the same arrays as chunks, indexed in the same (x, z, y)
+    order, but only sixteen blocks high.
     """
 
-    ambient = glow[strength]
+    def __init__(self, blocks=None, metadata=None, skylight=None,
+        blocklight=None):
+        """
+        Any arrays not passed in are created empty.
+        """
+
+        if blocks is None:
+            blocks = zeros((16, 16, 16), dtype=uint8)
+        if metadata is None:
+            metadata = NibbleArray((16, 16, 16))
+        if skylight is None:
+            skylight = NibbleArray((16, 16, 16))
+        if blocklight is None:
+            blocklight = NibbleArray((16, 16, 16))
+
+        self.blocks = blocks
+        self.metadata = metadata
+        self.skylight = skylight
+        self.blocklight = blocklight
+
+    def copy(self):
+        """
+        Make a copy of this section, with its own arrays.
+        """
+
+        return Section(self.blocks.copy(), self.metadata.copy(),
+            self.skylight.copy(), self.blocklight.copy())
+
+    def freeze(self):
+        """
+        Make this section read-only, so that it can be safely shared.
+        """
+
+        for array in (self.blocks, self.metadata.packed, self.skylight.packed,
+            self.blocklight.packed):
+            array.flags.writeable = False
+
+    def same_as(self, other):
+        """
+        Whether this section has exactly the same contents as another.
+
+        :rtype: bool
+        """
+
+        return (other is self or ((self.blocks == other.blocks).all()
+            and (self.metadata.packed == other.metadata.packed).all()
+            and (self.skylight.packed == other.skylight.packed).all()
+            and (self.blocklight.packed == other.blocklight.packed).all()))
 
-    xbound, zbound, ybound = target.shape
+    @property
+    def nbytes(self):
+        return (self.blocks.nbytes + self.metadata.packed.nbytes +
+            self.skylight.packed.nbytes + self.blocklight.packed.nbytes)
 
-    sx = x - strength
-    sy = y - strength
-    sz = z - strength
+    def is_empty(self):
+        """
+        Whether this section is indistinguishable from ``EMPTY``.
+
+        :rtype: bool
+        """
+
+        return not (self.blocks.any() or self.metadata.packed.any()
+            or self.blocklight.packed.any()
+            or (self.skylight.packed != 0xff).any())
+
+def _make_empty():
+    section = Section()
+    section.skylight.fill(15)
+    section.freeze()
+    return section
+
+EMPTY = _make_empty()
+"""
+The empty section.
+
+Sections which are entirely air, entirely lit by the sky, and have no block
+light or metadata are all the same, so they are all represented by this
+single, read-only section.
+"""
 
-    ex = x + strength
-    ey = y + strength
-    ez = z + strength
+class ChunkTemplate(object):
+    """
+    The contents of a chunk, shared between every chunk with exactly those
+    contents.
 
-    si, sj, sk = 0, 0, 0
-    ei, ej, ek = strength * 2, strength * 2, strength * 2
+    Templates are read-only; chunks using a template copy any section that
+    they write to. The compressed packet payload is shared as well, once any
+    of the chunks has made it.
 
-    if sx < 0:
-        sx, si = 0, -sx
+    :ivar tuple sections: shared, read-only sections
+    :ivar str digest: digest of the sections, like ``Chunk.digest()``
+    :ivar str payload: shared packet payload, or None if not made yet
+    """
 
-    if sy < 0:
-        sy, sj = 0, -sy
+    def __init__(self, sections, digest):
+        for section in sections:
+            if section is not EMPTY:
+                section.freeze()
 
-    if sz < 0:
-        sz, sk = 0, -sz
+        self.sections = tuple(sections)
+        self.digest = digest
+        self.payload = None
 
-    if ex > xbound:
-        ex, ei = xbound, ei - ex + xbound
+def _flat_property(index):
+    """
+    Make a property which exposes one of the full-height arrays of a chunk.
+    """
 
-    if ey > ybound:
-        ey, ej = ybound, ej - ey + ybound
+    def get(self):
+        return self._flatten()[index]
 
-    if ez > zbound:
-        ez, ek = zbound, ek - ez + zbound
+    def set(self, value):
+        target = self._flatten()[index]
+        if isinstance(target, NibbleArray):
+            if not isinstance(value, NibbleArray):
+                value = NibbleArray.from_array(value)
+            target.packed[...] = value.packed.reshape(target.packed.shape)
+        else:
+            target[...] = value.reshape(target.shape)
 
-    # Composite!
-    target[sx:ex, sz:ez, sy:ey] += ambient[si:ei, sk:ek, sj:ej]
+    return property(get, set)
 
 class Chunk(object):
     """
@@ -78,50 +158,409 @@ class Chunk(object):
     always measured 16x128x16 and are aligned on 16x16 boundaries in
     the xz-plane.
 
+    Chunks are stored as eight sections, each sixteen blocks high. Most of
+    the upper sections of a typical chunk are empty, and share ``EMPTY``
+    instead of having their own arrays. The ``blocks``, ``metadata``,
+    ``skylight``, and ``blocklight`` attributes are full-height arrays which
+    are put together from the sections on demand; while they exist, the
+    sections are views onto them, so that changes made through either are
+    seen by both. ``compact()`` goes back to separate sections.
+
+    The full-height arrays, and columns from ``get_column()``, are only
+    valid until the next ``compact()``, which the world does every tick;
+    hold on to the chunk, not to its arrays. Arrays which the chunk put
+    together itself are made read-only when it's compacted, so that writes
+    to stale arrays fail instead of being lost.
+
     :cvar bool dirty: Whether this chunk needs to be flushed to disk.
     :cvar bool populated: Whether this chunk has had its initial block data
         filled out.
+    :cvar `LightQueue` light_queue: The queue of pending light updates for
+        this chunk. Chunks which are part of a world share the world's queue,
+        so that light can be updated across chunk boundaries.
+    :cvar bool light_dirty: Whether this chunk's light still needs to be
+        spread. Lazily regenerated chunks only have direct skylight and the
+        light of glowing blocks themselves, until their light is needed.
     """
 
     dirty = True
     populated = False
+    light_queue = None
+    light_dirty = False
+
+    blocks = _flat_property(0)
+    metadata = _flat_property(1)
+    skylight = _flat_property(2)
+    blocklight = _flat_property(3)
 
     def __init__(self, x, z):
         """
         :param int x: X coordinate in chunk coords
         :param int z: Z coordinate in chunk coords
 
+        :ivar list sections: The sections of this chunk, from the bottom up.
         :ivar numpy.ndarray heightmap: Tracks the tallest block in each xz-column.
-        :ivar numpy.ndarray skylight: Ambient light map.
-        :ivar numpy.ndarray damaged: Array for tracking damaged coordinates.
+        :ivar set damaged: Set of damaged coordinates, packed as they are
+            in batch packets.
         :ivar bool all_damaged: Flag for forcing the entire chunk to be
             damaged. This is for efficiency; past a certain point, it is not
             efficient to batch block updates or track damage. Heavily damaged
             chunks have their damage represented as a complete resend of the
             entire chunk.
+        :ivar int generation: Counter which is bumped every time this chunk is
+            modified, for invalidating cached data.
+        :ivar float last_used: When this chunk was last asked for by its
+            world, or woken up from hibernation.
+        :ivar `ChunkTemplate` template: The template that this chunk shares
+            sections with, if any.
         """
 
         self.x = int(x)
         self.z = int(z)
 
-        self.blocks = zeros((16, 16, 128), dtype=uint8)
+        self._sections = [EMPTY] * 8
+        self._owned = [False] * 8
+        self._flat = None
+        self._unflattened = None
+        self._awake_nbytes = None
+
+        self.template = None
+
+        self.last_used = time()
+
         self.heightmap = zeros((16, 16), dtype=uint8)
-        self.blocklight = zeros((16, 16, 128), dtype=uint8)
-        self.metadata = zeros((16, 16, 128), dtype=uint8)
-        self.skylight = zeros((16, 16, 128), dtype=uint8)
 
         self.entities = set()
         self.tiles = {}
 
-        self.damaged = zeros((16, 16, 128), dtype=bool)
+        self.damaged = set()
 
         self.all_damaged = False
 
+        self.generation = 0
+        self._payload = None
+        self._payload_generation = None
+
     def __repr__(self):
         return "Chunk(%d, %d)" % (self.x, self.z)
 
     __str__ = __repr__
 
+    def _assemble(self):
+        """
+        Put together full-height arrays from the sections, without changing
+        the sections.
+        """
+
+        blocks = empty((16, 16, 128), dtype=uint8)
+        metadata = NibbleArray((16, 16, 128))
+        skylight = NibbleArray((16, 16, 128))
+        blocklight = NibbleArray((16, 16, 128))
+
+        for i, section in enumerate(self.sections):
+            full = slice(i * 16, i * 16 + 16)
+            half = slice(i * 8, i * 8 + 8)
+            blocks[:, :, full] = section.blocks
+            metadata.packed[:, :, half] = section.metadata.packed
+            skylight.packed[:, :, half] = section.skylight.packed
+            blocklight.packed[:, :, half] = section.blocklight.packed
+
+        return blocks, metadata, skylight, blocklight
+
+    def _flatten(self):
+        """
+        Get the full-height arrays for this chunk, making them if necessary.
+
+        Once the full-height arrays exist, the sections are replaced with
+        views onto them. The shared sections they replaced are remembered, so
+        that ``compact()`` can share the ones which weren't written to again.
+        """
+
+        if self._flat is None:
+            arrays = self._assemble()
+            unflattened = [None if owned else section
+                for section, owned in zip(self._sections, self._owned)]
+            self._use_flat(arrays)
+            self._unflattened = unflattened
+
+        return self._flat
+
+    def _use_flat(self, arrays):
+        """
+        Use a set of full-height arrays as this chunk's storage.
+        """
+
+        self._flat = blocks, metadata, skylight, blocklight = arrays
+        self._unflattened = None
+
+        for i in range(8):
+            full = slice(i * 16, i * 16 + 16)
+            half = slice(i * 8, i * 8 + 8)
+            self._sections[i] = Section(blocks[:, :, full],
+                NibbleArray((16, 16, 16), metadata.packed[:, :, half]),
+                NibbleArray((16, 16, 16), skylight.packed[:, :, half]),
+                NibbleArray((16, 16, 16), blocklight.packed[:, :, half]))
+            self._owned[i] = True
+
+    @property
+    def sections(self):
+        """
+        The sections of this chunk, from the bottom up.
+
+        Getting the sections of a hibernating chunk wakes it up.
+        """
+
+        if self._sections is None:
+            self.wake()
+        return self._sections
+
+    @property
+    def hibernating(self):
+        """
+        Whether this chunk is currently compressed in memory.
+        """
+
+        return self._sections is None
+
+    @property
+    def nbytes(self):
+        """
+        The number of bytes used to store this chunk's blocks, metadata, and
+        light.
+
+        Shared sections, including ``EMPTY``, aren't counted.
+        """
+
+        if self._sections is None:
+            return len(self._payload)
+        elif self._flat is not None:
+            blocks, metadata, skylight, blocklight = self._flat
+            return (blocks.nbytes + metadata.packed.nbytes +
+                skylight.packed.nbytes + blocklight.packed.nbytes)
+        else:
+            return sum(section.nbytes for section, owned
+                in zip(self._sections, self._owned) if owned)
+
+    @property
+    def hibernation_savings(self):
+        """
+        The number of bytes saved by hibernating this chunk, or zero if it
+        isn't hibernating.
+        """
+
+        if self._sections is None:
+            return self._awake_nbytes - len(self._payload)
+        return 0
+
+    def hibernate(self):
+        """
+        Compress this chunk in memory.
+
+        Only the compressed chunk packet payload is kept, and the sections are
+        thrown away. Sending a hibernating chunk to clients doesn't need the
+        sections, but anything else that does will wake it up again.
+        """
+
+        if self._sections is None:
+            return
+
+        # This also applies any pending lighting.
+        self.save_to_payload()
+
+        self._awake_nbytes = self.nbytes
+        self._sections = None
+        self._owned = None
+        self._flat = None
+        self._unflattened = None
+
+    def wake(self):
+        """
+        Decompress a hibernating chunk.
+        """
+
+        if self._sections is not None:
+            return
+
+        data = decompress(self._payload)
+        blocks = fromstring(data[:32768], dtype=uint8).reshape(16, 16, 128)
+        metadata = NibbleArray((16, 16, 128), data[32768:49152])
+        blocklight = NibbleArray((16, 16, 128), data[49152:65536])
+        skylight = NibbleArray((16, 16, 128), data[65536:])
+
+        self.load_arrays(blocks, metadata, skylight, blocklight)
+
+        self._awake_nbytes = None
+        self.last_used = time()
+
+    def load_arrays(self, blocks, metadata, skylight, blocklight):
+        """
+        Replace this chunk's blocks, metadata, and light with full-height
+        arrays.
+
+        Only the sections which aren't empty are copied out of the arrays,
+        so the arrays can be reused as soon as this returns.
+
+        :param `ndarray` blocks: block types
+        :param `NibbleArray` metadata: metadata
+        :param `NibbleArray` skylight: skylight
+        :param `NibbleArray` blocklight: block light
+        """
+
+        self._sections = [None] * 8
+        self._owned = [False] * 8
+        self._use_flat((blocks, metadata, skylight, blocklight))
+        self.compact()
+
+    def compact(self):
+        """
+        Drop the full-height arrays, and store this chunk as sections again.
+
+        Any empty sections are replaced with ``EMPTY``, and any sections which
+        haven't changed from this chunk's template, or from the sections they
+        replaced, are shared again. Any references to the
+        full-height arrays, or to columns from ``get_column()``, are no
+        longer connected to this chunk afterwards.
+        """
+
+        if self._flat is None:
+            return
+
+        unflattened = self._unflattened or [None] * 8
+
+        for i, section in enumerate(self._sections):
+            if (self.template is not None
+                and section.same_as(self.template.sections[i])):
+                self._sections[i] = self.template.sections[i]
+                self._owned[i] = False
+            elif (unflattened[i] is not None
+                and section.same_as(unflattened[i])):
+                # Only read, never written; keep sharing it.
+                self._sections[i] = unflattened[i]
+                self._owned[i] = False
+            elif section.is_empty():
+                self._sections[i] = EMPTY
+                self._owned[i] = False
+            else:
+                self._sections[i] = section.copy()
+                self._owned[i] = True
+
+        # Nobody else has the arrays that this chunk put together, so
+        # anything still writing to them has gone stale.
+        if self._unflattened is not None:
+            for array in self._flat:
+                if isinstance(array, NibbleArray):
+                    array = array.packed
+                array.flags.writeable = False
+
+        self._flat = None
+        self._unflattened = None
+
+    def own_section(self, i):
+        """
+        Get a section which can be written to.
+
+        Sections can be shared with other chunks, or be ``EMPTY``; those
+        sections are copied first, so that nobody else sees the changes.
+
+        :param int i: index of the section
+        :rtype: `Section`
+        """
+
+        sections = self.sections
+        if not self._owned[i]:
+            sections[i] = sections[i].copy()
+            self._owned[i] = True
+        return sections[i]
+
+    def digest(self):
+        """
+        Hash the contents of this chunk.
+
+        Chunks with the same digest have the same blocks, metadata, and
+        lighting, and can share a template.
+
+        :rtype: str
+        """
+
+        h = sha1()
+        for section in self.sections:
+            h.update(section.blocks.tostring())
+            h.update(section.metadata.tostring())
+            h.update(section.skylight.tostring())
+            h.update(section.blocklight.tostring())
+        return h.digest()
+
+    def make_template(self):
+        """
+        Turn this chunk's contents into a template, and use it.
+
+        :rtype: `ChunkTemplate`
+        """
+
+        self.compact()
+        template = ChunkTemplate(self.sections, self.digest())
+        self.use_template(template)
+        return template
+
+    def use_template(self, template):
+        """
+        Share a template's sections, and its payload if it has one, instead of
+        keeping a copy of the same contents.
+
+        :param `ChunkTemplate` template: template with the same contents as
+                                         this chunk
+        """
+
+        self._sections = list(template.sections)
+        self._owned = [False] * 8
+        self._flat = None
+        self._unflattened = None
+        self.template = template
+
+        if template.payload is not None:
+            self._payload = template.payload
+            self._payload_generation = self.generation
+
+    def snapshot(self):
+        """
+        Make a copy of this chunk, which won't change along with it.
+
+        The copy shares this chunk's sections, and from then on, both chunks
+        copy any shared section before writing to it, so taking a snapshot
+        costs almost nothing. Snapshots are meant for handing chunks to
+        other threads, like when saving them.
+
+        :rtype: `Chunk`
+        """
+
+        self.compact()
+
+        snapshot = Chunk(self.x, self.z)
+        snapshot._sections = list(self.sections)
+        snapshot.template = self.template
+        self._owned = [False] * 8
+
+        snapshot.heightmap = self.heightmap.copy()
+        snapshot.entities = set(self.entities)
+        snapshot.tiles = dict(self.tiles)
+
+        snapshot.populated = self.populated
+        snapshot.dirty = self.dirty
+        snapshot.light_dirty = self.light_dirty
+        snapshot.generation = self.generation
+
+        return snapshot
+
+    def _pristine(self):
+        """
+        Whether this chunk is still using all of its template's sections.
+        """
+
+        return (self.template is not None and self._flat is None
+            and self._sections is not None
+            and all(mine is theirs for mine, theirs
+                in zip(self._sections, self.template.sections)))
+
     def regenerate_heightmap(self):
         """
         Regenerate the height map array.
@@ -130,22 +569,33 @@ class Chunk(object):
         xz-column.
         """
 
-        for x, z in product(xrange(16), repeat=2):
-            for y in range(127, -1, -1):
-                if self.blocks[x, z, y]:
-                    break
-
-            self.heightmap[x, z] = y
+        heightmap = zeros((16, 16), dtype=uint8)
+        found = zeros((16, 16), dtype=bool)
+
+        # Find the first non-air block from the top of each column, working
+        # down one section at a time, and skipping empty sections. Columns
+        # which are entirely air have a height of zero.
+        for i in reversed(range(8)):
+            if found.all():
+                break
+            section = self.sections[i]
+            if section is EMPTY:
+                continue
+            solid = section.blocks[:, :, ::-1] != 0
+            top = solid.any(axis=2) & ~found
+            heightmap[top] = i * 16 + 15 - solid.argmax(axis=2)[top]
+            found |= top
+
+        self.heightmap = heightmap
 
     def regenerate_blocklight(self):
-        lightmap = zeros((16, 16, 128), dtype=uint32)
+        """
+        Regenerate the block light map.
 
-        for x, y, z in product(xrange(16), xrange(128), xrange(16)):
-            block = self.blocks[x, z, y]
-            if block in glowing_blocks:
-                composite_glow(lightmap, glowing_blocks[block], x, y, z)
+        Block light comes from glowing blocks, like torches and lava.
+        """
 
-        self.blocklight = cast[uint8](lightmap.clip(0, 15))
+        self.blocklight = regenerate_blocklight(self.blocks)
 
     def regenerate_metadata(self):
         pass
@@ -160,116 +610,105 @@ class Chunk(object):
         The height map must be valid for this method to produce valid results.
         """
 
-        lightmap = zeros((16, 16, 128), dtype=uint8)
-
-        for x, z in product(xrange(16), repeat=2):
-            # The maximum lighting value, unsurprisingly, is 0xf, which is the
-            # biggest possible value for a nibble.
-            light = 0xf
-
-            # Apparently, skylights start at the block *above* the block on
-            # which the light is incident?
-            height = self.heightmap[x, z] + 1
-
-            # The topmost block, regardless of type, is set to maximum
-            # lighting, as are all the blocks above it.
-            lightmap[x, z, height:] = light
-
-            # Dim the light going throught the remaining blocks, until there
-            # is no more light left.
-            for y in range(height, -1, -1):
-                dim = blocks[self.blocks[x, z, y]].dim
-                light -= dim
-                if light <= 0:
-                    break
-
-                lightmap[x, z, y] = light
-
-        # Now it's time to spread the light around. This flavor uses extra
-        # memory to speed things up; the basic idea is to spread *all* light,
-        # one glow level at a time, rather than spread each block
-        # individually.
-        max_height = amax(self.heightmap)
-        lightable = vectorize(lambda block: blocks[block].dim < 15)(self.blocks)
-        unlighted = logical_not(lightmap) & lightable
-
-        # Create a mask to find all blocks that have an unlighted block
-        # as a neighbour in the xz-plane.
-        mask = zeros((16, 16, max_height), dtype=bool)
-        mask[:-1,:,:max_height] |= unlighted[1:, :, :max_height]
-        mask[:,:-1,:max_height] |= unlighted[:, 1:, :max_height]
-        mask[1:,:,:max_height] |= unlighted[:-1, :, :max_height]
-        mask[:,1:,:max_height] |= unlighted[:, :-1, :max_height]
-
-        # Apply the mask to the lightmap to find all lighted blocks with one
-        # or more unlighted blocks as neighbours.
-        edges = logical_and(mask, lightmap[:, :, :max_height]).nonzero()
-
-        spread = [tuple(coords) for coords in transpose(edges)]
-        visited = set()
-        glow = 14
-
-        while glow:
-            for coords in spread:
-                if lightmap[coords] <= glow:
-                    visited.add(coords)
-                    continue
-
-                for dx, dz, dy in (
-                    (1, 0, 0),
-                    (-1, 0, 0),
-                    (0, 1, 0),
-                    (0, -1, 0),
-                    (0, 0, 1),
-                    (0, 0, -1)):
-                    x, z, y = coords
-                    x += dx
-                    z += dz
-                    y += dy
-
-                    if not (0 <= x < 16 and
-                        0 <= z < 16 and
-                        0 <= y < 128):
-                        continue
-
-                    if (x, z, y) in visited:
-                        continue
-
-                    if lightable[x, z, y] and lightmap[x, z, y] < glow:
-                        lightmap[x, z, y] = glow - blocks[self.blocks[x, z, y]].dim
-                        visited.add((x, z, y))
-            glow -= 1
-            spread = visited
-            visited = set()
-
-        self.skylight = lightmap.clip(0, 15)
-
-    def regenerate(self):
+        self.skylight = regenerate_skylight(self.blocks, self.heightmap)
+
+    def update_light(self):
+        """
+        Apply any pending light updates.
+
+        If this chunk was regenerated lazily, its light is spread now.
+
+        Light updates are queued as blocks change, and are applied in batches;
+        this forces the current batch to be applied immediately. If this
+        chunk shares a queue with other chunks, their updates are applied as
+        well.
+        """
+
+        if self.light_dirty:
+            self._spread_light()
+
+        if self.light_queue is not None:
+            self.light_queue.flush()
+
+    def _spread_light(self):
+        """
+        Finish lighting a lazily regenerated chunk.
+
+        Only the sections whose light actually changes are written, so that
+        sections shared with a template, or with ``EMPTY``, stay shared.
+        """
+
+        blocks = concatenate([section.blocks for section in self.sections],
+            axis=2)
+        lightmaps = (("skylight", regenerate_skylight(blocks, self.heightmap)),
+            ("blocklight", regenerate_blocklight(blocks)))
+
+        changed = False
+        for i, section in enumerate(self.sections):
+            for name, lightmap in lightmaps:
+                packed = NibbleArray.from_array(
+                    lightmap[:, :, i * 16:i * 16 + 16]).packed
+                if (getattr(section, name).packed != packed).any():
+                    getattr(self.own_section(i), name).packed[...] = packed
+                    changed = True
+
+        self.light_dirty = False
+
+        if changed:
+            self.dirty = True
+            self.generation += 1
+
+    def regenerate(self, lazy=False):
         """
         Regenerate all extraneous tables.
+
+        Spreading light is by far the most expensive part of regenerating a
+        chunk. If ``lazy`` is set, only the direct skylight of each column and
+        the light of glowing blocks are filled in, which is nearly free, and
+        the chunk is marked as needing its light spread. That happens in
+        ``update_light()``, which is called before the chunk is sent or saved;
+        chunks which are never used are never lit.
+
+        :param bool lazy: whether to put off spreading light
         """
 
         self.regenerate_heightmap()
-        self.regenerate_blocklight()
         self.regenerate_metadata()
-        self.regenerate_skylight()
+
+        if lazy:
+            blocks = self.blocks
+            self.blocklight = glow_table[blocks]
+            self.skylight = column_skylight(blocks, self.heightmap)
+            self.light_dirty = True
+        else:
+            self.regenerate_blocklight()
+            self.regenerate_skylight()
+            self.light_dirty = False
 
         self.dirty = True
+        self.generation += 1
 
     def damage(self, coords):
         """
         Record damage on this chunk.
-        """
 
-        x, y, z = coords
+        Past a certain number of damaged blocks, it's cheaper to resend the
+        entire chunk, so the individual damage is forgotten and the whole
+        chunk is marked as damaged instead.
+        """
 
         if self.all_damaged:
             return
 
-        self.damaged[x, z, y] = True
+        x, y, z = coords
+
+        # Coordinates are packed the same way as in batch packets, x << 12 |
+        # z << 8 | y, so that they can be sent without any translation.
+        self.damaged.add(x << 12 | z << 8 | y)
 
-        if self.damaged.sum() > 176:
+        if len(self.damaged) > 176:
             self.all_damaged = True
+            self.damaged.clear()
 
     def is_damaged(self):
         """
@@ -279,7 +718,7 @@ class Chunk(object):
         :returns: True if any damage is pending on this chunk, False if not.
         """
 
-        return self.all_damaged or self.damaged.any()
+        return self.all_damaged or bool(self.damaged)
 
     def get_damage_packet(self):
         """
@@ -309,28 +748,28 @@ class Chunk(object):
         if self.all_damaged:
             # Resend the entire chunk!
             return self.save_to_packet()
-        elif not self.damaged.any():
+        elif not self.damaged:
             return ""
-        elif self.damaged.sum() == 1:
+        elif len(self.damaged) == 1:
             # Use a single block update packet.
-            x, z, y = [int(i) for i in zip(*self.damaged.nonzero())[0]]
+            coord = next(iter(self.damaged))
+            x, z, y = coord >> 12, coord >> 8 & 0xf, coord & 0x7f
             return make_packet("block",
                     x=x + self.x * 16,
                     y=y,
                     z=z + self.z * 16,
-                    type=int(self.blocks[x, z, y]),
-                    meta=int(self.metadata[x, z, y]))
+                    type=self.get_block((x, y, z)),
+                    meta=self.get_metadata((x, y, z)))
         else:
-            # Use a batch update.
-            damaged = self.damaged.nonzero()
-            # Coordinates are not quite packed in the same system as the
-            # indices for chunk data structures.
-            # Chunk data structures are ((x * 16) + z) * 128) + y, or in
-            # bit-twiddler's parlance, x << 11 | z << 7 | y. However, for
-            # this, we need x << 12 | z << 8 | y, so repack accordingly.
-            coords = [int(x << 12 | z << 8 | y) for x, z, y in zip(*damaged)]
-            types = [int(i) for i in self.blocks[damaged]]
-            metadata = [int(i) for i in self.metadata[damaged]]
+            # Use a batch update. The damage is already packed the way that
+            # the batch packet wants it.
+            coords = sorted(self.damaged)
+            types = []
+            metadata = []
+            for coord in coords:
+                x, z, y = coord >> 12, coord >> 8 & 0xf, coord & 0x7f
+                types.append(self.get_block((x, y, z)))
+                metadata.append(self.get_metadata((x, y, z)))
 
             return make_packet("batch", x=self.x, z=self.z,
                 length=len(coords), coords=coords, types=types,
@@ -341,21 +780,60 @@ class Chunk(object):
         Clear this chunk's damage.
         """
 
-        self.damaged.fill(False)
+        self.damaged.clear()
         self.all_damaged = False
 
+    def save_to_payload(self):
+        """
+        Generate the compressed block and light data for a chunk packet.
+
+        Compressing chunks is expensive, so the payload is cached, and only
+        rebuilt when this chunk's generation has changed.
+
+        :rtype: str
+        :returns: zlib-compressed chunk data
+        """
+
+        self.update_light()
+
+        if self._payload_generation != self.generation:
+            if self._pristine() and self.template.payload is not None:
+                self._payload = self.template.payload
+                self._payload_generation = self.generation
+                return self._payload
+
+            if self._flat is None:
+                arrays = self._assemble()
+            else:
+                arrays = self._flat
+            blocks, metadata, skylight, blocklight = arrays
+
+            compressor = compressobj()
+            payload = compressor.compress(buffer(blocks))
+            for nibbles in (metadata, blocklight, skylight):
+                payload += compressor.compress(buffer(nibbles.packed))
+            payload += compressor.flush()
+
+            self._payload = payload
+            self._payload_generation = self.generation
+
+            if self._pristine():
+                self.template.payload = payload
+
+        return self._payload
+
     def save_to_packet(self):
         """
         Generate a chunk packet.
         """
 
-        array = self.blocks.tostring()
-        array += pack_nibbles(self.metadata)
-        array += pack_nibbles(self.blocklight)
-        array += pack_nibbles(self.skylight)
-        packet = make_packet("chunk", x=self.x * 16, y=0, z=self.z * 16,
-            x_size=15, y_size=127, z_size=15, data=array)
-        return packet
+        payload = self.save_to_payload()
+        # This is the header of the "chunk" packet. The payload is already
+        # compressed, so it can't go through make_packet(), which would
+        # compress it again.
+        header = pack(">BiHiBBBI", packets_by_name["chunk"], self.x * 16, 0,
+            self.z * 16, 15, 127, 15, len(payload))
+        return header + payload
 
     def get_block(self, coords):
         """
@@ -368,7 +846,7 @@ class Chunk(object):
 
         try:
             x, y, z = coords
-            return self.blocks[x, z, y]
+            return self.sections[y >> 4].blocks.item(x, z, y & 0xf)
         except IndexError:
             # Coordinates were out-of-bounds; warn and pretend it's air.
             warn("Coordinates %s are out-of-bounds in %s" % (coords, self),
@@ -386,8 +864,9 @@ class Chunk(object):
         x, y, z = coords
 
         try:
-            if self.blocks[x, z, y] != block:
-                self.blocks[x, z, y] = block
+            old = self.sections[y >> 4].blocks.item(x, z, y & 0xf)
+            if old != block:
+                self.own_section(y >> 4).blocks.itemset(x, z, y & 0xf, block)
 
                 if not self.populated:
                     return
@@ -399,20 +878,20 @@ class Chunk(object):
                     height = self.heightmap[x, z]
                     if y == height:
                         for y in range(height, -1, -1):
-                            if self.blocks[x, z, y]:
+                            if self.get_block((x, y, z)):
                                 break
                         self.heightmap[x, z] = y
                 else:
                     self.heightmap[x, z] = max(self.heightmap[x, z], y)
 
-                # Add to lightmap at this coordinate.
-                if block in glowing_blocks:
-                    composite_glow(self.blocklight, glowing_blocks[block],
-                        x, y, z)
-
-                    self.blocklight = cast[uint8](self.blocklight.clip(0, 15))
+                # Queue up lighting changes. They'll be applied later, along
+                # with any other changes made in the meantime.
+                if self.light_queue is None:
+                    self.light_queue = LightQueue()
+                self.light_queue.enqueue(self, coords, old)
 
                 self.dirty = True
+                self.generation += 1
                 self.damage(coords)
         except IndexError:
             # Coordinates were out-of-bounds; warn and run away.
@@ -430,7 +909,7 @@ class Chunk(object):
         x, y, z = coords
 
         try:
-            return self.metadata[x, z, y]
+            return self.sections[y >> 4].metadata.item(x, z, y & 0xf)
         except IndexError:
             # Coordinates were out-of-bounds; warn.
             warn("Coordinates %s are out-of-bounds in %s" % (coords, self),
@@ -448,10 +927,13 @@ class Chunk(object):
         x, y, z = coords
 
         try:
-            if self.metadata[x, z, y] != metadata:
-                self.metadata[x, z, y] = metadata
+            section = self.sections[y >> 4]
+            if section.metadata.item(x, z, y & 0xf) != metadata:
+                section = self.own_section(y >> 4)
+                section.metadata.itemset(x, z, y & 0xf, metadata)
 
                 self.dirty = True
+                self.generation += 1
                 self.damage(coords)
         except IndexError:
             # Coordinates were out-of-bounds; warn.
@@ -474,7 +956,7 @@ class Chunk(object):
 
         x, y, z = coords
 
-        block = blocks[self.blocks[x, z, y]]
+        block = blocks[self.get_block((x, y, z))]
         self.set_block((x, y, z), block.replace)
         self.set_metadata((x, y, z), 0)
 
@@ -501,11 +983,18 @@ class Chunk(object):
         :param int replace: block to use as a replacement
         """
 
-        if (self.blocks == search).any():
+        changed = False
+
+        for i, section in enumerate(self.sections):
+            matches = section.blocks == search
+            if matches.any():
+                self.own_section(i).blocks[matches] = replace
+                changed = True
+
+        if changed:
             self.all_damaged = True
             self.dirty = True
-
-            self.blocks = where(self.blocks == search, replace, self.blocks)
+            self.generation += 1
 
     def get_column(self, x, z):
         """
@@ -514,6 +1003,9 @@ class Chunk(object):
         The slice is a numpy array, so you do not have to set it again if you
         are modifying it in-place.
 
+        This needs the full-height block array, so it is made if it doesn't
+        already exist.
+
         :rtype: :py:class:`numpy.ndarray`
         """
         return self.blocks[x, z]
@@ -527,8 +1019,223 @@ class Chunk(object):
         :type column: :py:class:`numpy.ndarray`
         :param column: Column data, in the form of a NumPy array.
         """
-        self.blocks[x, z] = column
+
+        mask = zeros((16, 16, 128), dtype=bool)
+        mask[x, z] = True
+        values = zeros((16, 16, 128), dtype=uint8)
+        values[x, z] = column
+
+        self._edit(mask, values)
+
+    def _box(self, start, end):
+        """
+        Make a full-height mask of a box of blocks.
+        """
+
+        (x1, y1, z1), (x2, y2, z2) = start, end
+
+        mask = zeros((16, 16, 128), dtype=bool)
+        mask[x1:x2, z1:z2, y1:y2] = True
+        return mask
+
+    def _scatter(self, coords, values=None):
+        """
+        Turn a list of coordinate triplets into a full-height mask, and
+        optionally a full-height array of values.
+
+        Coordinates outside of this chunk are dropped with a warning.
+        """
+
+        coords = asarray(coords, dtype=int).reshape(-1, 3)
+        x, y, z = coords.T
+
+        inside = ((0 <= x) & (x < 16) & (0 <= y) & (y < 128) & (0 <= z)
+            & (z < 16))
+        if not inside.all():
+            warn("Coordinates %s are out-of-bounds in %s" %
+                 (coords[~inside].tolist(), self), ChunkWarning)
+            x, y, z = x[inside], y[inside], z[inside]
+            if values is not None and asarray(values).ndim:
+                values = asarray(values)[inside]
+
+        mask = zeros((16, 16, 128), dtype=bool)
+        mask[x, z, y] = True
+
+        if values is None:
+            return mask, None
+
+        array = zeros((16, 16, 128), dtype=uint8)
+        array[x, z, y] = values
+        return mask, array
+
+    def _edit(self, mask, block=None, metadata=None, search=None):
+        """
+        Write blocks and metadata wherever a mask is set, and then bring the
+        rest of this chunk up to date, once, for all of the changes.
+
+        Only sections which actually change are written to.
+
+        :param `ndarray` mask: full-height boolean mask of blocks to write
+        :param block: block type, or full-height array of block types
+        :param metadata: metadata, or full-height array of metadata
+        :param int search: only write where the block type is this
+        :returns: number of blocks changed
+        """
+
+        sections = self.sections
+        changed = zeros((16, 16, 128), dtype=bool)
+        moved = None
+
+        if block is not None or search is not None:
+            old = concatenate([section.blocks for section in sections],
+                axis=2)
+            if search is not None:
+                mask = mask & (old == search)
+
+        if block is not None:
+            new = where(mask, block, old)
+            moved = new != old
+            self._write("blocks", moved, new)
+            changed |= moved
+
+        if metadata is not None:
+            current = concatenate([section.metadata.unpack()
+                for section in sections], axis=2)
+            new = where(mask, metadata, current) & 0xf
+            differs = new != current
+            self._write("metadata", differs, new)
+            changed |= differs
+
+        count = int(changed.sum())
+        if not count:
+            return 0
+
+        if self.populated and moved is not None and moved.any():
+            self.regenerate_heightmap()
+
+            if self.light_queue is None:
+                self.light_queue = LightQueue()
+            self.light_queue.enqueue_mask(self, moved, old)
 
         self.dirty = True
-        for y in range(128):
-            self.damage((x, y, z))
+        self.generation += 1
+
+        if not self.all_damaged:
+            if len(self.damaged) + count > 176:
+                self.all_damaged = True
+                self.damaged.clear()
+            else:
+                xs, zs, ys = changed.nonzero()
+                self.damaged.update((xs << 12 | zs << 8 | ys).tolist())
+
+        return count
+
+    def _write(self, name, changed, values):
+        """
+        Copy the changed parts of a full-height array into each section.
+        """
+
+        for i in range(8):
+            mask = changed[:, :, i * 16:i * 16 + 16]
+            if mask.any():
+                array = getattr(self.own_section(i), name)
+                array[mask] = values[:, :, i * 16:i * 16 + 16][mask]
+
+    def get_blocks(self, coords):
+        """
+        Look up many blocks at once.
+
+        :param coords: sequence of coordinate triplets, or an array of them
+                       with shape (n, 3)
+        :rtype: :py:class:`numpy.ndarray`
+        :returns: block types, in the same order as the coordinates
+        """
+
+        coords = asarray(coords, dtype=int).reshape(-1, 3)
+        x, y, z = coords.T
+
+        blocks = concatenate([section.blocks for section in self.sections],
+            axis=2)
+        return blocks[x, z, y]
+
+    def set_blocks(self, coords, blocks=None, metadata=None):
+        """
+        Update many blocks at once.
+
+        The heightmap, lighting, and damage are only updated once, for all of
+        the blocks together.
+
+        :param coords: sequence of coordinate triplets, or an array of them
+                       with shape (n, 3)
+        :param blocks: block type, or sequence of block types, one for each
+                       coordinate; None to leave the blocks alone
+        :param metadata: metadata, or sequence of metadata, one for each
+                         coordinate; None to leave the metadata alone
+        :returns: number of blocks changed
+        """
+
+        mask, blocks_array = self._scatter(coords, blocks)
+        if metadata is not None:
+            mask, metadata = self._scatter(coords, metadata)
+
+        return self._edit(mask, blocks_array, metadata)
+
+    def fill_box(self, start, end, block, metadata=None):
+        """
+        Fill a box with a single kind of block.
+
+        Like slices, the box includes its start and not its end; a box from
+        (0, 0, 0) to (16, 128, 16) covers the entire chunk.
+
+        :param tuple start: coordinate triplet of the first corner
+        :param tuple end: coordinate triplet past the opposite corner
+        :param int block: block type
+        :param int metadata: metadata, or None to leave the metadata alone
+        :returns: number of blocks changed
+        """
+
+        return self._edit(self._box(start, end), block, metadata)
+
+    def replace(self, search, replace, start=None, end=None, mask=None):
+        """
+        Replace one kind of block with another.
+
+        Unlike ``sed()``, this keeps the heightmap, lighting, and damage up
+        to date. The replacement can be limited to a box, to a mask, or to
+        both; otherwise, the entire chunk is searched.
+
+        :param int search: block to find
+        :param int replace: block to use as a replacement
+        :param tuple start: optional first corner of a box, as for
+                            ``fill_box()``
+        :param tuple end: optional opposite corner of a box
+        :param `ndarray` mask: optional full-height boolean mask, indexed
+                               like ``blocks``
+        :returns: number of blocks changed
+        """
+
+        if start is not None:
+            region = self._box(start, end)
+        else:
+            region = zeros((16, 16, 128), dtype=bool)
+            region.fill(True)
+
+        if mask is not None:
+            region &= mask
+
+        return self._edit(region, replace, search=search)
+
+    def apply_mask(self, mask, block=None, metadata=None):
+        """
+        Set every block under a mask.
+
+        :param `ndarray` mask: full-height boolean mask, indexed like
+                               ``blocks``
+        :param block: block type, or full-height array of block types to
+                      take values from; None to leave the blocks alone
+        :param metadata: metadata, or full-height array of metadata; None to
+                         leave the metadata alone
+        :returns: number of blocks changed
+        """
+
+        return self._edit(asarray(mask, dtype=bool), block, metadata)
@@ -16,3 +16,8 @@ class SerializerWriteException(SerializerException):
     """
     A serializer had issues writing data.
     """
+
+class ChunkNotLoaded(Exception):
+    """
+    The requested chunk is not loaded.
+    """
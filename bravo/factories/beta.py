@@ -1,6 +1,6 @@
-from itertools import chain
 from time import time
 
+from twisted.internet.defer import succeed
 from twisted.internet.interfaces import IPushProducer
 from twisted.internet.protocol import Factory
 from twisted.internet.task import LoopingCall
@@ -283,8 +283,12 @@ class BravoFactory(Factory):
     def flush_chunk(self, chunk):
         """
         Flush a damaged chunk to all players that have it loaded.
+
+        Any lighting changes queued up by the damage are applied first.
         """
 
+        chunk.update_light()
+
         if chunk.is_damaged():
             packet = chunk.get_damage_packet()
             for player in self.protocols.itervalues():
@@ -303,8 +307,7 @@ class BravoFactory(Factory):
         I'm gonna have a chat with you.
         """
 
-        for chunk in chain(self.world.chunk_cache.itervalues(),
-            self.world.dirty_chunk_cache.itervalues()):
+        for chunk in self.world.chunk_cache.itervalues():
             self.flush_chunk(chunk)
 
     def give(self, coords, block, quantity):
@@ -348,22 +351,25 @@ class BravoFactory(Factory):
         """
         Called before factory stops listening on ports. Used to perform
         shutdown tasks.
+
+        :returns: ``Deferred`` which fires when the world has been saved
         """
 
         if not self.world.saving:
-            return
+            return succeed(None)
 
         log.msg("Shutting down; flushing world data...")
 
-        # Flush all dirty chunks to disk.
-        for chunk in self.world.dirty_chunk_cache.itervalues():
-            self.world.save_chunk(chunk)
+        # Flush all dirty chunks to disk, including any which haven't been
+        # noticed as dirty yet.
+        d = self.world.flush()
 
         # Write back current world time.
         self.world.time = self.time
         self.world.serializer.save_level(self.world)
 
-        log.msg("World data saved!")
+        d.addCallback(lambda none: log.msg("World data saved!"))
+        return d
 
     def pauseProducing(self):
         pass
@@ -334,6 +334,133 @@ class NBTFile(TAG_Compound):
         if filename and 'close' in dir(self.file):
             self.file.close()
 
+# A faster parser, for whole NBT files which are already in memory.
+# Instead of reading every field from a file object, the parser walks a
+# single string with precompiled structs, keeping track of its offset itself.
+# It builds the same tags as the file parser, but skips their constructors.
+
+_byte = Struct(">b")
+_length = Struct(">i")
+_string_length = Struct(">H")
+
+def _new_tag(cls, name, value=None):
+    tag = cls.__new__(cls)
+    tag.name = name
+    tag.value = value
+    return tag
+
+def _parse_numeric(cls):
+    fmt = cls.fmt
+    size = fmt.size
+    unpack_from = fmt.unpack_from
+
+    def parse(data, offset, name):
+        tag = _new_tag(cls, name, unpack_from(data, offset)[0])
+        tag.size = size
+        return tag, offset + size
+
+    return parse
+
+def _parse_byte_array(data, offset, name):
+    length = _length.unpack_from(data, offset)[0]
+    offset += 4
+    end = offset + length
+    if length < 0 or end > len(data):
+        raise StructError("Byte array runs past the end of the data")
+    return _new_tag(TAG_Byte_Array, name, buffer(data, offset, length)), end
+
+def _parse_string_value(data, offset):
+    length = _string_length.unpack_from(data, offset)[0]
+    offset += 2
+    end = offset + length
+    if end > len(data):
+        raise StructError("String runs past the end of the data")
+    return unicode(data[offset:end], "utf-8"), end
+
+def _parse_string(data, offset, name):
+    value, offset = _parse_string_value(data, offset)
+    return _new_tag(TAG_String, name, value), offset
+
+def _parse_list(data, offset, name):
+    tagid = _byte.unpack_from(data, offset)[0]
+    length = _length.unpack_from(data, offset + 1)[0]
+    offset += 5
+
+    tag = _new_tag(TAG_List, name)
+    tag.tagID = tagid
+    tag.tags = tags = []
+
+    if length > 0:
+        try:
+            parse = _PARSERS[tagid]
+        except KeyError:
+            raise ValueError("Unrecognised tag type")
+        for i in xrange(length):
+            item, offset = parse(data, offset, None)
+            tags.append(item)
+
+    return tag, offset
+
+def _parse_compound(data, offset, name):
+    tag = _new_tag(TAG_Compound, name)
+    tag.tags = tags = []
+
+    while True:
+        tagid = _byte.unpack_from(data, offset)[0]
+        offset += 1
+        if tagid == TAG_END:
+            break
+
+        name, offset = _parse_string_value(data, offset)
+        try:
+            parse = _PARSERS[tagid]
+        except KeyError:
+            raise ValueError("Unrecognised tag type")
+        item, offset = parse(data, offset, name)
+        tags.append(item)
+
+    return tag, offset
+
+_PARSERS = {
+    TAG_BYTE: _parse_numeric(TAG_Byte),
+    TAG_SHORT: _parse_numeric(TAG_Short),
+    TAG_INT: _parse_numeric(TAG_Int),
+    TAG_LONG: _parse_numeric(TAG_Long),
+    TAG_FLOAT: _parse_numeric(TAG_Float),
+    TAG_DOUBLE: _parse_numeric(TAG_Double),
+    TAG_BYTE_ARRAY: _parse_byte_array,
+    TAG_STRING: _parse_string,
+    TAG_LIST: _parse_list,
+    TAG_COMPOUND: _parse_compound,
+}
+
+def parse_nbt(data, offset=0):
+    """
+    Parse an uncompressed NBT file which is already in memory.
+
+    This builds the same tags as ``NBTFile``, but much more quickly, since it
+    doesn't make lots of little reads. Byte arrays aren't copied; their values
+    are ``buffer``s pointing into ``data``.
+
+    :param data: the NBT, as a string or a ``buffer``
+    :param int offset: where the NBT starts in ``data``
+
+    :returns: ``NBTFile`` holding the parsed NBT
+    """
+
+    try:
+        if _byte.unpack_from(data, offset)[0] != TAG_COMPOUND:
+            raise MalformedFileError("First record is not a Compound Tag")
+        name, offset = _parse_string_value(data, offset + 1)
+        compound, offset = _parse_compound(data, offset, name)
+    except StructError:
+        raise MalformedFileError("Partial File Parse: file possibly truncated.")
+
+    nbt = NBTFile()
+    nbt.name = name
+    nbt.tags = compound.tags
+    return nbt
+
 # Useful utility functions for handling large NBT structures elegantly and
 # Pythonically.
 
@@ -247,11 +247,11 @@ class Quit(object):
         factory.broadcast(packet)
 
         yield "Saving all chunks to disk..."
-        for chunk in factory.world.dirty_chunk_cache.itervalues():
-            factory.world.save_chunk(chunk)
+        d = factory.world.flush()
 
+        # Don't stop until the chunks are safely written.
         yield "Halting."
-        reactor.stop()
+        d.addCallback(lambda none: reactor.stop())
 
     name = "quit"
     aliases = ("exit",)
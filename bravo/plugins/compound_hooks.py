@@ -17,7 +17,9 @@ class Fallables(object):
     whitespace = (blocks["air"].slot,)
 
     def dig_hook(self, factory, chunk, x, y, z, block):
-        column = chunk.get_column(x, z)
+        # Work on a copy, so that the whole column is updated in one go
+        # afterwards.
+        column = chunk.get_column(x, z).copy()
         y = min(y - 1, 0)
 
         while y < 127:
@@ -36,10 +36,29 @@ class Status(object):
             dirty = len([i for i in protocol.chunks.values() if i.dirty])
             yield "%s: %d chunks (%d dirty)" % (name, count, dirty)
 
-        chunk_count = len(factory.world.chunk_cache)
-        dirty = len(factory.world.dirty_chunk_cache)
-        chunk_count += dirty
-        yield "World cache: %d chunks (%d dirty)" % (chunk_count, dirty)
+        stats = factory.world.cache_stats()
+        yield "World cache: %d chunks (%d dirty)" % (stats["chunks"],
+            stats["dirty"])
+        yield "Cache: %d KiB, %d evicted, %.1f%% hit rate" % (
+            stats["bytes"] // 1024, stats["evictions"],
+            stats["hit_rate"] * 100)
+
+        stats = factory.world.save_stats()
+        yield "Saving: %d chunks waiting, %.1f ms per save, %.1f s latency" % (
+            stats["backlog"], stats["save_time"] * 1000, stats["latency"])
+        yield "Writing: %d KiB in %d commits, %.1f ms per commit" % (
+            stats["bytes_written"] // 1024, stats["commits"],
+            stats["commit_time"] * 1000)
+
+        stats = factory.world.load_stats()
+        yield "Reading: %d chunks, %.1f ms read, %.1f ms decode per chunk" % (
+            stats["read"], stats["read_time"] * 1000,
+            stats["decode_time"] * 1000)
+
+        stats = factory.world.hibernation_stats()
+        yield "Hibernating: %d chunks (%d KiB saved, %.1f%% hit rate)" % (
+            stats["hibernating"], stats["bytes_saved"] // 1024,
+            stats["hit_rate"] * 100)
 
     name = "status"
     aliases = tuple()
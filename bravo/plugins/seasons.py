@@ -1,4 +1,4 @@
-from itertools import product
+from numpy import column_stack, in1d, indices
 
 from zope.interface import implements
 
@@ -55,22 +55,21 @@ class Winter(object):
     implements(ISeason)
 
     def transform(self, chunk):
-        chunk.sed(blocks["spring"].slot, blocks["ice"].slot)
+        chunk.replace(blocks["spring"].slot, blocks["ice"].slot)
 
         # Make sure that the heightmap is valid so that we don't spawn
         # floating snow.
         chunk.regenerate_heightmap()
 
-        # Lay snow over anything not already snowed and not snow-resistant.
-        for x, z in product(xrange(16), xrange(16)):
-            height = chunk.height_at(x, z)
-            if height == 127:
-                continue
+        # Lay snow over anything not already snowed and not snow-resistant,
+        # all at once.
+        x, z = indices((16, 16))
+        tops = column_stack((x.ravel(), chunk.heightmap.ravel(), z.ravel()))
+        tops = tops[tops[:, 1] < 127]
 
-            top_block = chunk.get_block((x, height, z))
-
-            if top_block not in snow_resistant:
-                chunk.set_block((x, height + 1, z), blocks["snow"].slot)
+        exposed = ~in1d(chunk.get_blocks(tops), list(snow_resistant))
+        above = tops[exposed] + (0, 1, 0)
+        chunk.set_blocks(above, blocks["snow"].slot)
 
     name = "winter"
 
@@ -81,8 +80,8 @@ class Spring(object):
     implements(ISeason)
 
     def transform(self, chunk):
-        chunk.sed(blocks["ice"].slot, blocks["spring"].slot)
-        chunk.sed(blocks["snow"].slot, blocks["air"].slot)
+        chunk.replace(blocks["ice"].slot, blocks["spring"].slot)
+        chunk.replace(blocks["snow"].slot, blocks["air"].slot)
 
     name = "spring"
 
@@ -1,14 +1,25 @@
 from __future__ import division
 
+from contextlib import contextmanager
 from gzip import GzipFile
 from itertools import chain
+from mmap import mmap, ACCESS_READ
 import os
+from Queue import Queue
+import sqlite3
 from StringIO import StringIO
-from struct import pack, unpack
+from struct import pack, unpack, unpack_from, Struct
+import sys
+from threading import Event, Lock, Thread
+from time import time
 from urlparse import urlparse
+from zlib import compress, compressobj, decompress
 
-from numpy import array, fromstring, uint8
+from numpy import ascontiguousarray, frombuffer, uint8
 
+from twisted.internet import reactor
+from twisted.internet.task import LoopingCall
+from twisted.internet.threads import deferToThread
 from twisted.python import log
 from twisted.python.filepath import FilePath
 from zope.interface import implements, classProvides
@@ -18,10 +29,13 @@ from bravo.errors import SerializerReadException, SerializerWriteException
 from bravo.ibravo import ISerializer, ISerializerFactory
 from bravo.inventory import Slot
 from bravo.location import Location
-from bravo.nbt import NBTFile
+from bravo.nbt import NBTFile, parse_nbt
+from bravo.nbt import TAG_BYTE, TAG_INT, TAG_BYTE_ARRAY, TAG_LIST, TAG_COMPOUND
 from bravo.nbt import TAG_Compound, TAG_List, TAG_Byte_Array, TAG_String
 from bravo.nbt import TAG_Double, TAG_Long, TAG_Short, TAG_Int, TAG_Byte
-from bravo.utilities.bits import unpack_nibbles, pack_nibbles
+from bravo.utilities.bits import NibbleArray
+from bravo.utilities.cache import LRUCache
+from bravo.utilities.extents import Extents
 
 # Due to technical limitations in the way Twisted discovers plugins, here is
 # how this file works:
@@ -77,6 +91,70 @@ def name_for_region(x, z):
 
     return "r.%s.%s.mcr" % (x // 32, z // 32)
 
+def name_for_native_region(x, z):
+    """
+    Figure out the name for a native region file, given chunk coordinates.
+    """
+
+    return "r.%s.%s.bnr" % (x // 32, z // 32)
+
+# The fixed parts of a chunk's NBT, for writing chunks straight from their
+# arrays. Every chunk has the same tags, in the same order, so everything but
+# the values can be rendered once, up front.
+
+def _tag_header(tagid, name):
+    return pack(">bH", tagid, len(name)) + name
+
+def _array_header(name, length):
+    return _tag_header(TAG_BYTE_ARRAY, name) + pack(">i", length)
+
+_chunk_prefix = (_tag_header(TAG_COMPOUND, "") +
+    _tag_header(TAG_COMPOUND, "Level") + _tag_header(TAG_INT, "xPos"))
+_zpos_header = _tag_header(TAG_INT, "zPos")
+_chunk_header = Struct(">%dsi%dsi" % (len(_chunk_prefix), len(_zpos_header)))
+
+_blocks_header = _array_header("Blocks", 32768)
+_heightmap_header = _array_header("HeightMap", 256)
+_blocklight_header = _array_header("BlockLight", 16384)
+_metadata_header = _array_header("Data", 16384)
+_skylight_header = _array_header("SkyLight", 16384)
+
+_populated_header = _tag_header(TAG_BYTE, "TerrainPopulated")
+_populated = Struct(">%dsb" % len(_populated_header))
+
+_entities_header = _tag_header(TAG_LIST, "Entities")
+_tiles_header = _tag_header(TAG_LIST, "TileEntities")
+
+# Native region records, and the side table entry of a chunk without any
+# entities or tiles.
+
+_record_size = 32768 + 16384 * 3 + 256 + 1
+_record_pages = (_record_size + 4095) // 4096
+
+_empty_side = compress(_tag_header(TAG_COMPOUND, "") + _entities_header +
+    pack(">bi", TAG_COMPOUND, 0) + _tiles_header +
+    pack(">bi", TAG_COMPOUND, 0) + "\x00")
+
+class _Deflater(object):
+    """
+    A write-only file which compresses everything written to it with zlib.
+    """
+
+    def __init__(self):
+        self._compressor = compressobj()
+        self._parts = []
+
+    def write(self, data):
+        self._parts.append(self._compressor.compress(data))
+
+    def getvalue(self):
+        """
+        Finish compressing, and get the compressed data.
+        """
+
+        self._parts.append(self._compressor.flush())
+        return "".join(self._parts)
+
 class Alpha(object):
     """
     Minecraft Alpha world serializer.
@@ -164,7 +242,8 @@ class Alpha(object):
 
     def _read_tag(self, fp):
         if fp.exists() and fp.getsize():
-            return NBTFile(fileobj=fp.open("r"))
+            with fp.open("r") as handle:
+                return parse_nbt(GzipFile(fileobj=handle).read())
         return None
 
     def _write_tag(self, fp, tag):
@@ -357,20 +436,33 @@ class Alpha(object):
         level = tag["Level"]
 
         # These are designed to raise if there are any issues, but still be
-        # speedy.
-        chunk.blocks = fromstring(level["Blocks"].value,
-            dtype=uint8).reshape(chunk.blocks.shape)
-        chunk.heightmap = fromstring(level["HeightMap"].value,
+        # speedy. The arrays are read-only views onto the NBT, which is fine,
+        # since load_arrays() copies out only the sections which aren't
+        # empty, and the nibbles stay packed the whole way.
+        blocks = frombuffer(level["Blocks"].value,
+            dtype=uint8).reshape(16, 16, 128)
+        metadata = NibbleArray((16, 16, 128),
+            frombuffer(level["Data"].value, dtype=uint8))
+        skylight = NibbleArray((16, 16, 128),
+            frombuffer(level["SkyLight"].value, dtype=uint8))
+        blocklight = NibbleArray((16, 16, 128),
+            frombuffer(level["BlockLight"].value, dtype=uint8))
+        chunk.load_arrays(blocks, metadata, skylight, blocklight)
+
+        chunk.heightmap[...] = frombuffer(level["HeightMap"].value,
             dtype=uint8).reshape(chunk.heightmap.shape)
-        chunk.blocklight = array(unpack_nibbles(
-            level["BlockLight"].value)).reshape(chunk.blocklight.shape)
-        chunk.metadata = array(unpack_nibbles(
-            level["Data"].value)).reshape(chunk.metadata.shape)
-        chunk.skylight = array(unpack_nibbles(
-            level["SkyLight"].value)).reshape(chunk.skylight.shape)
 
         chunk.populated = bool(level["TerrainPopulated"])
 
+        self._load_entities_from_tag(chunk, level)
+
+        chunk.dirty = not chunk.populated
+
+    def _load_entities_from_tag(self, chunk, level):
+        """
+        Load a chunk's entities and tiles from a tag.
+        """
+
         if "Entities" in level:
             for tag in level["Entities"].tags:
                 try:
@@ -391,8 +483,6 @@ class Alpha(object):
                     print "Tag for tile:"
                     print tag.pretty_tree()
 
-        chunk.dirty = not chunk.populated
-
     def _save_chunk_to_tag(self, chunk):
         tag = NBTFile()
         tag.name = ""
@@ -411,30 +501,78 @@ class Alpha(object):
 
         level["Blocks"].value = chunk.blocks.tostring()
         level["HeightMap"].value = chunk.heightmap.tostring()
-        level["BlockLight"].value = pack_nibbles(chunk.blocklight)
-        level["Data"].value = pack_nibbles(chunk.metadata)
-        level["SkyLight"].value = pack_nibbles(chunk.skylight)
+        level["BlockLight"].value = chunk.blocklight.tostring()
+        level["Data"].value = chunk.metadata.tostring()
+        level["SkyLight"].value = chunk.skylight.tostring()
 
         level["TerrainPopulated"] = TAG_Byte(chunk.populated)
 
-        level["Entities"] = TAG_List(type=TAG_Compound)
+        level["Entities"] = self._save_entities_to_tag(chunk)
+        level["TileEntities"] = self._save_tiles_to_tag(chunk)
+
+        return tag
+
+    def _save_entities_to_tag(self, chunk):
+        tag = TAG_List(type=TAG_Compound)
         for entity in chunk.entities:
             try:
                 entitytag = self._save_entity_to_tag(entity)
-                level["Entities"].tags.append(entitytag)
+                tag.tags.append(entitytag)
             except KeyError:
                 print "Unknown entity %s" % entity.name
 
-        level["TileEntities"] = TAG_List(type=TAG_Compound)
+        return tag
+
+    def _save_tiles_to_tag(self, chunk):
+        tag = TAG_List(type=TAG_Compound)
         for tile in chunk.tiles.itervalues():
             try:
                 tiletag = self._save_tile_to_tag(tile)
-                level["TileEntities"].tags.append(tiletag)
+                tag.tags.append(tiletag)
             except KeyError:
                 print "Unknown tile entity %s" % tile.name
 
         return tag
 
+    def _write_chunk(self, chunk, f):
+        """
+        Write a chunk's NBT to a file.
+
+        The NBT is exactly what rendering ``_save_chunk_to_tag()`` would
+        produce, but the arrays are written straight from the chunk, next to
+        headers which were rendered ahead of time, instead of being copied
+        into tags first. Only entities and tiles go through tags.
+
+        :param `Chunk` chunk: chunk to write
+        :param f: file-like object to write to
+        """
+
+        write = f.write
+
+        write(_chunk_header.pack(_chunk_prefix, chunk.x, _zpos_header,
+            chunk.z))
+
+        write(_blocks_header)
+        write(buffer(ascontiguousarray(chunk.blocks)))
+        write(_heightmap_header)
+        write(buffer(ascontiguousarray(chunk.heightmap)))
+        write(_blocklight_header)
+        write(buffer(ascontiguousarray(chunk.blocklight.packed)))
+        write(_metadata_header)
+        write(buffer(ascontiguousarray(chunk.metadata.packed)))
+        write(_skylight_header)
+        write(buffer(ascontiguousarray(chunk.skylight.packed)))
+
+        write(_populated.pack(_populated_header, chunk.populated))
+
+        write(_entities_header)
+        self._save_entities_to_tag(chunk)._render_buffer(f)
+        write(_tiles_header)
+        self._save_tiles_to_tag(chunk)._render_buffer(f)
+
+        # The ends of the Level compound and of the root compound.
+        write("\x00\x00")
+
     def _load_inventory_from_tag(self, inventory, tag):
         """
         Load an inventory from a tag.
@@ -502,8 +640,11 @@ class Alpha(object):
             raise SerializerReadException(e)
 
     def save_chunk(self, chunk):
+        b = StringIO()
         try:
-            tag = self._save_chunk_to_tag(chunk)
+            gz = GzipFile(fileobj=b, mode="wb")
+            self._write_chunk(chunk, gz)
+            gz.close()
         except Exception, e:
             raise SerializerWriteException(e)
 
@@ -513,13 +654,16 @@ class Alpha(object):
             fp.makedirs()
         fp = fp.child(filename)
 
-        self._write_tag(fp, tag)
+        fp.setContent(b.getvalue())
 
     def load_level(self, level):
         tag = self._read_tag(self.folder.child("level.dat"))
         if not tag:
             return
 
+        self._load_level_from_tag(level, tag)
+
+    def _load_level_from_tag(self, level, tag):
         try:
             level.spawn = (tag["Data"]["SpawnX"].value,
                 tag["Data"]["SpawnY"].value,
@@ -542,6 +686,9 @@ class Alpha(object):
         if not tag:
             return
 
+        self._load_player_from_tag(player, tag)
+
+    def _load_player_from_tag(self, player, tag):
         player.location.x, player.location.y, player.location.z = [
             i.value for i in tag["Pos"].tags]
 
@@ -552,6 +699,15 @@ class Alpha(object):
             self._load_inventory_from_tag(player.inventory, tag["Inventory"])
 
     def save_player(self, player):
+        tag = self._save_player_to_tag(player)
+
+        fp = self.folder.child("players")
+        if not fp.exists():
+            fp.makedirs()
+        fp = fp.child("%s.dat" % player.username)
+        self._write_tag(fp, tag)
+
+    def _save_player_to_tag(self, player):
         tag = NBTFile()
         tag.name = ""
 
@@ -565,11 +721,7 @@ class Alpha(object):
 
         tag["Inventory"] = self._save_inventory_to_tag(player.inventory)
 
-        fp = self.folder.child("players")
-        if not fp.exists():
-            fp.makedirs()
-        fp = fp.child("%s.dat" % player.username)
-        self._write_tag(fp, tag)
+        return tag
 
     def get_plugin_data_path(self, name):
         return self.folder.child(name + '.dat')
@@ -586,134 +738,126 @@ class Alpha(object):
         path = self.get_plugin_data_path(name)
         path.setContent(value)
 
-class Beta(Alpha):
-    """
-    Minecraft Beta serializer.
-
-    This serializer supports the MCRegion paged chunk files used by Minecraft
-    Beta and the MCRegion mod.
+class Region(object):
     """
+    An open MCRegion file.
 
-    classProvides(ISerializerFactory)
-
-    name = "beta"
-
-    def __init__(self, url):
-        Alpha.__init__(self, url)
+    The header is read once, when the file is opened, and is kept up to date
+    as chunks are written, along with the free extents of pages. Chunks are read
+    through a read-only memory map of the file, so that their payloads can be
+    decompressed without being copied out of the file first.
 
-        self.regions = dict()
+    Regions aren't thread-safe; use ``lock`` to take turns.
+    """
 
-    def _save_level_to_tag(self, level):
-        tag = Alpha._save_level_to_tag(self, level)
+    def __init__(self, fp):
+        """
+        :param `FilePath` fp: the region file, which must already exist
+        """
 
-        # Beta version and accounting.
-        # Needed for Notchian tools to be able to comprehend this world.
-        tag["Data"]["version"] = TAG_Int(19132)
-        tag["Data"]["LevelName"] = TAG_String("Generated by Bravo :3")
+        self.fp = fp
+        self.lock = Lock()
+        self.handle = fp.open("r+")
+        self.map = None
 
-        return tag
+        self.unsynced = False
+        self.synced = time()
 
-    def cache_region_pages(self, region):
-        """
-        Cache the pages of a region.
-        """
+        header = self.handle.read(4096)
+        self.size = os.fstat(self.handle.fileno()).st_size
 
-        fp = self.folder.child("region").child(region)
-        handle = fp.open("r")
-        page = handle.read(4096)
-        # The + 1 is not gratuitous. Remember that range/xrange won't include
-        # the upper index, but we want it, so we need to increase our upper
-        # bound. Additionally, the first page is off-limits.
-        free_pages = set(xrange(2, (fp.getsize() // 4096) + 1))
-        positions = dict()
+        # Every page past the header, and past the spare page after it, is
+        # free unless a chunk is using it.
+        self.free = Extents()
+        self.free.free(2, self.pages - 2)
+        self.positions = dict()
 
         for x in xrange(32):
             for z in xrange(32):
                 offset = 4 * (x + z * 32)
-                position = unpack(">L", page[offset:offset+4])[0]
+                position = unpack(">L", header[offset:offset+4])[0]
                 pages = position & 0xff
                 position >>= 8
                 if position and pages:
-                    positions[x, z] = position, pages
-                    for i in xrange(pages):
-                        free_pages.discard(position + i)
+                    self.positions[x, z] = position, pages
+                    self.free.reserve(position, pages)
 
-        self.regions[region] = positions, free_pages
+    def __repr__(self):
+        return "Region(%r)" % self.fp.basename()
 
-    def load_chunk(self, chunk):
-        region = name_for_region(chunk.x, chunk.z)
-        fp = self.folder.child("region").child(region)
-        if not fp.exists():
-            return
+    @property
+    def pages(self):
+        """
+        The number of pages in the file, counting a partial last page, and
+        counting pages which have been allocated but not written yet.
+        """
+
+        return (self.size + 4095) // 4096
 
-        x, z = chunk.x % 32, chunk.z % 32
+    def _mapped(self, end):
+        """
+        Make sure that the map covers the file up to ``end``.
 
-        if region not in self.regions:
-            self.cache_region_pages(region)
+        The file only ever grows, so the map is only remade when something
+        past its end is needed.
+        """
 
-        positions = self.regions[region][0]
+        if self.map is None or len(self.map) < end:
+            if self.map is not None:
+                self.map.close()
+            self.map = mmap(self.handle.fileno(), 0, access=ACCESS_READ)
 
-        if (x, z) not in positions:
-            return
+        if len(self.map) < end:
+            raise SerializerReadException("%r is truncated" % self)
 
-        position, pages = positions[x, z]
+    def read(self, x, z):
+        """
+        Read a chunk's NBT.
 
-        if not position or not pages:
-            return
+        :param int x: X coordinate of the chunk, within the region
+        :param int z: Z coordinate of the chunk, within the region
 
-        handle = fp.open("r")
-        handle.seek(position * 4096)
-        data = handle.read(pages * 4096)
-        length = unpack(">L", data[:4])[0] - 1
-        version = ord(data[4])
+        :returns: the uncompressed NBT, or None if the chunk isn't in the
+                  region
+        """
 
-        data = data[5:length+5]
-        if version == 1:
-            data = data.decode("gzip")
-            fileobj = GzipFile(fileobj=StringIO(data))
-        elif version == 2:
-            fileobj = StringIO(data.decode("zlib"))
+        if (x, z) not in self.positions:
+            return None
 
-        tag = NBTFile(buffer=fileobj)
+        position, pages = self.positions[x, z]
+        start = position * 4096
 
-        return self._load_chunk_from_tag(chunk, tag)
+        self._mapped(start + 5)
+        length = unpack_from(">L", self.map, start)[0] - 1
+        version = ord(self.map[start + 4])
 
-    def save_chunk(self, chunk):
-        tag = self._save_chunk_to_tag(chunk)
-        b = StringIO()
-        tag.write_file(buffer=b)
-        data = b.getvalue().encode("zlib")
+        self._mapped(start + 5 + length)
+        data = buffer(self.map, start + 5, length)
 
-        region = name_for_region(chunk.x, chunk.z)
-        fp = self.folder.child("region")
-        if not fp.exists():
-            fp.makedirs()
-        fp = fp.child(region)
-        if not fp.exists():
-            # Create the file and zero out the header, plus a spare page for
-            # Notchian software.
-            handle = fp.open("w")
-            handle.write("\x00" * 8192)
-            handle.close()
+        if version == 1:
+            return GzipFile(fileobj=StringIO(str(data))).read()
+        elif version == 2:
+            return decompress(data)
+        else:
+            raise SerializerReadException("Unknown compression %d in %r" %
+                (version, self))
 
-        if region not in self.regions:
-            self.cache_region_pages(region)
+    def _allocate(self, x, z, needed_pages, freed):
+        """
+        Find a home for a chunk which needs a certain number of pages.
 
-        positions = self.regions[region][0]
+        The pages which the chunk is moving out of aren't freed yet, since
+        the header on disk still points at them; they're added to ``freed``,
+        to be freed once the new header has been written.
 
-        x, z = chunk.x % 32, chunk.z % 32
+        :returns: position of the chunk's new home
+        """
 
-        if (x, z) in positions:
-            position, pages = positions[x, z]
+        if (x, z) in self.positions:
+            position, pages = self.positions[x, z]
         else:
             position, pages = 0, 0
 
-        # Pack up the data, all ready to go.
-        data = "%s\x02%s" % (pack(">L", len(data) + 1), data)
-        needed_pages = (len(data) + 4095) // 4096
-
-        handle = fp.open("r+")
-
         # I should comment this, since it's not obvious in the original MCR
         # code either. The reason that we might want to reallocate pages if we
         # have shrunk, and not just grown, is that it allows the region to
@@ -723,42 +867,1256 @@ class Beta(Alpha):
         # method we *will* be blocking, makes it worthwhile computationally.
         # This is a lot cheaper than an explicit vacuum, by the way!
         if not position or not pages or pages != needed_pages:
-            free_pages = self.regions[region][1]
+            # Leave our current home, and find the snuggest new home; if
+            # there isn't one, go to the end of the file.
+            if position and pages:
+                freed.append((position, pages))
+            position = self.free.allocate(needed_pages, self.pages)
+
+        # Chunks at the end of the file grow it, and the next chunk to go to
+        # the end has to go after them, even before they've been written.
+        self.size = max(self.size, (position + needed_pages) * 4096)
+
+        return position
+
+    def write(self, x, z, data):
+        """
+        Write a chunk's compressed NBT.
+
+        :param int x: X coordinate of the chunk, within the region
+        :param int z: Z coordinate of the chunk, within the region
+        :param str data: the NBT, compressed with zlib
+
+        :returns: number of bytes written
+        """
+
+        return self.commit([(x, z, data)])
+
+    def commit(self, writes, sync=False):
+        """
+        Write many chunks' compressed NBT, as a group.
+
+        Every chunk is given a home first, and then the payloads are written
+        in the order in which they're laid out in the file, followed by the
+        whole header in one go. Pages which chunks moved out of aren't reused
+        until the header which no longer points at them has been written, and
+        nothing changes if any of the writes fail.
+
+        :param list writes: tuples of X and Z coordinates, within the region,
+                            and NBT compressed with zlib
+        :param bool sync: whether to wait for the writes to reach the disk
 
-            # Deallocate our current home.
-            for i in xrange(pages):
-                free_pages.add(position + i)
+        :returns: number of bytes written
+        """
+
+        # Only the last write of each chunk counts.
+        latest = {}
+        for x, z, data in writes:
+            latest[x, z] = data
+
+        positions = {}
+        payloads = []
+        allocated = []
+        freed = []
+
+        for (x, z), data in latest.iteritems():
+            # Pack up the data, all ready to go.
+            data = "%s\x02%s" % (pack(">L", len(data) + 1), data)
+            pages = (len(data) + 4095) // 4096
+            position = self._allocate(x, z, pages, freed)
+
+            if self.positions.get((x, z)) != (position, pages):
+                allocated.append((position, pages))
+            positions[x, z] = position, pages
+            payloads.append((position, data))
+
+        merged = dict(self.positions)
+        merged.update(positions)
+
+        header = [0] * 1024
+        for (x, z), (position, pages) in merged.iteritems():
+            header[x + z * 32] = position << 8 | pages
+
+        written = 0
 
-            # Find a new home for us.
-            found = False
-            for candidate in sorted(free_pages):
-                if all(candidate + i in free_pages
-                    for i in range(needed_pages)):
-                        # Excellent.
-                        position = candidate
-                        found = True
-                        break
+        try:
+            for position, data in sorted(payloads):
+                self.handle.seek(position * 4096)
+                self.handle.write(data)
+                written += len(data)
+
+            self.handle.seek(0)
+            self.handle.write(pack(">1024L", *header))
+            written += 4096
+
+            # The map reads from the OS, not from our buffer.
+            self.handle.flush()
+        except:
+            # None of the new homes are used by anything on disk.
+            for position, pages in allocated:
+                self.free.free(position, pages)
+            raise
+
+        self.positions = merged
+        self.unsynced = True
 
-            # If we couldn't find a reusable run of pages, we should just go
-            # to the end of the file.
-            if not found:
-                position = (fp.getsize() + 4095) // 4096
+        if sync:
+            self.sync()
 
-            # And allocate our new home.
-            for i in xrange(needed_pages):
-                free_pages.discard(position + i)
+        # Only now can the old homes be given to other chunks.
+        for position, pages in freed:
+            self.free.free(position, pages)
 
-        pages = needed_pages
+        return written
 
-        positions[x, z] = position, pages
+    def sync(self):
+        """
+        Wait for everything written so far to reach the disk.
+        """
 
-        # Write our payload.
-        handle.seek(position * 4096)
-        handle.write(data)
+        self.handle.flush()
+        os.fsync(self.handle.fileno())
+        self.unsynced = False
+        self.synced = time()
+
+    def _write_position(self, x, z):
+        """
+        Write a chunk's position and page count into the header.
+        """
 
-        # Write our position and page count.
+        position, pages = self.positions[x, z]
         offset = 4 * (x + z * 32)
-        position = position << 8 | pages
-        handle.seek(offset)
-        handle.write(pack(">L", position))
-        handle.close()
+        self.handle.seek(offset)
+        self.handle.write(pack(">L", position << 8 | pages))
+
+    def _move(self, x, z, target):
+        """
+        Move a chunk to another spot in the file.
+
+        The chunk is copied and synced before the header is pointed at the
+        copy, and the header is synced before anything can overwrite the old
+        copy, so that the header always points at a whole chunk.
+        """
+
+        position, pages = self.positions[x, z]
+
+        self.handle.seek(position * 4096)
+        data = self.handle.read(pages * 4096)
+        self.handle.seek(target * 4096)
+        self.handle.write(data)
+        self.sync()
+
+        self.positions[x, z] = target, pages
+        self._write_position(x, z)
+        self.sync()
+
+    def compact(self):
+        """
+        Defragment the file.
+
+        Chunks are moved, in order, as close to the start of the file as they
+        can go, and the free space left over at the end is cut off. A chunk
+        which would overlap its own old pages is first moved past the end of
+        the file, so that no chunk is ever overwritten while the header still
+        points at it.
+
+        :returns: number of pages freed
+        """
+
+        before = self.pages
+        end = 2
+
+        for (x, z), (position, pages) in sorted(self.positions.iteritems(),
+            key=lambda t: t[1][0]):
+            if position != end:
+                if position < end + pages:
+                    tail = max(self.pages, position + pages)
+                    self._move(x, z, tail)
+                    self.size = (tail + pages) * 4096
+                self._move(x, z, end)
+
+            end += pages
+
+        # The map can't outlive the end of the file.
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+        self.handle.flush()
+        self.handle.truncate(end * 4096)
+        self.size = end * 4096
+        self.free.clear()
+
+        return before - end
+
+    def close(self):
+        """
+        Close the file.
+        """
+
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        self.handle.close()
+
+class NativeRegion(object):
+    """
+    An open native region file, along with its side table.
+
+    Every chunk in a native region has a fixed-size record, holding its
+    blocks, metadata, skylight, block light, and height map, uncompressed,
+    followed by whether it's populated. Records are read through a read-only
+    memory map of the file, straight into arrays. Chunks keep the same record
+    forever, and records are overwritten in place, so the file never has
+    any holes in it.
+
+    Entities and tiles don't fit in fixed-size records; they're stored as NBT
+    in the side table, which is an MCRegion file. Chunks without any
+    entities or tiles usually don't have an entry in it at all.
+
+    The header is a single page, with a big-endian record number, counting
+    from one, for each chunk; zero means that the chunk isn't in the region.
+
+    Regions aren't thread-safe; use ``lock`` to take turns.
+    """
+
+    def __init__(self, fp, side):
+        """
+        :param `FilePath` fp: the region file, which must already exist
+        :param `FilePath` side: the side table, which must already exist
+        """
+
+        self.fp = fp
+        self.lock = Lock()
+        self.handle = fp.open("r+")
+        self.map = None
+        self.side = Region(side)
+
+        self.unsynced = False
+        self.synced = time()
+
+        header = unpack(">1024L", self.handle.read(4096))
+
+        # Positions are kept as page numbers and page counts, just like in
+        # MCRegion files, so that both kinds of region can be put in disk
+        # order the same way.
+        self.records = 0
+        self.positions = dict()
+
+        for i, record in enumerate(header):
+            if record:
+                self.positions[i % 32, i // 32] = (
+                    1 + (record - 1) * _record_pages, _record_pages)
+                self.records = max(self.records, record)
+
+    def __repr__(self):
+        return "NativeRegion(%r)" % self.fp.basename()
+
+    @property
+    def free(self):
+        """
+        The free extents of the side table; the records never have any.
+        """
+
+        return self.side.free
+
+    @property
+    def pages(self):
+        """
+        The number of pages in the side table.
+        """
+
+        return self.side.pages
+
+    def _mapped(self, end):
+        """
+        Make sure that the map covers the file up to ``end``.
+
+        Arrays read out of an old map keep it alive for as long as they're
+        around, so old maps are let go of instead of being closed.
+        """
+
+        if self.map is None or len(self.map) < end:
+            self.map = mmap(self.handle.fileno(), 0, access=ACCESS_READ)
+
+        if len(self.map) < end:
+            raise SerializerReadException("%r is truncated" % self)
+
+    def read(self, x, z):
+        """
+        Read a chunk's record.
+
+        The arrays are read-only views onto the file.
+
+        :param int x: X coordinate of the chunk, within the region
+        :param int z: Z coordinate of the chunk, within the region
+
+        :returns: tuple of blocks, metadata, skylight, block light, height
+                  map, and whether the chunk is populated, or None if the
+                  chunk isn't in the region
+        """
+
+        if (x, z) not in self.positions:
+            return None
+
+        position, pages = self.positions[x, z]
+        start = position * 4096
+
+        self._mapped(start + _record_size)
+        m = self.map
+
+        blocks = frombuffer(m, dtype=uint8, count=32768,
+            offset=start).reshape(16, 16, 128)
+        metadata = NibbleArray((16, 16, 128), frombuffer(m, dtype=uint8,
+            count=16384, offset=start + 32768))
+        skylight = NibbleArray((16, 16, 128), frombuffer(m, dtype=uint8,
+            count=16384, offset=start + 49152))
+        blocklight = NibbleArray((16, 16, 128), frombuffer(m, dtype=uint8,
+            count=16384, offset=start + 65536))
+        heightmap = frombuffer(m, dtype=uint8, count=256,
+            offset=start + 81920).reshape(16, 16)
+        populated = m[start + 82176] != "\x00"
+
+        return blocks, metadata, skylight, blocklight, heightmap, populated
+
+    def read_side(self, x, z):
+        """
+        Read a chunk's entities and tiles.
+
+        :returns: the uncompressed NBT, or None if the chunk doesn't have an
+                  entry in the side table
+        """
+
+        return self.side.read(x, z)
+
+    def commit(self, writes, sync=False):
+        """
+        Write many chunks, as a group.
+
+        Every chunk is given a record first, and then the records are written
+        in order, followed by the header if any records were added, and then
+        the side table is committed.
+
+        :param list writes: tuples of X and Z coordinates, within the region,
+                            and pairs of the pieces of the record and the
+                            compressed NBT for the side table, or None
+        :param bool sync: whether to wait for the writes to reach the disk
+
+        :returns: number of bytes written
+        """
+
+        added = False
+        records = []
+        sides = []
+
+        for x, z, (pieces, side) in writes:
+            if (x, z) not in self.positions:
+                self.positions[x, z] = (1 + self.records * _record_pages,
+                    _record_pages)
+                self.records += 1
+                added = True
+
+            records.append((self.positions[x, z][0], pieces))
+
+            # Chunks which lost all of their entities and tiles need their
+            # old ones overwritten.
+            if side is None and (x, z) in self.side.positions:
+                side = _empty_side
+            if side is not None:
+                sides.append((x, z, side))
+
+        written = 0
+
+        for position, pieces in sorted(records):
+            self.handle.seek(position * 4096)
+            for piece in pieces:
+                self.handle.write(piece)
+                written += len(piece)
+
+        if added:
+            header = [0] * 1024
+            for (x, z), (position, pages) in self.positions.iteritems():
+                header[x + z * 32] = (position - 1) // _record_pages + 1
+            self.handle.seek(0)
+            self.handle.write(pack(">1024L", *header))
+            written += 4096
+
+        # The map reads from the OS, not from our buffer.
+        self.handle.flush()
+        self.unsynced = True
+
+        if sides:
+            written += self.side.commit(sides)
+
+        if sync:
+            self.sync()
+
+        return written
+
+    def sync(self):
+        """
+        Wait for everything written so far to reach the disk.
+        """
+
+        self.handle.flush()
+        os.fsync(self.handle.fileno())
+        self.side.sync()
+        self.unsynced = False
+        self.synced = time()
+
+    def compact(self):
+        """
+        Defragment the side table.
+
+        :returns: number of pages freed
+        """
+
+        return self.side.compact()
+
+    def close(self):
+        """
+        Close the file and the side table.
+        """
+
+        self.map = None
+        self.handle.close()
+        self.side.close()
+
+class Beta(Alpha):
+    """
+    Minecraft Beta serializer.
+
+    This serializer supports the MCRegion paged chunk files used by Minecraft
+    Beta and the MCRegion mod.
+
+    Region files are kept open, up to ``open_regions`` of them, so that
+    loading and saving chunks doesn't mean opening a file and reading its
+    header every time. Regions which are being used are never closed; the
+    least recently used of the rest are closed to make room.
+    """
+
+    classProvides(ISerializerFactory)
+
+    name = "beta"
+
+    open_regions = 16
+    """
+    The most region files to keep open while they aren't being used.
+    """
+
+    compact_ratio = 0.5
+    """
+    Regions are compacted after a save leaves more than this fraction of their
+    pages free...
+    """
+
+    compact_pages = 64
+    """
+    ...and at least this many pages free.
+    """
+
+    fsync = "none"
+    """
+    When to wait for writes to reach the disk: "none" leaves it up to the
+    OS, "batch" waits after every commit, and "interval" waits after a
+    commit once ``fsync_interval`` seconds have passed since the region was
+    last synced, and also syncs regions which were written to and then left
+    alone, every ``fsync_interval`` seconds. Regions with writes outstanding
+    are synced before they're evicted, unless this is "none", and are always
+    synced by ``close()``.
+    """
+
+    fsync_interval = 5
+    """
+    How many seconds to let writes sit before syncing them, with the
+    "interval" policy.
+    """
+
+    saves_by_region = True
+    """
+    Chunks are committed a region at a time, so saves are best handed over
+    grouped by region.
+    """
+
+    region_folder = "region"
+    """
+    The folder, inside the world, which holds the region files.
+    """
+
+    region_pattern = "r.*.*.mcr"
+    """
+    A glob which matches the names of region files.
+    """
+
+    def __init__(self, url):
+        Alpha.__init__(self, url)
+
+        self.regions = LRUCache(self.open_regions)
+        self._regions_lock = Lock()
+        self._region_users = dict()
+        self._syncer = None
+
+        self.bytes_written = 0
+        self.commits = 0
+        self.commit_time = 0.0
+
+        self.chunks_read = 0
+        self.read_time = 0.0
+        self.decode_time = 0.0
+
+    def _save_level_to_tag(self, level):
+        tag = Alpha._save_level_to_tag(self, level)
+
+        # Beta version and accounting.
+        # Needed for Notchian tools to be able to comprehend this world.
+        tag["Data"]["version"] = TAG_Int(19132)
+        tag["Data"]["LevelName"] = TAG_String("Generated by Bravo :3")
+
+        return tag
+
+    @contextmanager
+    def region(self, name):
+        """
+        Use a region, opening it if it isn't already open.
+
+        The region is locked, and can't be closed, until the block is done.
+
+        :param str name: name of the region file, which must exist
+        """
+
+        with self._regions_lock:
+            region = self.regions.get(name)
+            if region is None:
+                region = self._open_region(name)
+                self.regions[name] = region
+            self._region_users[name] = self._region_users.get(name, 0) + 1
+            self.regions.pin(name)
+
+        try:
+            with region.lock:
+                yield region
+        finally:
+            with self._regions_lock:
+                self._region_users[name] -= 1
+                if not self._region_users[name]:
+                    del self._region_users[name]
+                    self.regions.unpin(name)
+
+                for chaff, evicted in self.regions.evict():
+                    self._close_region(evicted)
+
+    def _region_name(self, x, z):
+        return name_for_region(x, z)
+
+    def _region_file(self, name):
+        return self.folder.child(self.region_folder).child(name)
+
+    def _open_region(self, name):
+        return Region(self._region_file(name))
+
+    def _create_region(self, name):
+        """
+        Create an empty region file.
+        """
+
+        # Zero out the header, plus a spare page for Notchian software.
+        handle = self._region_file(name).open("w")
+        handle.write("\x00" * 8192)
+        handle.close()
+
+    def _close_region(self, region):
+        if region.unsynced and self.fsync != "none":
+            region.sync()
+        region.close()
+
+    def close(self):
+        """
+        Sync and close every region file.
+
+        Regions are opened again if they're needed afterwards.
+        """
+
+        with self._regions_lock:
+            if self._syncer is not None:
+                if self._syncer.running:
+                    self._syncer.stop()
+                self._syncer = None
+
+            for region in self.regions.values():
+                with region.lock:
+                    if region.unsynced:
+                        region.sync()
+                    region.close()
+            self.regions.clear()
+
+    def sync_regions(self, idle=0):
+        """
+        Sync the open regions which have writes outstanding.
+
+        :param float idle: only sync regions which haven't been synced for
+                           at least this many seconds
+        """
+
+        with self._regions_lock:
+            names = self.regions.keys()
+
+        for name in names:
+            with self._regions_lock:
+                if name not in self.regions:
+                    continue
+
+            with self.region(name) as r:
+                if r.unsynced and time() - r.synced >= idle:
+                    r.sync()
+
+    def _start_syncing(self):
+        """
+        Start syncing idle regions, with the "interval" policy.
+
+        Regions are only synced by commits, so a region which is written to
+        once and then left alone would never be synced otherwise.
+        """
+
+        with self._regions_lock:
+            if self._syncer is not None or self.fsync != "interval":
+                return
+            self._syncer = LoopingCall(self._sync_idle)
+
+        # Looping calls belong to the reactor, and saves usually aren't done
+        # on its thread.
+        reactor.callFromThread(self._start_syncer, self._syncer)
+
+    def _start_syncer(self, syncer):
+        # The serializer might've been closed in the meantime.
+        if syncer is self._syncer and not syncer.running:
+            syncer.start(self.fsync_interval, now=False)
+
+    def _sync_idle(self):
+        d = deferToThread(self.sync_regions, self.fsync_interval)
+        d.addErrback(log.err)
+        return d
+
+    def disk_order(self, chunks):
+        """
+        Sort chunks into the order in which they're laid out on disk.
+
+        Chunks are sorted by region, and then by their offset in the region.
+        Chunks which aren't on disk come last.
+
+        :param list chunks: chunks to sort
+
+        :returns: list of the chunks, sorted
+        """
+
+        regions = {}
+        for chunk in chunks:
+            name = self._region_name(chunk.x, chunk.z)
+            regions.setdefault(name, []).append(chunk)
+
+        ordered = []
+        missing = []
+
+        for name in sorted(regions):
+            fp = self._region_file(name)
+            if not fp.exists():
+                missing.extend(regions[name])
+                continue
+
+            with self.region(name) as r:
+                positions = r.positions
+                keyed = []
+                for chunk in regions[name]:
+                    key = chunk.x % 32, chunk.z % 32
+                    if key in positions:
+                        keyed.append((positions[key][0], chunk))
+                    else:
+                        missing.append(chunk)
+
+            keyed.sort(key=lambda t: t[0])
+            ordered.extend(chunk for position, chunk in keyed)
+
+        return ordered + missing
+
+    def stored_chunks(self):
+        """
+        Find every chunk which is stored in this world.
+
+        :returns: iterator of X and Z coordinates of chunks, a region at a
+                  time, in the order in which they're laid out in the region
+        """
+
+        fp = self.folder.child(self.region_folder)
+        if not fp.exists():
+            return
+
+        for child in sorted(fp.globChildren(self.region_pattern)):
+            name = child.basename()
+            rx, rz = (int(i) for i in name.split(".")[1:3])
+
+            with self.region(name) as r:
+                positions = sorted(r.positions.iteritems(),
+                    key=lambda t: t[1][0])
+
+            for (x, z), chaff in positions:
+                yield rx * 32 + x, rz * 32 + z
+
+    def load_chunk(self, chunk):
+        region = self._region_name(chunk.x, chunk.z)
+        if not self._region_file(region).exists():
+            return
+
+        before = time()
+        with self.region(region) as r:
+            data = r.read(chunk.x % 32, chunk.z % 32)
+        read = time()
+
+        if data is None:
+            return
+
+        tag = parse_nbt(data)
+        self._load_chunk_from_tag(chunk, tag)
+        after = time()
+
+        with self._regions_lock:
+            self.chunks_read += 1
+            self.read_time += read - before
+            self.decode_time += after - read
+
+    def save_chunk(self, chunk):
+        self.save_chunks([chunk])
+
+    def save_chunks(self, chunks):
+        """
+        Save many chunks.
+
+        The chunks in each region are committed as a group: all of their
+        payloads are written, and then the region's header is written once.
+        Whether the commit waits for the disk depends on ``fsync``.
+
+        :param list chunks: chunks to save
+        """
+
+        regions = {}
+        for chunk in chunks:
+            region = self._region_name(chunk.x, chunk.z)
+            regions.setdefault(region, []).append(
+                (chunk.x % 32, chunk.z % 32, self._payload(chunk)))
+
+        fp = self.folder.child(self.region_folder)
+        if not fp.exists():
+            fp.makedirs()
+
+        for region, writes in regions.iteritems():
+            if not self._region_file(region).exists():
+                self._create_region(region)
+
+            with self.region(region) as r:
+                before = time()
+                written = r.commit(writes, self._should_sync(r))
+                after = time()
+
+                # Chunks which change size are moved around, leaving holes
+                # behind them; once there are enough holes, they're squeezed
+                # out. Since this is only ever done by a save, it happens
+                # wherever saves happen, which is usually off of the main
+                # thread.
+                free = len(r.free)
+                if (free >= self.compact_pages and
+                    free > r.pages * self.compact_ratio):
+                    freed = r.compact()
+                    log.msg("Compacted %r, freeing %d pages" % (r, freed))
+
+            with self._regions_lock:
+                self.bytes_written += written
+                self.commits += 1
+                self.commit_time += after - before
+
+        if self.fsync == "interval":
+            self._start_syncing()
+
+    def _payload(self, chunk):
+        """
+        Get what a region needs to commit a chunk.
+        """
+
+        deflater = _Deflater()
+        self._write_chunk(chunk, deflater)
+        return deflater.getvalue()
+
+    def _should_sync(self, region):
+        if self.fsync == "batch":
+            return True
+        elif self.fsync == "interval":
+            return time() - region.synced >= self.fsync_interval
+        return False
+
+    def write_stats(self):
+        """
+        Get statistics on writing chunks.
+
+        :returns: dict of the bytes written, the number of commits, and the
+                  average time per commit
+        """
+
+        with self._regions_lock:
+            if self.commits:
+                commit_time = self.commit_time / self.commits
+            else:
+                commit_time = 0.0
+
+            return {
+                "bytes_written": self.bytes_written,
+                "commits": self.commits,
+                "commit_time": commit_time,
+            }
+
+    def read_stats(self):
+        """
+        Get statistics on reading chunks.
+
+        Reading a chunk's data out of its region, and inflating it, is timed
+        separately from decoding it into the chunk.
+
+        :returns: dict of the number of chunks read, and the average times to
+                  read and to decode a chunk
+        """
+
+        with self._regions_lock:
+            if self.chunks_read:
+                read_time = self.read_time / self.chunks_read
+                decode_time = self.decode_time / self.chunks_read
+            else:
+                read_time = decode_time = 0.0
+
+            return {
+                "read": self.chunks_read,
+                "read_time": read_time,
+                "decode_time": decode_time,
+            }
+
+    def compact_region(self, name):
+        """
+        Defragment a region file.
+
+        :param str name: name of the region file
+
+        :returns: number of pages freed
+        """
+
+        if not self._region_file(name).exists():
+            return 0
+
+        with self.region(name) as r:
+            return r.compact()
+
+class Native(Beta):
+    """
+    Native world serializer.
+
+    This serializer stores chunks uncompressed, in fixed-size records in
+    memory-mapped region files, so that loading a chunk is only a matter of
+    copying its arrays out of the map, without inflating or parsing anything.
+    It trades disk space, and compatibility with Notchian tools, for load
+    latency; tools/nativeconvert.py converts worlds to and from MCRegion.
+
+    Level, player, and plugin data are stored just as the Beta serializer
+    stores them.
+    """
+
+    classProvides(ISerializerFactory)
+
+    name = "native"
+
+    region_folder = "native"
+    region_pattern = "r.*.*.bnr"
+
+    def _region_name(self, x, z):
+        return name_for_native_region(x, z)
+
+    def _side_file(self, name):
+        return self._region_file(name).sibling(name[:-4] + ".bne")
+
+    def _open_region(self, name):
+        return NativeRegion(self._region_file(name), self._side_file(name))
+
+    def _create_region(self, name):
+        handle = self._region_file(name).open("w")
+        handle.write("\x00" * 4096)
+        handle.close()
+
+        handle = self._side_file(name).open("w")
+        handle.write("\x00" * 8192)
+        handle.close()
+
+    def load_chunk(self, chunk):
+        region = self._region_name(chunk.x, chunk.z)
+        if not self._region_file(region).exists():
+            return
+
+        before = time()
+        with self.region(region) as r:
+            record = r.read(chunk.x % 32, chunk.z % 32)
+            read = time()
+
+            if record is None:
+                return
+
+            blocks, metadata, skylight, blocklight, heightmap, populated = record
+            chunk.load_arrays(blocks, metadata, skylight, blocklight)
+            chunk.heightmap[...] = heightmap
+
+            side = r.read_side(chunk.x % 32, chunk.z % 32)
+
+        if side is not None:
+            self._load_entities_from_tag(chunk, parse_nbt(side))
+
+        chunk.populated = populated
+        chunk.dirty = not chunk.populated
+        after = time()
+
+        with self._regions_lock:
+            self.chunks_read += 1
+            self.read_time += read - before
+            self.decode_time += after - read
+
+    def _payload(self, chunk):
+        pieces = [
+            buffer(ascontiguousarray(chunk.blocks)),
+            buffer(ascontiguousarray(chunk.metadata.packed)),
+            buffer(ascontiguousarray(chunk.skylight.packed)),
+            buffer(ascontiguousarray(chunk.blocklight.packed)),
+            buffer(ascontiguousarray(chunk.heightmap)),
+            chr(chunk.populated),
+        ]
+
+        if chunk.entities or chunk.tiles:
+            tag = NBTFile()
+            tag.name = ""
+            tag["Entities"] = self._save_entities_to_tag(chunk)
+            tag["TileEntities"] = self._save_tiles_to_tag(chunk)
+
+            deflater = _Deflater()
+            tag.write_file(buffer=deflater)
+            side = deflater.getvalue()
+        else:
+            side = None
+
+        return pieces, side
+
+class _DatabaseThread(object):
+    """
+    A thread with a database connection of its own, which runs queries
+    handed to it, one at a time.
+
+    The thread is started the first time that it's needed.
+    """
+
+    def __init__(self, connect):
+        """
+        :param callable connect: makes a connection, in the thread
+        """
+
+        self.connect = connect
+
+        self._lock = Lock()
+        self._jobs = Queue()
+        self._thread = None
+
+    def call(self, f, *args):
+        """
+        Run ``f(connection, *args)`` in the thread, and wait for it.
+
+        :returns: the result of ``f``, or raises whatever ``f`` raised
+        """
+
+        with self._lock:
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name="database")
+                self._thread.daemon = True
+                self._thread.start()
+
+        done = Event()
+        result = []
+        self._jobs.put((f, args, done, result))
+        done.wait()
+
+        ok, value = result[0]
+        if not ok:
+            raise value[0], value[1], value[2]
+        return value
+
+    def _run(self):
+        connection = self.connect()
+
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+
+            f, args, done, result = job
+            try:
+                result.append((True, f(connection, *args)))
+            except:
+                result.append((False, sys.exc_info()))
+            done.set()
+
+        connection.close()
+
+    def stop(self):
+        """
+        Finish any outstanding queries, close the connection, and stop the
+        thread.
+        """
+
+        with self._lock:
+            thread, self._thread = self._thread, None
+
+        if thread is not None:
+            self._jobs.put(None)
+            thread.join()
+
+def _fetch_value(connection, statement, args):
+    row = connection.execute(statement, args).fetchone()
+    if row is None:
+        return None
+    return row[0]
+
+_schema = [
+    """CREATE TABLE IF NOT EXISTS chunks (x INTEGER NOT NULL,
+        z INTEGER NOT NULL, data BLOB NOT NULL, PRIMARY KEY (x, z))""",
+    """CREATE TABLE IF NOT EXISTS players (name TEXT PRIMARY KEY,
+        data BLOB NOT NULL)""",
+    """CREATE TABLE IF NOT EXISTS level (id INTEGER PRIMARY KEY,
+        data BLOB NOT NULL)""",
+    """CREATE TABLE IF NOT EXISTS plugins (name TEXT PRIMARY KEY,
+        data BLOB NOT NULL)""",
+]
+
+class Sqlite(Alpha):
+    """
+    SQLite world serializer.
+
+    This serializer keeps an entire world in a single SQLite database:
+    chunks, as compressed NBT, along with players, the level, and plugin
+    data. The chunks saved together are saved in a single transaction, so
+    saves are atomic, and backing up a world only means copying one file.
+
+    Reads are done by a thread of their own, with its own connection, and
+    writes take turns on another connection. The database uses write-ahead
+    logging, so reads don't have to wait for writes.
+    """
+
+    classProvides(ISerializerFactory)
+
+    name = "sqlite"
+
+    def __init__(self, url):
+        Alpha.__init__(self, url)
+
+        self.path = self.folder.child("world.sqlite").path
+
+        self._reader = _DatabaseThread(self._connect)
+        self._writer = None
+        self._write_lock = Lock()
+        self._stats_lock = Lock()
+
+        self.bytes_written = 0
+        self.commits = 0
+        self.commit_time = 0.0
+
+        self.chunks_read = 0
+        self.read_time = 0.0
+        self.decode_time = 0.0
+
+        # Make sure that the tables exist before anything is read.
+        with self._write_lock:
+            self._writing()
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        connection.text_factory = str
+        return connection
+
+    def _writing(self):
+        """
+        Get the connection for writing, connecting if necessary.
+
+        The write lock must be held.
+        """
+
+        if self._writer is None:
+            self._writer = self._connect()
+            self._writer.execute("PRAGMA journal_mode = WAL")
+            with self._writer:
+                for statement in _schema:
+                    self._writer.execute(statement)
+
+        return self._writer
+
+    def _read(self, statement, *args):
+        """
+        Read a single value, in the reading thread.
+
+        :returns: the value, or None if there wasn't a row
+        """
+
+        return self._reader.call(_fetch_value, statement, args)
+
+    def _write(self, statement, rows):
+        """
+        Write some rows, in a single transaction.
+        """
+
+        with self._write_lock:
+            connection = self._writing()
+            with connection:
+                connection.executemany(statement, rows)
+
+    def _compress_tag(self, tag):
+        deflater = _Deflater()
+        tag.write_file(buffer=deflater)
+        return buffer(deflater.getvalue())
+
+    def close(self):
+        """
+        Close the database.
+
+        The database is opened again if it's needed afterwards.
+        """
+
+        self._reader.stop()
+
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+    def write_stats(self):
+        """
+        Get statistics on writing chunks.
+
+        :returns: dict of the bytes written, the number of commits, and the
+                  average time per commit
+        """
+
+        with self._stats_lock:
+            if self.commits:
+                commit_time = self.commit_time / self.commits
+            else:
+                commit_time = 0.0
+
+            return {
+                "bytes_written": self.bytes_written,
+                "commits": self.commits,
+                "commit_time": commit_time,
+            }
+
+    def read_stats(self):
+        """
+        Get statistics on reading chunks.
+
+        :returns: dict of the number of chunks read, and the average times to
+                  read and to decode a chunk
+        """
+
+        with self._stats_lock:
+            if self.chunks_read:
+                read_time = self.read_time / self.chunks_read
+                decode_time = self.decode_time / self.chunks_read
+            else:
+                read_time = decode_time = 0.0
+
+            return {
+                "read": self.chunks_read,
+                "read_time": read_time,
+                "decode_time": decode_time,
+            }
+
+    # ISerializer API.
+
+    def load_chunk(self, chunk):
+        before = time()
+        data = self._read("SELECT data FROM chunks WHERE x = ? AND z = ?",
+            chunk.x, chunk.z)
+        read = time()
+
+        if data is None:
+            return
+
+        try:
+            tag = parse_nbt(decompress(data))
+            self._load_chunk_from_tag(chunk, tag)
+        except Exception, e:
+            raise SerializerReadException(e)
+        after = time()
+
+        with self._stats_lock:
+            self.chunks_read += 1
+            self.read_time += read - before
+            self.decode_time += after - read
+
+    def save_chunk(self, chunk):
+        self.save_chunks([chunk])
+
+    def save_chunks(self, chunks):
+        """
+        Save many chunks, in a single transaction.
+
+        :param list chunks: chunks to save
+        """
+
+        rows = []
+        for chunk in chunks:
+            deflater = _Deflater()
+            try:
+                self._write_chunk(chunk, deflater)
+            except Exception, e:
+                raise SerializerWriteException(e)
+            rows.append((chunk.x, chunk.z, buffer(deflater.getvalue())))
+
+        before = time()
+        self._write("INSERT OR REPLACE INTO chunks (x, z, data) "
+            "VALUES (?, ?, ?)", rows)
+        after = time()
+
+        with self._stats_lock:
+            self.bytes_written += sum(len(data) for x, z, data in rows)
+            self.commits += 1
+            self.commit_time += after - before
+
+    def load_level(self, level):
+        data = self._read("SELECT data FROM level WHERE id = 0")
+        if data is None:
+            return
+
+        self._load_level_from_tag(level, parse_nbt(decompress(data)))
+
+    def save_level(self, level):
+        tag = self._save_level_to_tag(level)
+
+        self._write("INSERT OR REPLACE INTO level (id, data) VALUES (0, ?)",
+            [(self._compress_tag(tag),)])
+
+    def load_player(self, player):
+        data = self._read("SELECT data FROM players WHERE name = ?",
+            player.username)
+        if data is None:
+            return
+
+        self._load_player_from_tag(player, parse_nbt(decompress(data)))
+
+    def save_player(self, player):
+        tag = self._save_player_to_tag(player)
+
+        self._write("INSERT OR REPLACE INTO players (name, data) "
+            "VALUES (?, ?)", [(player.username, self._compress_tag(tag))])
+
+    def load_plugin_data(self, name):
+        data = self._read("SELECT data FROM plugins WHERE name = ?", name)
+        if data is None:
+            return ""
+        return str(data)
+
+    def save_plugin_data(self, name, value):
+        self._write("INSERT OR REPLACE INTO plugins (name, data) "
+            "VALUES (?, ?)", [(name, buffer(value))])
@@ -1,6 +1,7 @@
 from zope.interface import implements
 
 from bravo.blocks import blocks
+from bravo.errors import ChunkNotLoaded
 from bravo.ibravo import IPreBuildHook, IDigHook
 
 tracks_allowed_on = set([
@@ -53,6 +54,23 @@ CORNER_NW = 0x7 # Northwest corner
 CORNER_NE = 0x8 # Northeast corner
 CORNER_SE = 0x9 # Southeast corner
 
+def track_metadata(world, coords):
+    """
+    Get the metadata of the tracks at some coordinates.
+
+    Tracks can run up to the edge of the loaded world; blocks in chunks which
+    aren't loaded are treated as not being tracks.
+
+    :returns: metadata, or None if there aren't any tracks there
+    """
+
+    try:
+        if world.sync_get_block(coords) != blocks["tracks"].slot:
+            return None
+        return world.sync_get_metadata(coords)
+    except ChunkNotLoaded:
+        return None
+
 class Tracks(object):
     """
     Build and dig hooks for mine cart tracks.
@@ -81,7 +99,7 @@ class Tracks(object):
             return True, builddata
 
         # Check for correct underground
-        if world.get_block((x, y - 1, z)) not in tracks_allowed_on:
+        if world.sync_get_block((x, y - 1, z)) not in tracks_allowed_on:
             return False, builddata
 
         # Use facing direction of player to set correct track tile
@@ -96,34 +114,30 @@ class Tracks(object):
             metadata = CORNER_NE
         elif 60 <= yaw <= 120 or 240 <= yaw <= 300:
             # north or south
-            if world.get_block((x - 1, y + 1, z)) == blocks["tracks"].slot:
+            if track_metadata(world, (x - 1, y + 1, z)) is not None:
                 metadata = ASCEND_N
-            elif world.get_block((x + 1, y + 1, z)) == blocks["tracks"].slot:
+            elif track_metadata(world, (x + 1, y + 1, z)) is not None:
                 metadata = ASCEND_S
             else:
                 metadata = FLAT_NS
             # check and adjust ascending tracks
-            if world.get_block((x - 1, y - 1, z)) == blocks["tracks"].slot:
-                if world.get_metadata((x - 1, y - 1, z)) == FLAT_NS:
-                    world.set_metadata((x - 1, y - 1, z), ASCEND_S)
-            if world.get_block((x + 1, y - 1, z)) == blocks["tracks"].slot:
-                if world.get_metadata((x + 1, y - 1, z)) == FLAT_NS:
-                    world.set_metadata((x + 1, y - 1, z), ASCEND_N)
+            if track_metadata(world, (x - 1, y - 1, z)) == FLAT_NS:
+                world.sync_set_metadata((x - 1, y - 1, z), ASCEND_S)
+            if track_metadata(world, (x + 1, y - 1, z)) == FLAT_NS:
+                world.sync_set_metadata((x + 1, y - 1, z), ASCEND_N)
         else: # (0, 30) or (330, 0)
             # east or west
-            if world.get_block((x, y + 1, z + 1)) == blocks["tracks"].slot:
+            if track_metadata(world, (x, y + 1, z + 1)) is not None:
                 metadata = ASCEND_W
-            elif world.get_block((x, y + 1, z - 1)) == blocks["tracks"].slot:
+            elif track_metadata(world, (x, y + 1, z - 1)) is not None:
                 metadata = ASCEND_E
             else:
                 metadata = FLAT_EW
             # check and adjust ascending tracks
-            if world.get_block((x, y - 1, z - 1)) == blocks["tracks"].slot:
-                if world.get_metadata((x, y - 1, z - 1)) == FLAT_EW:
-                    world.set_metadata((x, y - 1, z - 1), ASCEND_W)
-            if world.get_block((x, y - 1, z + 1)) == blocks["tracks"].slot:
-                if world.get_metadata((x, y - 1, z + 1)) == FLAT_EW:
-                    world.set_metadata((x, y - 1, z + 1), ASCEND_E)
+            if track_metadata(world, (x, y - 1, z - 1)) == FLAT_EW:
+                world.sync_set_metadata((x, y - 1, z - 1), ASCEND_W)
+            if track_metadata(world, (x, y - 1, z + 1)) == FLAT_EW:
+                world.sync_set_metadata((x, y - 1, z + 1), ASCEND_E)
         builddata = builddata._replace(metadata=metadata)
         return True, builddata
 
@@ -140,10 +154,10 @@ class Tracks(object):
                              (0, 1, 0)):
             # Get affected chunk
             coords = (x + dx, y + dy, z + dz)
-            if world.get_block(coords) != blocks["tracks"].slot:
+            metadata = track_metadata(world, coords)
+            if metadata is None:
                 continue
             # Check if descending
-            metadata = world.get_metadata(coords)
             if dx == 1 and metadata != ASCEND_N:
                 continue
             elif dx == -1 and metadata != ASCEND_S:
@@ -153,7 +167,7 @@ class Tracks(object):
             elif dz == -1 and metadata != ASCEND_W:
                 continue
             # Remove track and metadata
-            world.destroy(coords)
+            world.sync_destroy(coords)
             # Drop track on ground - needs pixel coordinates
             pixcoords = ((x + dx) * 32 + 16, (y + 1) * 32, (z + dz) * 32 + 16)
             factory.give(pixcoords, (blocks["tracks"].slot, 0), 1)
@@ -5,8 +5,8 @@ from urlparse import urlunparse
 from math import pi
 
 from twisted.internet import reactor
-from twisted.internet.defer import (DeferredList, inlineCallbacks,
-    maybeDeferred, succeed)
+from twisted.internet.defer import (CancelledError, DeferredList,
+    inlineCallbacks, maybeDeferred, succeed)
 from twisted.internet.protocol import Protocol
 from twisted.internet.task import cooperate, deferLater, LoopingCall
 from twisted.internet.task import TaskDone, TaskFailed
@@ -423,6 +423,8 @@ class BravoProtocol(BetaServerProtocol):
 
     chunk_tasks = None
 
+    chunk_requests = None
+
     time_loop = None
 
     eid = 0
@@ -1010,7 +1012,7 @@ class BravoProtocol(BetaServerProtocol):
 
     def disable_chunk(self, x, z):
         # Remove the chunk from cache.
-        chunk = self.chunks.pop(x, z)
+        chunk = self.chunks.pop((x, z))
 
         for entity in chunk.entities:
             packet = make_packet("destroy", eid=entity.eid)
@@ -1024,7 +1026,8 @@ class BravoProtocol(BetaServerProtocol):
         Request a chunk.
 
         This function will asynchronously obtain the chunk, and send it on the
-        wire.
+        wire. The request can be withdrawn with ``cancel_chunk()`` until the
+        chunk arrives.
 
         :returns: `Deferred` that will be fired when the chunk is obtained,
                   with no arguments
@@ -1033,11 +1036,54 @@ class BravoProtocol(BetaServerProtocol):
         if (x, z) in self.chunks:
             return succeed(None)
 
-        d = self.factory.world.request_chunk(x, z)
+        return self._chunk_requested(x, z,
+            self.factory.world.request_chunk(x, z))
+
+    def enable_chunks(self, coords):
+        """
+        Request many chunks at once.
+
+        Chunks are obtained and sent just like with ``enable_chunk()``, but
+        the world gets to load them in whichever order is quickest.
+
+        :returns: list of `Deferred`s that will be fired when each chunk is
+                  obtained, with no arguments
+        """
+
+        coords = [(x, z) for x, z in coords if (x, z) not in self.chunks]
+        requests = self.factory.world.request_chunks(coords)
+
+        return [self._chunk_requested(x, z, requests[x, z])
+            for x, z in coords]
+
+    def _chunk_requested(self, x, z, d):
+        """
+        Keep track of a chunk request, and send the chunk when it arrives.
+        """
+
+        if self.chunk_requests is None:
+            self.chunk_requests = {}
+
+        self.chunk_requests[x, z] = d
+
+        def obtained(result):
+            self.chunk_requests.pop((x, z), None)
+            return result
+        d.addBoth(obtained)
+
         d.addCallback(self.send_chunk)
+        d.addErrback(lambda failure: failure.trap(CancelledError))
 
         return d
 
+    def cancel_chunk(self, x, z):
+        """
+        Withdraw a request for a chunk which hasn't been obtained yet.
+        """
+
+        if self.chunk_requests and (x, z) in self.chunk_requests:
+            self.chunk_requests.pop((x, z)).cancel()
+
     def send_chunk(self, chunk):
         packet = make_packet("prechunk", x=chunk.x, z=chunk.z, enabled=1)
         self.transport.write(packet)
@@ -1063,13 +1109,12 @@ class BravoProtocol(BetaServerProtocol):
         # Spawn the 25 chunks in a square around the spawn, *before* spawning
         # the player. Otherwise, there's a funky Beta 1.2 bug which causes the
         # player to not be able to move.
-        d = cooperate(
-            self.enable_chunk(i, j)
-            for i, j in product(
+        d = DeferredList(self.enable_chunks(
+            product(
                 xrange(bigx - 3, bigx + 3),
                 xrange(bigz - 3, bigz + 3)
             )
-        ).whenDone()
+        ))
 
         # Don't dare send more chunks beyond the initial one until we've
         # spawned.
@@ -1102,16 +1147,25 @@ class BravoProtocol(BetaServerProtocol):
 
         new = set((i + x, j + z) for i, j in circle)
         old = set(self.chunks.iterkeys())
-        added = new - old
+        requested = set(self.chunk_requests or ())
+        added = new - old - requested
         discarded = old - new
 
+        # The world generates chunks nearest to players first, so let it know
+        # where we are. Chunks which we asked for, but which are now out of
+        # range, aren't needed any longer; if nobody else wants them either,
+        # the world won't bother generating them.
+        self.factory.world.set_interest(self, x, z)
+
+        for i, j in requested - new:
+            self.cancel_chunk(i, j)
+
         # Perhaps some explanation is in order.
         # The cooperate() function iterates over the iterable it is fed,
-        # without tying up the reactor, by yielding after each iteration. The
-        # inner part of the generator expression generates all of the chunks
-        # around the currently needed chunk, and it sorts them by distance to
-        # the current chunk. The end result is that we load chunks one-by-one,
-        # nearest to furthest, without stalling other clients.
+        # without tying up the reactor, by yielding after each iteration.
+        # Chunks are requested all at once, and the world takes care of loading
+        # and generating them without stalling other clients, nearest first;
+        # the chunks which we no longer need are dropped one-by-one.
         if self.chunk_tasks:
             for task in self.chunk_tasks:
                 try:
@@ -1119,12 +1173,10 @@ class BravoProtocol(BetaServerProtocol):
                 except (TaskDone, TaskFailed):
                     pass
 
-        self.chunk_tasks = [cooperate(task) for task in
-            (
-                self.enable_chunk(i, j) for i, j in
-                sorted(added, key=lambda t: (t[0] - x)**2 + (t[1] - z)**2)
-            ),
-            (self.disable_chunk(i, j) for i, j in discarded)
+        self.enable_chunks(added)
+
+        self.chunk_tasks = [
+            cooperate(self.disable_chunk(i, j) for i, j in discarded)
         ]
 
     def update_time(self):
@@ -1142,7 +1194,12 @@ class BravoProtocol(BetaServerProtocol):
                 except (TaskDone, TaskFailed):
                     pass
 
+        if self.chunk_requests:
+            for x, z in self.chunk_requests.keys():
+                self.cancel_chunk(x, z)
+
         if self.player:
+            self.factory.world.clear_interest(self)
             self.factory.world.save_player(self.username, self.player)
             self.factory.destroy_entity(self.player)
             packet = make_packet("destroy", eid=self.player.eid)
@@ -1,59 +1,267 @@
-from ampoule import AMPChild
-import ampoule.pool
+from collections import deque
+from ctypes import c_ubyte
+from multiprocessing import Pool
+from multiprocessing.sharedctypes import RawArray
+from traceback import format_exc
 
-from twisted.protocols.amp import ListOf, Command, Integer, String
+from numpy import frombuffer, uint8
+
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, TimeoutError
+from twisted.python import log
 
 from bravo.chunk import Chunk
 from bravo.ibravo import ITerrainGenerator
 from bravo.plugin import retrieve_sorted_plugins
+from bravo.utilities.bits import NibbleArray
+
+"""
+Chunk generation in other processes.
+
+Generated chunks are handed back to the server through slots in a block of
+shared memory, rather than being serialized and sent over a pipe. Each slot
+holds one chunk's worth of full-height arrays, in the same layout that
+``Chunk`` uses, so that the server can copy the sections of the chunk
+directly out of the slot.
+"""
 
-class MakeChunk(Command):
-    arguments = [
-        ("x", Integer()),
-        ("z", Integer()),
-        ("seed", Integer()),
-        ("generators", ListOf(String())),
-    ]
-    response = [
-        ("blocks", String()),
-        ("metadata", String()),
-        ("skylight", String()),
-        ("blocklight", String()),
-        ("heightmap", String()),
-    ]
-    errors = {
-        Exception: "Exception",
-    }
+SLOT_SIZE = 32768 + 16384 * 3 + 256
+"""
+The size of a slot, in bytes: blocks, metadata, skylight, block light, and
+the heightmap.
+"""
 
-class Slave(AMPChild):
+def slot_arrays(arena, slot):
     """
-    Process-based peon for processing and populating.
+    Get views onto the arrays of a slot.
+
+    :param arena: shared memory holding all of the slots
+    :param int slot: index of the slot
+
+    :returns: tuple of blocks, metadata, skylight, block light, and heightmap
     """
 
-    def make_chunk(self, x, z, seed, generators):
-        """
-        Create a chunk using the given parameters.
-        """
+    base = frombuffer(arena, dtype=uint8, count=SLOT_SIZE,
+        offset=slot * SLOT_SIZE)
+
+    blocks = base[:32768].reshape(16, 16, 128)
+    metadata = NibbleArray((16, 16, 128), base[32768:49152])
+    skylight = NibbleArray((16, 16, 128), base[49152:65536])
+    blocklight = NibbleArray((16, 16, 128), base[65536:81920])
+    heightmap = base[81920:].reshape(16, 16)
+
+    return blocks, metadata, skylight, blocklight, heightmap
 
-        generators = retrieve_sorted_plugins(ITerrainGenerator, generators)
+# These are only set in the worker processes.
+_arena = None
+_pipelines = {}
+
+def _initialize(arena):
+    global _arena
+    _arena = arena
+
+def make_chunk(slot, x, z, seed, generators):
+    """
+    Create a chunk using the given parameters, and put it into a slot.
+
+    This runs in the worker processes.
+
+    :returns: None, or a traceback if the chunk couldn't be made
+    """
+
+    try:
+        if generators not in _pipelines:
+            _pipelines[generators] = retrieve_sorted_plugins(
+                ITerrainGenerator, generators)
 
         chunk = Chunk(x, z)
 
-        for stage in generators:
+        for stage in _pipelines[generators]:
             stage.populate(chunk, seed)
 
+        # Spreading light is expensive, so it's done here rather than on the
+        # server.
         chunk.regenerate()
 
-        return {
-            "blocks": chunk.blocks.tostring(),
-            "metadata": chunk.metadata.tostring(),
-            "skylight": chunk.skylight.tostring(),
-            "blocklight": chunk.blocklight.tostring(),
-            "heightmap": chunk.heightmap.tostring(),
-        }
+        blocks, metadata, skylight, blocklight, heightmap = slot_arrays(
+            _arena, slot)
+        blocks[...] = chunk.blocks
+        metadata.packed[...] = chunk.metadata.packed
+        skylight.packed[...] = chunk.skylight.packed
+        blocklight.packed[...] = chunk.blocklight.packed
+        heightmap[...] = chunk.heightmap
+    except Exception:
+        return format_exc()
+
+class GenerationPool(object):
+    """
+    A pool of processes for generating chunks.
+
+    There are a couple of slots for every process, so that the processes
+    don't have to wait for the server to pick up their chunks before moving
+    on. Chunks which are waiting for a slot are generated in the order in
+    which they were asked for, and can be cancelled until they get one.
+
+    A chunk which takes longer than ``timeout`` to generate is given up on,
+    and the processes are replaced, since one of them has probably died;
+    the other chunks being generated are started over.
+
+    :ivar int generated: number of chunks generated
+    """
+
+    timeout = 60
+    """
+    How many seconds to wait for a chunk before giving up on it.
+    """
+
+    def __init__(self, size, slots=None):
+        """
+        :param int size: number of processes
+        :param int slots: number of slots; by default, twice the number of
+                          processes
+        """
+
+        self.size = size
+        self.slots = slots or size * 2
+
+        self.arena = RawArray(c_ubyte, self.slots * SLOT_SIZE)
+        self.free = range(self.slots)
+        self.waiting = deque()
+        self.running = {}
+
+        self.pool = None
+        self.generated = 0
+
+    def start(self):
+        """
+        Start the processes.
+
+        This is done automatically the first time that a chunk is generated,
+        but it's better to do it early, before the server has started any
+        threads. The processes are stopped when the reactor shuts down.
+        """
+
+        if self.pool is not None:
+            return
+
+        self.pool = Pool(self.size, _initialize, (self.arena,))
+        reactor.addSystemEventTrigger("after", "shutdown", self.stop)
+
+    def stop(self):
+        """
+        Stop the processes, abandoning any chunks being generated.
+        """
+
+        for job, timer in self.running.itervalues():
+            timer.cancel()
+        self.running.clear()
+
+        if self.pool is not None:
+            pool, self.pool = self.pool, None
+            pool.terminate()
+            pool.join()
+
+    def generate(self, chunk, seed, generators):
+        """
+        Generate a chunk.
+
+        :param `Chunk` chunk: chunk to fill
+        :param int seed: world seed
+        :param list generators: names of the terrain generators to use
+
+        :returns: ``Deferred`` which fires with the chunk
+        """
+
+        self.start()
+
+        d = Deferred(self._cancel)
+        self.waiting.append((chunk, seed, tuple(generators), d))
+        self._dispatch()
+
+        return d
+
+    def _cancel(self, d):
+        for i, job in enumerate(self.waiting):
+            if job[3] is d:
+                del self.waiting[i]
+                break
+
+    def _dispatch(self):
+        if self.pool is None:
+            return
+
+        while self.free and self.waiting:
+            job = chunk, seed, generators, d = self.waiting.popleft()
+            if d.called:
+                continue
+
+            slot = self.free.pop()
+
+            # Python 2's pools never report workers dying, so the callback
+            # might never come.
+            timer = reactor.callLater(self.timeout, self._timed_out, slot)
+            self.running[slot] = job, timer
+
+            def callback(error, slot=slot, timer=timer):
+                # This runs in one of the pool's threads.
+                reactor.callFromThread(self._finished, error, slot, timer)
+
+            self.pool.apply_async(make_chunk,
+                (slot, chunk.x, chunk.z, seed, generators), callback=callback)
+
+    def _timed_out(self, slot):
+        job, timer = self.running.pop(slot)
+        chunk, seed, generators, d = job
+
+        log.msg("Generating %s timed out; replacing the processes" % chunk)
+
+        # Whatever the old processes were doing, they can't be allowed to
+        # keep writing into the slots, so they're stopped, and every other
+        # chunk that they were generating goes back to the front of the line.
+        for other, other_timer in self.running.itervalues():
+            other_timer.cancel()
+            self.waiting.appendleft(other)
+        self.running.clear()
+
+        self.pool.terminate()
+        self.pool.join()
+        self.pool = Pool(self.size, _initialize, (self.arena,))
+        self.free = range(self.slots)
+
+        self._dispatch()
+
+        if not d.called:
+            d.errback(TimeoutError("Generating %s timed out" % chunk))
+
+    def _finished(self, error, slot, timer):
+        # Every attempt at a chunk has its own timer. Attempts which timed
+        # out, or which were started over, were already given up on, and
+        # their slots might have been reused since.
+        if slot not in self.running or self.running[slot][1] is not timer:
+            return
+
+        job, timer = self.running.pop(slot)
+        timer.cancel()
+        chunk, seed, generators, d = job
+
+        # Chunks which were cancelled while they were being generated are
+        # simply dropped.
+        if error is None and not d.called:
+            blocks, metadata, skylight, blocklight, heightmap = slot_arrays(
+                self.arena, slot)
+            chunk.load_arrays(blocks, metadata, skylight, blocklight)
+            chunk.heightmap = heightmap.copy()
+            self.generated += 1
+
+        self.free.append(slot)
+        self._dispatch()
 
-    MakeChunk.responder(make_chunk)
+        if d.called:
+            return
 
-ampoule.pool.pp = ampoule.pool.ProcessPool(
-    ampChild=Slave,
-)
+        if error is None:
+            d.callback(chunk)
+        else:
+            log.msg("Couldn't generate %s:" % chunk)
+            log.msg(error)
+            d.errback(RuntimeError("Couldn't generate %s" % chunk))
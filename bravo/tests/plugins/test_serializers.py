@@ -1,3 +1,4 @@
+from StringIO import StringIO
 import unittest
 import shutil
 import tempfile
@@ -5,6 +6,7 @@ import tempfile
 from twisted.python.filepath import FilePath
 
 import bravo.chunk
+import bravo.entity
 import bravo.plugins.serializers
 from bravo.nbt import TAG_Compound, TAG_List, TAG_String
 from bravo.nbt import TAG_Double, TAG_Byte, TAG_Short
@@ -39,6 +41,13 @@ class TestBetaUtilities(unittest.TestCase):
         self.assertEqual(bravo.plugins.serializers.name_for_region(70, -30),
             "r.2.-1.mcr")
 
+class TestNativeUtilities(unittest.TestCase):
+
+    def test_name_for_native_region(self):
+        self.assertEqual(
+            bravo.plugins.serializers.name_for_native_region(70, -30),
+            "r.2.-1.bnr")
+
 class TestAlphaSerializerInit(unittest.TestCase):
 
     def test_not_url(self):
@@ -90,6 +99,22 @@ class TestAlphaSerializer(unittest.TestCase):
         self.assertEqual(tag["Level"]["xPos"].value, 1)
         self.assertEqual(tag["Level"]["zPos"].value, 2)
 
+    def test_write_chunk(self):
+        chunk = bravo.chunk.Chunk(1, 2)
+        chunk.set_block((1, 2, 3), 4)
+        chunk.set_metadata((1, 2, 3), 5)
+        chunk.populated = True
+        sign = bravo.entity.Sign(17, 2, 35)
+        sign.text1 = "Hello"
+        chunk.tiles[17, 2, 35] = sign
+
+        expected = StringIO()
+        self.serializer._save_chunk_to_tag(chunk).write_file(buffer=expected)
+        written = StringIO()
+        self.serializer._write_chunk(chunk, written)
+
+        self.assertEqual(written.getvalue(), expected.getvalue())
+
     def test_save_data(self):
         data = 'Foo\nbar'
         self.serializer.save_plugin_data('plugin1', data)
@@ -101,3 +126,405 @@ class TestAlphaSerializer(unittest.TestCase):
         data = 'Foo\nbar'
         self.serializer.save_plugin_data('plugin1', data)
         self.assertEqual(self.serializer.load_plugin_data('plugin1'), data)
+
+class TestBetaSerializer(unittest.TestCase):
+
+    def setUp(self):
+        self.d = tempfile.mkdtemp()
+        self.folder = FilePath(self.d)
+        self.serializer = bravo.plugins.serializers.Beta('file://' + self.folder.path)
+
+    def tearDown(self):
+        self.serializer.close()
+        shutil.rmtree(self.d)
+
+    def test_trivial(self):
+        pass
+
+    def test_load_missing_region(self):
+        chunk = bravo.chunk.Chunk(1, 2)
+        self.serializer.load_chunk(chunk)
+        self.assertFalse(chunk.populated)
+        self.assertEqual(len(self.serializer.regions), 0)
+
+    def test_load_missing_chunk(self):
+        self.serializer.save_chunk(bravo.chunk.Chunk(1, 2))
+        chunk = bravo.chunk.Chunk(2, 1)
+        self.serializer.load_chunk(chunk)
+        self.assertFalse(chunk.populated)
+
+    def test_save_load_chunk(self):
+        chunk = bravo.chunk.Chunk(1, 2)
+        chunk.set_block((1, 2, 3), 4)
+        chunk.populated = True
+        self.serializer.save_chunk(chunk)
+
+        loaded = bravo.chunk.Chunk(1, 2)
+        self.serializer.load_chunk(loaded)
+        self.assertTrue(loaded.populated)
+        self.assertEqual(loaded.get_block((1, 2, 3)), 4)
+
+    def test_load_chunk_empty_sections(self):
+        """
+        Empty sections of loaded chunks aren't copied out of the region.
+        """
+
+        chunk = bravo.chunk.Chunk(1, 2)
+        chunk.set_block((1, 2, 3), 4)
+        chunk.populated = True
+        self.serializer.save_chunk(chunk)
+
+        loaded = bravo.chunk.Chunk(1, 2)
+        self.serializer.load_chunk(loaded)
+        self.assertTrue(loaded.sections[7] is bravo.chunk.EMPTY)
+
+        loaded.set_block((1, 2, 4), 5)
+        self.assertEqual(loaded.get_block((1, 2, 4)), 5)
+
+    def test_read_stats(self):
+        self.serializer.save_chunk(bravo.chunk.Chunk(1, 2))
+        self.serializer.load_chunk(bravo.chunk.Chunk(1, 2))
+
+        stats = self.serializer.read_stats()
+        self.assertEqual(stats["read"], 1)
+        self.assertTrue(stats["decode_time"] >= 0)
+
+    def test_save_load_chunk_reopened(self):
+        chunk = bravo.chunk.Chunk(1, 2)
+        chunk.set_block((1, 2, 3), 4)
+        chunk.populated = True
+        self.serializer.save_chunk(chunk)
+        self.serializer.close()
+
+        serializer = bravo.plugins.serializers.Beta('file://' + self.folder.path)
+        loaded = bravo.chunk.Chunk(1, 2)
+        serializer.load_chunk(loaded)
+        serializer.close()
+        self.assertEqual(loaded.get_block((1, 2, 3)), 4)
+
+    def test_save_grows_map(self):
+        """
+        Chunks written after a region was mapped can still be read.
+        """
+
+        first = bravo.chunk.Chunk(1, 2)
+        first.populated = True
+        self.serializer.save_chunk(first)
+        self.serializer.load_chunk(bravo.chunk.Chunk(1, 2))
+
+        second = bravo.chunk.Chunk(2, 2)
+        second.set_block((1, 2, 3), 4)
+        second.populated = True
+        self.serializer.save_chunk(second)
+
+        loaded = bravo.chunk.Chunk(2, 2)
+        self.serializer.load_chunk(loaded)
+        self.assertEqual(loaded.get_block((1, 2, 3)), 4)
+
+    def test_regions_kept_open(self):
+        for i in range(3):
+            self.serializer.save_chunk(bravo.chunk.Chunk(i, 0))
+        self.assertEqual(len(self.serializer.regions), 1)
+
+    def test_regions_bounded(self):
+        self.serializer.regions.size = 2
+        regions = []
+        for i in range(3):
+            self.serializer.save_chunk(bravo.chunk.Chunk(i * 32, 0))
+            regions.append(self.serializer.regions.peek(
+                bravo.plugins.serializers.name_for_region(i * 32, 0)))
+
+        self.assertEqual(len(self.serializer.regions), 2)
+        self.assertTrue(regions[0].handle.closed)
+        self.assertFalse(regions[2].handle.closed)
+
+    def test_disk_order(self):
+        for x in (3, 1, 2):
+            self.serializer.save_chunk(bravo.chunk.Chunk(x, 0))
+
+        chunks = [bravo.chunk.Chunk(x, 0) for x in (1, 2, 3, 4)]
+        ordered = self.serializer.disk_order(chunks)
+        self.assertEqual([chunk.x for chunk in ordered], [3, 1, 2, 4])
+
+    def test_save_reuses_pages(self):
+        self.serializer.save_chunk(bravo.chunk.Chunk(1, 0))
+        self.serializer.save_chunk(bravo.chunk.Chunk(2, 0))
+        self.serializer.save_chunk(bravo.chunk.Chunk(1, 0))
+        with self.serializer.region("r.0.0.mcr") as r:
+            self.assertEqual(len(r.free), 0)
+
+    def test_commit_keeps_freed_pages(self):
+        self.serializer.save_chunk(bravo.chunk.Chunk(1, 0))
+        with self.serializer.region("r.0.0.mcr") as r:
+            old = r.positions[1, 0]
+
+            # The first chunk grows out of its pages, and a new chunk which
+            # would fit in them is written alongside it.
+            r.commit([(1, 0, "\x00" * 5000), (2, 0, "\x00" * 100)])
+
+            self.assertNotEqual(r.positions[1, 0][0], old[0])
+            self.assertNotEqual(r.positions[2, 0][0], old[0])
+            self.assertTrue(old[0] in r.free)
+
+    def test_compact_region(self):
+        chunk = bravo.chunk.Chunk(1, 0)
+        chunk.set_block((1, 2, 3), 4)
+        chunk.populated = True
+        self.serializer.save_chunk(bravo.chunk.Chunk(0, 0))
+        self.serializer.save_chunk(chunk)
+
+        # Leave a hole where the first chunk was.
+        with self.serializer.region("r.0.0.mcr") as r:
+            r.free.free(*r.positions.pop((0, 0)))
+            r.handle.seek(0)
+            r.handle.write("\x00" * 4)
+
+        self.assertEqual(self.serializer.compact_region("r.0.0.mcr"), 1)
+        self.serializer.close()
+
+        loaded = bravo.chunk.Chunk(1, 0)
+        self.serializer.load_chunk(loaded)
+        self.assertEqual(loaded.get_block((1, 2, 3)), 4)
+        with self.serializer.region("r.0.0.mcr") as r:
+            self.assertEqual(r.positions[1, 0][0], 2)
+            self.assertEqual(len(r.free), 0)
+
+    def test_save_chunks(self):
+        chunks = [bravo.chunk.Chunk(x, 0) for x in (0, 1, 40)]
+        for chunk in chunks:
+            chunk.set_block((1, 2, 3), chunk.x + 1)
+            chunk.populated = True
+        self.serializer.save_chunks(chunks)
+
+        # One commit for each region.
+        stats = self.serializer.write_stats()
+        self.assertEqual(stats["commits"], 2)
+        self.assertTrue(stats["bytes_written"] > 0)
+
+        for x in (0, 1, 40):
+            loaded = bravo.chunk.Chunk(x, 0)
+            self.serializer.load_chunk(loaded)
+            self.assertEqual(loaded.get_block((1, 2, 3)), x + 1)
+
+    def test_save_chunks_fsync(self):
+        self.serializer.fsync = "batch"
+        self.serializer.save_chunk(bravo.chunk.Chunk(0, 0))
+        with self.serializer.region("r.0.0.mcr") as r:
+            self.assertFalse(r.unsynced)
+
+    def test_stored_chunks(self):
+        self.serializer.save_chunks([bravo.chunk.Chunk(x, z)
+            for x, z in ((0, 0), (1, 0), (-1, 40))])
+        self.assertEqual(sorted(self.serializer.stored_chunks()),
+            [(-1, 40), (0, 0), (1, 0)])
+
+    def test_save_chunks_no_fsync(self):
+        self.serializer.save_chunk(bravo.chunk.Chunk(0, 0))
+        with self.serializer.region("r.0.0.mcr") as r:
+            self.assertTrue(r.unsynced)
+
+    def test_sync_regions(self):
+        self.serializer.save_chunk(bravo.chunk.Chunk(0, 0))
+        self.serializer.sync_regions()
+        with self.serializer.region("r.0.0.mcr") as r:
+            self.assertFalse(r.unsynced)
+
+    def test_sync_regions_idle(self):
+        self.serializer.save_chunk(bravo.chunk.Chunk(0, 0))
+        self.serializer.sync_regions(idle=60)
+        with self.serializer.region("r.0.0.mcr") as r:
+            self.assertTrue(r.unsynced)
+
+    def test_save_chunks_fsync_interval(self):
+        """
+        Idle regions are synced on a timer with the "interval" policy.
+        """
+
+        self.serializer.fsync = "interval"
+        self.serializer.save_chunk(bravo.chunk.Chunk(0, 0))
+        self.assertTrue(self.serializer._syncer is not None)
+
+        self.serializer.close()
+        self.assertTrue(self.serializer._syncer is None)
+
+class TestNativeSerializer(unittest.TestCase):
+
+    def setUp(self):
+        self.d = tempfile.mkdtemp()
+        self.folder = FilePath(self.d)
+        self.serializer = bravo.plugins.serializers.Native('file://' + self.folder.path)
+
+    def tearDown(self):
+        self.serializer.close()
+        shutil.rmtree(self.d)
+
+    def test_trivial(self):
+        pass
+
+    def test_load_missing_region(self):
+        chunk = bravo.chunk.Chunk(1, 2)
+        self.serializer.load_chunk(chunk)
+        self.assertFalse(chunk.populated)
+        self.assertEqual(len(self.serializer.regions), 0)
+
+    def test_load_missing_chunk(self):
+        self.serializer.save_chunk(bravo.chunk.Chunk(1, 2))
+        chunk = bravo.chunk.Chunk(2, 1)
+        self.serializer.load_chunk(chunk)
+        self.assertFalse(chunk.populated)
+
+    def test_save_load_chunk(self):
+        chunk = bravo.chunk.Chunk(1, 2)
+        chunk.set_block((1, 2, 3), 4)
+        chunk.set_metadata((1, 2, 3), 5)
+        chunk.populated = True
+        self.serializer.save_chunk(chunk)
+
+        loaded = bravo.chunk.Chunk(1, 2)
+        self.serializer.load_chunk(loaded)
+        self.assertTrue(loaded.populated)
+        self.assertEqual(loaded.get_block((1, 2, 3)), 4)
+        self.assertEqual(loaded.get_metadata((1, 2, 3)), 5)
+        self.assertTrue(loaded.sections[7] is bravo.chunk.EMPTY)
+
+    def test_save_load_chunk_reopened(self):
+        chunk = bravo.chunk.Chunk(1, 2)
+        chunk.set_block((1, 2, 3), 4)
+        chunk.populated = True
+        self.serializer.save_chunk(chunk)
+        self.serializer.close()
+
+        serializer = bravo.plugins.serializers.Native('file://' + self.folder.path)
+        loaded = bravo.chunk.Chunk(1, 2)
+        serializer.load_chunk(loaded)
+        serializer.close()
+        self.assertEqual(loaded.get_block((1, 2, 3)), 4)
+
+    def test_save_overwrites_record(self):
+        """
+        Chunks keep their records when they're saved again.
+        """
+
+        chunk = bravo.chunk.Chunk(1, 2)
+        self.serializer.save_chunk(chunk)
+        size = self.folder.child("native").child("r.0.0.bnr").getsize()
+
+        chunk.set_block((1, 2, 3), 4)
+        self.serializer.save_chunk(chunk)
+        self.assertEqual(
+            self.folder.child("native").child("r.0.0.bnr").getsize(), size)
+
+        loaded = bravo.chunk.Chunk(1, 2)
+        self.serializer.load_chunk(loaded)
+        self.assertEqual(loaded.get_block((1, 2, 3)), 4)
+
+    def test_save_load_tiles(self):
+        chunk = bravo.chunk.Chunk(1, 2)
+        sign = bravo.entity.Sign(17, 2, 35)
+        sign.text1 = "Hello"
+        chunk.tiles[17, 2, 35] = sign
+        self.serializer.save_chunk(chunk)
+
+        loaded = bravo.chunk.Chunk(1, 2)
+        self.serializer.load_chunk(loaded)
+        self.assertEqual(loaded.tiles[17, 2, 35].text1, "Hello")
+
+        # Tiles which are gone stay gone.
+        del chunk.tiles[17, 2, 35]
+        self.serializer.save_chunk(chunk)
+
+        loaded = bravo.chunk.Chunk(1, 2)
+        self.serializer.load_chunk(loaded)
+        self.assertEqual(loaded.tiles, {})
+
+    def test_stored_chunks(self):
+        self.serializer.save_chunks([bravo.chunk.Chunk(x, z)
+            for x, z in ((0, 0), (1, 0), (-1, 40))])
+        self.assertEqual(sorted(self.serializer.stored_chunks()),
+            [(-1, 40), (0, 0), (1, 0)])
+
+    def test_disk_order(self):
+        for x in (3, 1, 2):
+            self.serializer.save_chunk(bravo.chunk.Chunk(x, 0))
+
+        chunks = [bravo.chunk.Chunk(x, 0) for x in (1, 2, 3, 4)]
+        ordered = self.serializer.disk_order(chunks)
+        self.assertEqual([chunk.x for chunk in ordered], [3, 1, 2, 4])
+
+class TestSqliteSerializer(unittest.TestCase):
+
+    def setUp(self):
+        self.d = tempfile.mkdtemp()
+        self.folder = FilePath(self.d)
+        self.serializer = bravo.plugins.serializers.Sqlite('file://' + self.folder.path)
+
+    def tearDown(self):
+        self.serializer.close()
+        shutil.rmtree(self.d)
+
+    def test_trivial(self):
+        pass
+
+    def test_load_missing_chunk(self):
+        chunk = bravo.chunk.Chunk(1, 2)
+        self.serializer.load_chunk(chunk)
+        self.assertFalse(chunk.populated)
+
+    def test_save_load_chunk(self):
+        chunk = bravo.chunk.Chunk(1, 2)
+        chunk.set_block((1, 2, 3), 4)
+        chunk.populated = True
+        self.serializer.save_chunk(chunk)
+
+        loaded = bravo.chunk.Chunk(1, 2)
+        self.serializer.load_chunk(loaded)
+        self.assertTrue(loaded.populated)
+        self.assertEqual(loaded.get_block((1, 2, 3)), 4)
+
+    def test_save_load_chunk_reopened(self):
+        chunk = bravo.chunk.Chunk(1, 2)
+        chunk.set_block((1, 2, 3), 4)
+        chunk.populated = True
+        self.serializer.save_chunk(chunk)
+        self.serializer.close()
+
+        serializer = bravo.plugins.serializers.Sqlite('file://' + self.folder.path)
+        loaded = bravo.chunk.Chunk(1, 2)
+        serializer.load_chunk(loaded)
+        serializer.close()
+        self.assertEqual(loaded.get_block((1, 2, 3)), 4)
+
+    def test_save_chunks(self):
+        chunks = [bravo.chunk.Chunk(x, 0) for x in range(3)]
+        for chunk in chunks:
+            chunk.set_block((1, 2, 3), chunk.x + 1)
+        self.serializer.save_chunks(chunks)
+        self.assertEqual(self.serializer.write_stats()["commits"], 1)
+
+        for x in range(3):
+            loaded = bravo.chunk.Chunk(x, 0)
+            self.serializer.load_chunk(loaded)
+            self.assertEqual(loaded.get_block((1, 2, 3)), x + 1)
+
+    def test_save_load_level(self):
+        class Level(object):
+            spawn = 1, 2, 3
+            seed = 42
+            time = 1000
+
+        self.serializer.save_level(Level())
+
+        level = Level()
+        level.spawn, level.seed, level.time = (0, 0, 0), 0, 0
+        self.serializer.load_level(level)
+        self.assertEqual(level.spawn, (1, 2, 3))
+        self.assertEqual(level.seed, 42)
+        self.assertEqual(level.time, 1000)
+
+    def test_no_data_corruption(self):
+        data = 'Foo\nbar'
+        self.serializer.save_plugin_data('plugin1', data)
+        self.assertEqual(self.serializer.load_plugin_data('plugin1'), data)
+
+    def test_load_missing_plugin_data(self):
+        self.assertEqual(self.serializer.load_plugin_data('plugin1'), "")
@@ -0,0 +1,92 @@
+from twisted.trial import unittest
+
+import bravo.blocks
+import bravo.entity
+from bravo.errors import ChunkNotLoaded
+from bravo.ibravo import IPreBuildHook
+import bravo.plugin
+import bravo.protocols.beta
+
+class TracksMockFactory(object):
+    """
+    A factory whose world only has the chunk at (0, 0) loaded.
+    """
+
+    def __init__(self):
+        class TracksMockWorld(object):
+
+            def __init__(self):
+                self.blocks = {}
+                self.metadata = {}
+
+            def check(self, coords):
+                x, y, z = coords
+                if not (0 <= x < 16 and 0 <= z < 16):
+                    raise ChunkNotLoaded("Chunk isn't loaded")
+
+            def sync_get_block(self, coords):
+                self.check(coords)
+                return self.blocks.get(coords, 0)
+
+            def sync_get_metadata(self, coords):
+                self.check(coords)
+                return self.metadata.get(coords, 0)
+
+            def sync_set_metadata(self, coords, value):
+                self.check(coords)
+                self.metadata[coords] = value
+
+            def sync_destroy(self, coords):
+                self.check(coords)
+                self.blocks.pop(coords, None)
+                self.metadata.pop(coords, None)
+
+        self.world = TracksMockWorld()
+        self.given = []
+
+    def give(self, coords, block, quantity):
+        self.given.append((coords, block, quantity))
+
+class TracksMockChunk(object):
+
+    x = 0
+    z = 0
+
+class TestTracks(unittest.TestCase):
+
+    def setUp(self):
+        self.p = bravo.plugin.retrieve_plugins(IPreBuildHook)
+
+        if "tracks" not in self.p:
+            raise unittest.SkipTest("Plugin not present")
+
+        self.hook = self.p["tracks"]
+        self.factory = TracksMockFactory()
+        self.world = self.factory.world
+
+        self.world.blocks[0, 63, 0] = bravo.blocks.blocks["stone"].slot
+
+    def test_build_at_chunk_border(self):
+        """
+        Tracks can be built next to chunks which aren't loaded.
+        """
+
+        player = bravo.entity.Player()
+        player.location.yaw = 90
+
+        builddata = bravo.protocols.beta.BuildData(
+            bravo.blocks.blocks["tracks"], 0, 0, 64, 0, "+y")
+        success, newdata = self.hook.pre_build_hook(self.factory, player,
+            builddata)
+
+        self.assertTrue(success)
+        self.assertEqual(newdata.metadata, 0x1)
+
+    def test_dig_at_chunk_border(self):
+        """
+        Digging next to chunks which aren't loaded doesn't touch them.
+        """
+
+        self.hook.dig_hook(self.factory, TracksMockChunk(), 0, 63, 0,
+            bravo.blocks.blocks["stone"])
+        self.assertEqual(self.factory.given, [])
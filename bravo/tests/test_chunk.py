@@ -5,6 +5,7 @@ from numpy import empty
 from numpy.testing import assert_array_equal
 
 import bravo.chunk
+from bravo.packets.beta import parse_packets
 
 class TestChunkBlocks(unittest.TestCase):
 
@@ -49,6 +50,37 @@ class TestChunkBlocks(unittest.TestCase):
         packet = chunk.get_damage_packet()
         self.assertEqual(packet, '\x35\x00\x00\x00\x02\x04\x00\x00\x00\x18\x01\x00')
 
+    def test_batch_damage_packet(self):
+        chunk = bravo.chunk.Chunk(0, 1)
+        chunk.populated = True
+        chunk.set_block((2, 4, 8), 1)
+        chunk.set_block((1, 5, 15), 3)
+        chunk.set_metadata((1, 5, 15), 2)
+        packet = chunk.get_damage_packet()
+        header, payload = parse_packets(packet)[0][0]
+        self.assertEqual(header, 52)
+        self.assertEqual(payload.coords, [0x1f05, 0x2804])
+        self.assertEqual(payload.types, [3, 1])
+        self.assertEqual(payload.metadata, [2, 0])
+
+    def test_damage_count(self):
+        self.c.populated = True
+        for i in range(3):
+            self.c.set_block((0, 0, 0), i + 1)
+        self.assertEqual(len(self.c.damaged), 1)
+        self.assertFalse(self.c.all_damaged)
+
+    def test_damage_all(self):
+        self.c.populated = True
+        for y in range(176):
+            self.c.damage((y % 16, y // 16, 0))
+        self.assertFalse(self.c.all_damaged)
+        self.c.damage((0, 127, 0))
+        self.assertTrue(self.c.all_damaged)
+        self.assertTrue(self.c.is_damaged())
+        self.c.clear_damage()
+        self.assertFalse(self.c.is_damaged())
+
     def test_set_block_correct_heightmap(self):
         """
         Test heightmap update for a single column.
@@ -217,3 +249,464 @@ class TestLightmaps(unittest.TestCase):
         self.c.regenerate()
 
         self.assertEqual(self.c.skylight[1, 1, 1], 12)
+
+class TestIncrementalLighting(unittest.TestCase):
+
+    def setUp(self):
+        self.c = bravo.chunk.Chunk(0, 0)
+        self.c.blocks[:, :, 0].fill(1)
+        self.c.regenerate()
+        self.c.populated = True
+
+    def test_torch(self):
+        self.c.set_block((8, 1, 8), 50)
+        self.c.update_light()
+        self.assertEqual(self.c.blocklight[8, 8, 1], 14)
+        self.assertEqual(self.c.blocklight[9, 8, 1], 13)
+        self.assertEqual(self.c.blocklight[8, 8, 5], 10)
+
+    def test_torch_removed(self):
+        self.c.set_block((8, 1, 8), 50)
+        self.c.update_light()
+        self.c.set_block((8, 1, 8), 0)
+        self.c.update_light()
+        self.assertFalse(self.c.blocklight.unpack().any())
+
+    def test_torch_moved(self):
+        self.c.set_block((4, 1, 4), 50)
+        self.c.update_light()
+        self.c.set_block((4, 1, 4), 0)
+        self.c.set_block((12, 1, 12), 50)
+        self.c.update_light()
+        self.c.regenerate_blocklight()
+        expected = self.c.blocklight
+        self.c.blocklight = expected.copy()
+        self.c.set_block((12, 1, 12), 0)
+        self.c.set_block((12, 1, 12), 50)
+        self.c.update_light()
+        assert_array_equal(self.c.blocklight, expected)
+
+    def test_torch_shadow(self):
+        self.c.set_block((8, 1, 8), 50)
+        self.c.update_light()
+        self.c.set_block((9, 1, 8), 1)
+        self.c.update_light()
+        self.assertEqual(self.c.blocklight[9, 8, 1], 0)
+        # The long way around.
+        self.assertEqual(self.c.blocklight[10, 8, 1], 10)
+
+    def test_roof(self):
+        """
+        Building a roof casts a shadow, and digging it up again lets the sky
+        back in.
+        """
+
+        for x in range(4, 12):
+            for z in range(4, 12):
+                self.c.set_block((x, 3, z), 1)
+        self.c.update_light()
+        self.assertEqual(self.c.skylight[8, 8, 1], 11)
+
+        before = self.c.skylight.copy()
+        self.c.regenerate_skylight()
+        assert_array_equal(self.c.skylight, before)
+
+        for x in range(4, 12):
+            for z in range(4, 12):
+                self.c.set_block((x, 3, z), 0)
+        self.c.update_light()
+        self.assertTrue((self.c.skylight[:, :, 1:] == 15).all())
+
+    def test_batched(self):
+        self.c.set_block((8, 1, 8), 50)
+        self.c.set_block((8, 2, 8), 1)
+        self.assertEqual(len(self.c.light_queue), 4)
+        self.c.update_light()
+        self.assertEqual(len(self.c.light_queue), 0)
+
+    def test_save_to_packet_updates_light(self):
+        self.c.set_block((8, 1, 8), 50)
+        self.c.save_to_packet()
+        self.assertEqual(self.c.blocklight[8, 8, 1], 14)
+
+    def test_unpopulated(self):
+        self.c.populated = False
+        self.c.set_block((8, 1, 8), 50)
+        self.assertEqual(self.c.light_queue, None)
+
+class TestLazyLighting(unittest.TestCase):
+
+    def setUp(self):
+        self.c = bravo.chunk.Chunk(0, 0)
+        self.c.blocks[:, :, :20].fill(1)
+        # A cave with a shaft up to the sky, and a torch.
+        self.c.blocks[4:12, 4:12, 10:15].fill(0)
+        self.c.blocks[4, 4, 15:20].fill(0)
+        self.c.blocks[8, 8, 12] = 89
+
+    def test_regenerate_lazy(self):
+        self.c.regenerate(lazy=True)
+        self.assertTrue(self.c.light_dirty)
+        # Direct skylight only; nothing spreads into the cave.
+        self.assertEqual(self.c.skylight[4, 4, 12], 15)
+        self.assertEqual(self.c.skylight[5, 4, 12], 0)
+        self.assertEqual(self.c.blocklight[8, 8, 12], 15)
+        self.assertEqual(self.c.blocklight[8, 8, 13], 0)
+
+    def test_update_light(self):
+        self.c.regenerate()
+        skylight = self.c.skylight.unpack()
+        blocklight = self.c.blocklight.unpack()
+
+        self.c.regenerate(lazy=True)
+        generation = self.c.generation
+        self.c.update_light()
+        self.assertFalse(self.c.light_dirty)
+        self.assertEqual(self.c.generation, generation + 1)
+        assert_array_equal(self.c.skylight, skylight)
+        assert_array_equal(self.c.blocklight, blocklight)
+
+    def test_save_to_packet(self):
+        self.c.regenerate()
+        packet = self.c.save_to_packet()
+        self.c.regenerate(lazy=True)
+        self.assertEqual(self.c.save_to_packet(), packet)
+        self.assertFalse(self.c.light_dirty)
+
+    def test_update_light_keeps_sections(self):
+        """
+        Sections which were already lit correctly aren't copied.
+        """
+
+        self.c.regenerate(lazy=True)
+        self.c.compact()
+        self.c.update_light()
+        self.assertTrue(self.c.sections[3] is bravo.chunk.EMPTY)
+        self.assertFalse(self.c.sections[0] is bravo.chunk.EMPTY)
+
+class TestChunkPackets(unittest.TestCase):
+
+    def setUp(self):
+        self.c = bravo.chunk.Chunk(2, -3)
+        self.c.blocks[:, :, 0].fill(1)
+        self.c.regenerate()
+        self.c.populated = True
+
+    def test_save_to_packet(self):
+        packet = self.c.save_to_packet()
+        header, payload = parse_packets(packet)[0][0]
+        self.assertEqual(header, 51)
+        self.assertEqual(payload.x, 32)
+        self.assertEqual(payload.z, -48)
+        self.assertEqual(payload.y_size, 127)
+        self.assertEqual(payload.data[:32768], self.c.blocks.tostring())
+        self.assertEqual(len(payload.data), 81920)
+
+    def test_save_to_packet_cached(self):
+        first = self.c.save_to_payload()
+        second = self.c.save_to_payload()
+        self.assertTrue(first is second)
+
+    def test_save_to_packet_invalidated(self):
+        first = self.c.save_to_packet()
+        self.c.set_block((1, 1, 1), 1)
+        second = self.c.save_to_packet()
+        self.assertNotEqual(first, second)
+        payload = parse_packets(second)[0][0][1]
+        self.assertEqual(payload.data[:32768], self.c.blocks.tostring())
+
+    def test_generation(self):
+        generation = self.c.generation
+        self.c.set_block((1, 1, 1), 1)
+        self.c.set_metadata((1, 1, 1), 1)
+        self.c.sed(1, 2)
+        self.c.set_column(0, 0, self.c.get_column(1, 1))
+        self.assertEqual(self.c.generation, generation + 4)
+
+class TestSections(unittest.TestCase):
+
+    def setUp(self):
+        self.c = bravo.chunk.Chunk(0, 0)
+
+    def test_trivial(self):
+        for section in self.c.sections:
+            self.assertTrue(section is bravo.chunk.EMPTY)
+
+    def test_empty_readonly(self):
+        self.assertRaises(ValueError, bravo.chunk.EMPTY.blocks.itemset,
+            (0, 0, 0), 1)
+
+    def test_set_block_copies(self):
+        self.c.set_block((1, 20, 1), 1)
+        self.assertFalse(self.c.sections[1] is bravo.chunk.EMPTY)
+        self.assertTrue(self.c.sections[0] is bravo.chunk.EMPTY)
+        self.assertEqual(self.c.get_block((1, 20, 1)), 1)
+        self.assertFalse(bravo.chunk.EMPTY.blocks.any())
+
+    def test_blocks_view(self):
+        self.c.blocks[1, 2, 40] = 3
+        self.assertEqual(self.c.get_block((1, 40, 2)), 3)
+        self.c.set_block((1, 41, 2), 4)
+        self.assertEqual(self.c.blocks[1, 2, 41], 4)
+
+    def test_blocks_stale(self):
+        blocks = self.c.blocks
+        self.c.compact()
+        self.assertRaises(ValueError, blocks.itemset, (1, 2, 40), 3)
+        self.assertEqual(self.c.blocks[1, 2, 40], 0)
+
+    def test_get_column_in_place(self):
+        column = self.c.get_column(3, 4)
+        column[:10] = 1
+        self.assertEqual(self.c.get_block((3, 9, 4)), 1)
+
+    def test_compact(self):
+        self.c.blocks[:, :, :20].fill(1)
+        self.c.regenerate()
+        self.c.compact()
+        self.assertFalse(self.c.sections[0] is bravo.chunk.EMPTY)
+        self.assertFalse(self.c.sections[1] is bravo.chunk.EMPTY)
+        for section in self.c.sections[2:]:
+            self.assertTrue(section is bravo.chunk.EMPTY)
+        self.assertEqual(self.c.get_block((0, 19, 0)), 1)
+        self.assertEqual(self.c.skylight[0, 0, 20], 15)
+
+    def test_compact_heightmap(self):
+        self.c.blocks[:, :, :20].fill(1)
+        self.c.blocks[4, 4, 100] = 1
+        self.c.compact()
+        self.c.regenerate_heightmap()
+        self.assertEqual(self.c.heightmap[0, 0], 19)
+        self.assertEqual(self.c.heightmap[4, 4], 100)
+
+    def test_packet_compact(self):
+        self.c.blocks[:, :, :20].fill(1)
+        self.c.regenerate()
+        flat = self.c.save_to_packet()
+        self.c.compact()
+        self.c.generation += 1
+        self.assertEqual(self.c.save_to_packet(), flat)
+
+    def test_sed(self):
+        self.c.blocks[:, :, :20].fill(1)
+        self.c.compact()
+        self.c.sed(1, 2)
+        self.assertEqual(self.c.get_block((5, 5, 5)), 2)
+        self.assertTrue(self.c.sections[2] is bravo.chunk.EMPTY)
+
+    def test_set_column(self):
+        column = self.c.get_column(0, 0).copy()
+        column[30] = 1
+        self.c.compact()
+        self.c.set_column(0, 0, column)
+        self.assertEqual(self.c.get_block((0, 30, 0)), 1)
+        self.assertTrue(self.c.sections[0] is bravo.chunk.EMPTY)
+
+class TestBulkEdits(unittest.TestCase):
+
+    def setUp(self):
+        self.c = bravo.chunk.Chunk(0, 0)
+        self.c.blocks[:, :, :20].fill(1)
+        self.c.regenerate()
+        self.c.compact()
+        self.c.populated = True
+        self.c.dirty = False
+        self.c.clear_damage()
+
+    def test_fill_box(self):
+        count = self.c.fill_box((2, 20, 3), (4, 22, 6), 2, 5)
+        self.assertEqual(count, 12)
+        self.assertEqual(self.c.get_block((3, 21, 5)), 2)
+        self.assertEqual(self.c.get_metadata((3, 21, 5)), 5)
+        self.assertEqual(self.c.get_block((4, 21, 5)), 0)
+        self.assertEqual(self.c.heightmap[3, 5], 21)
+        self.assertTrue(self.c.dirty)
+
+    def test_fill_box_sections(self):
+        self.c.fill_box((0, 40, 0), (1, 41, 1), 1)
+        self.assertFalse(self.c.sections[2] is bravo.chunk.EMPTY)
+        self.assertTrue(self.c.sections[3] is bravo.chunk.EMPTY)
+        self.assertTrue(self.c.sections[5] is bravo.chunk.EMPTY)
+
+    def test_fill_box_unchanged(self):
+        generation = self.c.generation
+        self.assertEqual(self.c.fill_box((0, 0, 0), (16, 20, 16), 1), 0)
+        self.assertEqual(self.c.generation, generation)
+        self.assertFalse(self.c.dirty)
+        self.assertFalse(self.c.is_damaged())
+
+    def test_generation_once(self):
+        generation = self.c.generation
+        self.c.fill_box((0, 20, 0), (16, 30, 16), 1)
+        self.assertEqual(self.c.generation, generation + 1)
+
+    def test_damage(self):
+        self.c.set_blocks([(1, 20, 2), (3, 21, 4)], 1)
+        self.assertEqual(self.c.damaged, set([1 << 12 | 2 << 8 | 20,
+            3 << 12 | 4 << 8 | 21]))
+        self.assertFalse(self.c.all_damaged)
+
+    def test_damage_all(self):
+        self.c.fill_box((0, 20, 0), (16, 21, 16), 1)
+        self.assertTrue(self.c.all_damaged)
+        self.assertFalse(self.c.damaged)
+
+    def test_set_blocks(self):
+        self.c.set_blocks([(1, 20, 2), (3, 21, 4)], [2, 3], [4, 5])
+        self.assertEqual(self.c.get_block((1, 20, 2)), 2)
+        self.assertEqual(self.c.get_block((3, 21, 4)), 3)
+        self.assertEqual(self.c.get_metadata((1, 20, 2)), 4)
+        self.assertEqual(self.c.get_metadata((3, 21, 4)), 5)
+
+    def test_set_blocks_metadata_only(self):
+        self.c.set_blocks([(1, 2, 3)], metadata=7)
+        self.assertEqual(self.c.get_block((1, 2, 3)), 1)
+        self.assertEqual(self.c.get_metadata((1, 2, 3)), 7)
+
+    def test_set_blocks_out_of_bounds(self):
+        warnings.simplefilter("ignore", bravo.chunk.ChunkWarning)
+        self.c.set_blocks([(1, 20, 2), (16, 20, 2), (1, 128, 2)], [2, 3, 4])
+        self.assertEqual(self.c.get_block((1, 20, 2)), 2)
+        self.assertEqual(self.c.damaged, set([1 << 12 | 2 << 8 | 20]))
+
+    def test_get_blocks(self):
+        self.c.set_block((1, 20, 2), 3)
+        assert_array_equal(self.c.get_blocks([(1, 20, 2), (1, 19, 2),
+            (1, 21, 2)]), [3, 1, 0])
+
+    def test_replace(self):
+        count = self.c.replace(1, 2, (0, 0, 0), (16, 10, 16))
+        self.assertEqual(count, 16 * 16 * 10)
+        self.assertEqual(self.c.get_block((0, 9, 0)), 2)
+        self.assertEqual(self.c.get_block((0, 10, 0)), 1)
+
+    def test_replace_mask(self):
+        mask = empty((16, 16, 128), dtype=bool)
+        mask.fill(False)
+        mask[5, 6] = True
+        self.c.replace(1, 0, mask=mask)
+        self.assertEqual(self.c.get_block((5, 0, 6)), 0)
+        self.assertEqual(self.c.get_block((5, 0, 7)), 1)
+        self.assertEqual(self.c.heightmap[5, 6], 0)
+
+    def test_apply_mask(self):
+        mask = empty((16, 16, 128), dtype=bool)
+        mask.fill(False)
+        mask[:, :, 50] = True
+        self.c.apply_mask(mask, 2)
+        self.assertEqual(self.c.get_block((7, 50, 7)), 2)
+        self.assertEqual(self.c.heightmap[7, 7], 50)
+
+    def test_light(self):
+        """
+        Bulk edits should light chunks exactly like a full regeneration.
+        """
+
+        self.c.fill_box((4, 10, 4), (12, 30, 12), 0)
+        self.c.fill_box((2, 25, 2), (14, 26, 14), 1)
+        self.c.set_blocks([(8, 12, 8), (5, 1, 5)], 89)
+        self.c.update_light()
+
+        skylight = self.c.skylight.unpack()
+        blocklight = self.c.blocklight.unpack()
+        self.c.regenerate()
+        assert_array_equal(self.c.skylight, skylight)
+        assert_array_equal(self.c.blocklight, blocklight)
+
+    def test_unpopulated(self):
+        self.c.populated = False
+        self.c.fill_box((0, 20, 0), (1, 21, 1), 1)
+        self.assertEqual(self.c.heightmap[0, 0], 19)
+        self.assertTrue(self.c.light_queue is None)
+
+class TestHibernation(unittest.TestCase):
+
+    def setUp(self):
+        self.c = bravo.chunk.Chunk(0, 0)
+        self.c.blocks[:, :, :20].fill(1)
+        self.c.blocks[3, 4, 5] = 2
+        self.c.metadata[3, 4, 5] = 6
+        self.c.regenerate()
+        self.c.compact()
+        self.c.populated = True
+
+    def test_hibernate(self):
+        nbytes = self.c.nbytes
+        self.c.hibernate()
+        self.assertTrue(self.c.hibernating)
+        self.assertTrue(self.c.nbytes < nbytes)
+        self.assertEqual(self.c.hibernation_savings,
+            nbytes - self.c.nbytes)
+
+    def test_wake(self):
+        packet = self.c.save_to_packet()
+        skylight = self.c.skylight.unpack()
+        self.c.compact()
+        self.c.hibernate()
+        self.assertEqual(self.c.get_block((3, 5, 4)), 2)
+        self.assertFalse(self.c.hibernating)
+        self.assertEqual(self.c.get_metadata((3, 5, 4)), 6)
+        for section in self.c.sections[2:]:
+            self.assertTrue(section is bravo.chunk.EMPTY)
+        assert_array_equal(self.c.skylight, skylight)
+        self.assertEqual(self.c.save_to_packet(), packet)
+
+    def test_send_while_hibernating(self):
+        packet = self.c.save_to_packet()
+        self.c.hibernate()
+        self.assertEqual(self.c.save_to_packet(), packet)
+        self.assertTrue(self.c.hibernating)
+
+    def test_set_block_wakes(self):
+        self.c.hibernate()
+        self.c.set_block((1, 30, 1), 3)
+        self.assertFalse(self.c.hibernating)
+        self.assertEqual(self.c.get_block((1, 30, 1)), 3)
+
+class TestTemplates(unittest.TestCase):
+
+    def setUp(self):
+        self.first = bravo.chunk.Chunk(0, 0)
+        self.second = bravo.chunk.Chunk(1, 0)
+        for chunk in self.first, self.second:
+            chunk.blocks[:, :, :20].fill(1)
+            chunk.regenerate()
+            chunk.compact()
+            chunk.populated = True
+
+    def test_digest(self):
+        self.assertEqual(self.first.digest(), self.second.digest())
+        self.second.set_block((1, 1, 1), 2)
+        self.assertNotEqual(self.first.digest(), self.second.digest())
+
+    def test_template_readonly(self):
+        template = self.first.make_template()
+        self.assertRaises(ValueError, template.sections[0].blocks.itemset,
+            (0, 0, 0), 2)
+
+    def test_use_template(self):
+        template = self.first.make_template()
+        self.second.use_template(template)
+        self.assertEqual(self.second.nbytes, 0)
+
+        self.second.set_block((1, 1, 1), 2)
+        self.assertEqual(self.first.get_block((1, 1, 1)), 1)
+        self.assertEqual(self.second.get_block((1, 1, 1)), 2)
+
+    def test_compact_reshares_snapshot(self):
+        """
+        Reading the full-height arrays doesn't stop sections being shared.
+        """
+
+        snapshot = self.first.snapshot()
+        self.first.blocks
+        self.first.compact()
+        self.assertTrue(self.first.sections[0] is snapshot.sections[0])
+
+    def test_compact_reshares(self):
+        template = self.first.make_template()
+        self.second.use_template(template)
+        self.second.blocks
+        self.second.compact()
+        self.assertTrue(self.second.sections[0] is template.sections[0])
+        self.assertEqual(self.second.nbytes, 0)
@@ -3,8 +3,8 @@ from StringIO import StringIO
 import tempfile
 import unittest
 
-from bravo.nbt import NBTFile, MalformedFileError
-from bravo.nbt import TAG_Compound
+from bravo.nbt import NBTFile, MalformedFileError, parse_nbt
+from bravo.nbt import TAG_Compound, TAG_Byte_Array
 
 bigtest = """
 H4sIAAAAAAAAAO1Uz08aQRR+wgLLloKxxBBjzKu1hKXbzUIRibGIFiyaDRrYqDGGuCvDgi67Znew
@@ -85,6 +85,48 @@ class EmptyStringTest(unittest.TestCase):
         self.nbtfile.write_file(buffer=buffer)
         self.assertEqual(buffer.getvalue(), self.golden_value)
 
+class TestParseNBT(unittest.TestCase):
+
+    def setUp(self):
+        self.raw = GzipFile(fileobj=StringIO(bigtest)).read()
+
+    def test_trivial(self):
+        pass
+
+    def test_parse_big(self):
+        expected = NBTFile(buffer=StringIO(self.raw))
+        nbt = parse_nbt(self.raw)
+        self.assertEqual(nbt.name, "Level")
+        self.assertEqual(nbt.pretty_tree(), expected.pretty_tree())
+
+    def test_parse_big_writeback(self):
+        nbt = parse_nbt(self.raw)
+        output = StringIO()
+        nbt.write_file(buffer=output)
+        self.assertEqual(output.getvalue(), self.raw)
+
+    def test_parse_offset(self):
+        nbt = parse_nbt("junk" + self.raw, 4)
+        self.assertEqual(len(nbt.tags), 11)
+
+    def test_byte_array_not_copied(self):
+        nbt = parse_nbt(self.raw)
+        arrays = [tag for tag in nbt.tags if isinstance(tag, TAG_Byte_Array)]
+        self.assertTrue(arrays)
+        for tag in arrays:
+            self.assertTrue(isinstance(tag.value, buffer))
+
+    def test_parse_empty_string(self):
+        nbt = parse_nbt("\x0A\0\x04Test\x08\0\x0Cempty string\0\0\0")
+        self.assertEqual(nbt.name, "Test")
+        self.assertEqual(nbt["empty string"].value, "")
+
+    def test_parse_truncated(self):
+        self.assertRaises(MalformedFileError, parse_nbt, self.raw[:100])
+
+    def test_parse_not_compound(self):
+        self.assertRaises(MalformedFileError, parse_nbt, "\x01\0\0\0")
+
 class TestTAGCompound(unittest.TestCase):
 
     def setUp(self):
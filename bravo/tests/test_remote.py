@@ -0,0 +1,86 @@
+from twisted.internet.defer import (CancelledError, TimeoutError,
+    gatherResults, inlineCallbacks)
+from twisted.trial import unittest
+
+from numpy.testing import assert_array_equal
+
+from bravo.chunk import Chunk
+from bravo.ibravo import ITerrainGenerator
+from bravo.plugin import retrieve_sorted_plugins
+from bravo.remote import GenerationPool
+
+class TestGenerationPool(unittest.TestCase):
+
+    generators = ["boring", "safety"]
+
+    def setUp(self):
+        self.p = GenerationPool(1)
+
+    def tearDown(self):
+        self.p.stop()
+
+    def test_trivial(self):
+        pass
+
+    @inlineCallbacks
+    def test_generate(self):
+        chunk = yield self.p.generate(Chunk(1, 2), 42, self.generators)
+        self.assertEqual(self.p.generated, 1)
+
+        expected = Chunk(1, 2)
+        for stage in retrieve_sorted_plugins(ITerrainGenerator,
+            self.generators):
+            stage.populate(expected, 42)
+        expected.regenerate()
+
+        assert_array_equal(chunk.blocks, expected.blocks)
+        assert_array_equal(chunk.metadata.packed, expected.metadata.packed)
+        assert_array_equal(chunk.skylight.packed, expected.skylight.packed)
+        assert_array_equal(chunk.heightmap, expected.heightmap)
+
+    @inlineCallbacks
+    def test_generate_many(self):
+        ds = [self.p.generate(Chunk(i, 0), 42, self.generators)
+            for i in range(5)]
+        for d in ds:
+            yield d
+        self.assertEqual(self.p.generated, 5)
+        self.assertEqual(sorted(self.p.free), range(self.p.slots))
+
+    def test_cancel_waiting(self):
+        ds = [self.p.generate(Chunk(i, 0), 42, self.generators)
+            for i in range(3)]
+
+        # The last chunk hasn't got a slot yet.
+        self.assertEqual(len(self.p.waiting), 1)
+        ds[2].cancel()
+        self.assertEqual(len(self.p.waiting), 0)
+        self.assertFailure(ds[2], CancelledError)
+
+        return gatherResults(ds)
+
+    @inlineCallbacks
+    def test_generate_error(self):
+        try:
+            yield self.p.generate(Chunk(0, 0), 42, ["nonexistent"])
+        except RuntimeError:
+            pass
+        else:
+            self.fail("Error wasn't passed on")
+
+    @inlineCallbacks
+    def test_generate_timeout(self):
+        self.p.timeout = 0
+        try:
+            yield self.p.generate(Chunk(0, 0), 42, self.generators)
+        except TimeoutError:
+            pass
+        else:
+            self.fail("Chunk didn't time out")
+
+        self.assertEqual(sorted(self.p.free), range(self.p.slots))
+
+        # The replacement processes work.
+        self.p.timeout = 60
+        yield self.p.generate(Chunk(0, 0), 42, self.generators)
+        self.assertEqual(self.p.generated, 1)
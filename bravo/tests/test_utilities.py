@@ -2,13 +2,15 @@
 
 import unittest
 
-from numpy import array
+from numpy import arange, array, uint8
 from numpy.testing import assert_array_equal
 
-from bravo.utilities.bits import unpack_nibbles, pack_nibbles
+from twisted.internet.defer import CancelledError
+
+from bravo.utilities.bits import NibbleArray, unpack_nibbles, pack_nibbles
 from bravo.utilities.chat import sanitize_chat
 from bravo.utilities.coords import split_coords, taxicab2, taxicab3
-from bravo.utilities.temporal import split_time
+from bravo.utilities.temporal import PendingEvent, split_time
 
 class TestCoordHandling(unittest.TestCase):
 
@@ -61,6 +63,56 @@ class TestBitTwiddling(unittest.TestCase):
             )
         )
 
+class TestNibbleArray(unittest.TestCase):
+
+    def setUp(self):
+        self.a = (arange(16 * 16 * 128) % 16).astype(uint8)
+        self.a.shape = (16, 16, 128)
+        self.n = NibbleArray.from_array(self.a)
+
+    def test_packed(self):
+        self.assertEqual(self.n.tostring(), pack_nibbles(self.a))
+
+    def test_unpack(self):
+        assert_array_equal(self.n.unpack(), self.a)
+        assert_array_equal(self.n, self.a)
+
+    def test_item(self):
+        self.assertEqual(self.n[1, 2, 3], self.a[1, 2, 3])
+        self.assertEqual(self.n[1, 2, 4], self.a[1, 2, 4])
+        self.assertEqual(self.n.item(15, 15, 127), self.a[15, 15, 127])
+
+    def test_itemset(self):
+        self.n[1, 2, 3] = 9
+        self.n.itemset((1, 2, 4), 10)
+        self.a[1, 2, 3] = 9
+        self.a[1, 2, 4] = 10
+        assert_array_equal(self.n, self.a)
+
+    def test_slice(self):
+        assert_array_equal(self.n[:, 3, 1:5], self.a[:, 3, 1:5])
+        self.n[:, 3, 1:5] = 2
+        self.a[:, 3, 1:5] = 2
+        assert_array_equal(self.n, self.a)
+
+    def test_out_of_bounds(self):
+        self.assertRaises(IndexError, self.n.__getitem__, (1, 2, 128))
+        self.assertRaises(IndexError, self.n.__setitem__, (16, 2, 3), 1)
+
+    def test_high_bits_dropped(self):
+        self.n[0, 0, 0] = 0x1f
+        self.assertEqual(self.n[0, 0, 0], 0xf)
+        self.assertEqual(self.n[0, 0, 1], 1)
+
+    def test_fill(self):
+        self.n.fill(7)
+        self.assertTrue((self.n.unpack() == 7).all())
+
+    def test_shape(self):
+        n = NibbleArray.from_array(self.a.flatten())
+        n.shape = (16, 16, 128)
+        self.assertEqual(n[1, 2, 3], self.a[1, 2, 3])
+
 class TestStringMunging(unittest.TestCase):
 
     def test_sanitize_chat_color_control_at_end(self):
@@ -79,3 +131,33 @@ class TestNumberMunching(unittest.TestCase):
         self.assertEqual(split_time(12000), (18, 0))
         # Midnight.
         self.assertEqual(split_time(18000), (0, 0))
+
+class TestPendingEvent(unittest.TestCase):
+
+    def setUp(self):
+        self.cancelled = []
+        self.pe = PendingEvent(self.cancelled.append)
+
+    def test_callback(self):
+        l = []
+        self.pe.deferred().addCallback(l.append)
+        self.pe.deferred().addCallback(l.append)
+        self.pe.callback(42)
+        self.assertEqual(l, [42, 42])
+
+    def test_cancel_one(self):
+        l = []
+        first = self.pe.deferred()
+        first.addErrback(lambda failure: failure.trap(CancelledError))
+        self.pe.deferred().addCallback(l.append)
+        first.cancel()
+        self.assertEqual(self.cancelled, [])
+        self.pe.callback(42)
+        self.assertEqual(l, [42])
+
+    def test_cancel_all(self):
+        ds = [self.pe.deferred() for i in range(2)]
+        for d in ds:
+            d.addErrback(lambda failure: failure.trap(CancelledError))
+            d.cancel()
+        self.assertEqual(self.cancelled, [self.pe])
@@ -1,6 +1,7 @@
 from twisted.trial import unittest
 
-from twisted.internet.defer import inlineCallbacks
+from twisted.internet.defer import (CancelledError, DeferredList,
+    inlineCallbacks)
 
 import numpy
 import shutil
@@ -8,6 +9,7 @@ import tempfile
 
 from itertools import product
 
+import bravo.chunk
 import bravo.config
 import bravo.errors
 import bravo.world
@@ -29,6 +31,7 @@ class TestWorldChunks(unittest.TestCase):
     def tearDown(self):
         if self.w.chunk_management_loop.running:
             self.w.chunk_management_loop.stop()
+        self.w.io.stop()
         del self.w
         shutil.rmtree(self.d)
         bravo.config.configuration.remove_section("world unittest")
@@ -162,6 +165,482 @@ class TestWorldChunks(unittest.TestCase):
         chunk = yield self.w.request_chunk(1, 2)
         self.assertTrue(chunk.dirty)
 
+    @inlineCallbacks
+    def test_hibernate_chunks(self):
+        chunk = yield self.w.request_chunk(0, 0)
+        chunk.blocks[:, :, :64].fill(1)
+        chunk.regenerate()
+        chunk.compact()
+        chunk.dirty = False
+
+        chunk.last_used -= self.w.hibernate_idle + 1
+        self.w.hibernate_chunks()
+        self.assertTrue(chunk.hibernating)
+
+        stats = self.w.hibernation_stats()
+        self.assertEqual(stats["hibernating"], 1)
+        self.assertTrue(stats["bytes_saved"] > 0)
+
+        block = yield self.w.get_block((1, 2, 3))
+        self.assertEqual(block, 1)
+        self.assertFalse(chunk.hibernating)
+        self.assertEqual(self.w.chunk_misses, 1)
+
+    @inlineCallbacks
+    def test_hibernate_chunks_recently_used(self):
+        chunk = yield self.w.request_chunk(0, 0)
+        chunk.blocks[:, :, :64].fill(1)
+        chunk.compact()
+        chunk.dirty = False
+
+        self.w.hibernate_chunks()
+        self.assertFalse(chunk.hibernating)
+
+    @inlineCallbacks
+    def test_hibernate_chunks_small(self):
+        chunk = yield self.w.request_chunk(0, 0)
+        chunk.compact()
+        chunk.dirty = False
+
+        chunk.last_used -= self.w.hibernate_idle + 1
+        self.w.hibernate_chunks()
+        self.assertFalse(chunk.hibernating)
+
+    @inlineCallbacks
+    def test_share_template(self):
+        first = yield self.w.request_chunk(0, 0)
+        second = yield self.w.request_chunk(1, 0)
+
+        self.assertTrue(first.template is second.template)
+        for mine, theirs in zip(first.sections, second.sections):
+            self.assertTrue(mine is theirs)
+
+        packet = first.save_to_payload()
+        self.assertTrue(second.save_to_payload() is packet)
+
+    @inlineCallbacks
+    def test_share_template_single(self):
+        """
+        Chunks without a twin aren't turned into templates.
+        """
+
+        chunk = yield self.w.request_chunk(0, 0)
+        self.assertTrue(chunk.template is None)
+
+    @inlineCallbacks
+    def test_share_template_lit(self):
+        """
+        Chunks are lit before they're compared.
+        """
+
+        first = yield self.w.request_chunk(0, 0)
+        second = yield self.w.request_chunk(1, 0)
+        self.assertFalse(first.light_dirty)
+        self.assertFalse(second.light_dirty)
+
+    @inlineCallbacks
+    def test_share_template_different_heightmap(self):
+        """
+        Chunks with different heightmaps aren't compared in full.
+        """
+
+        first = yield self.w.request_chunk(0, 0)
+        first.heightmap[0, 0] = 5
+        self.w.template_candidates.clear()
+        self.w.share_template(first)
+
+        digests = []
+        second = yield self.w.request_chunk(1, 0)
+        second.digest = lambda: digests.append(second)
+        self.w.share_template(second)
+
+        self.assertEqual(digests, [])
+        self.assertTrue(second.template is None)
+
+    @inlineCallbacks
+    def test_share_template_copy_on_write(self):
+        first = yield self.w.request_chunk(0, 0)
+        second = yield self.w.request_chunk(1, 0)
+
+        first.set_block((1, 2, 3), 1)
+        self.assertEqual(first.get_block((1, 2, 3)), 1)
+        self.assertEqual(second.get_block((1, 2, 3)), 0)
+        self.assertFalse(first.sections[0] is second.sections[0])
+        self.assertTrue(first.sections[1] is second.sections[1])
+
+    @inlineCallbacks
+    def test_lazy_light(self):
+        chunk = yield self.w.request_chunk(0, 0)
+        self.assertTrue(chunk.light_dirty)
+
+        self.w.save_chunk(chunk)
+        self.assertFalse(chunk.light_dirty)
+        self.assertFalse(chunk.dirty)
+
+    @inlineCallbacks
+    def test_evict_chunks(self):
+        self.w.chunk_cache.size = 2
+        for x in range(3):
+            yield self.w.request_chunk(x, 0)
+        self.w.sort_chunks()
+
+        self.assertEqual(len(self.w.chunk_cache), 2)
+        self.assertFalse((0, 0) in self.w.chunk_cache)
+        self.assertEqual(self.w.cache_stats()["evictions"], 1)
+
+    @inlineCallbacks
+    def test_evict_chunks_saves(self):
+        self.w.chunk_cache.size = 1
+        first = yield self.w.request_chunk(0, 0)
+        yield self.w.request_chunk(1, 0)
+        first.set_block((1, 2, 3), 1)
+        first.dirty = True
+        yield self.w.request_chunk(2, 0)
+        self.w.evict_chunks()
+
+        self.assertFalse(first.dirty)
+        self.assertFalse((0, 0) in self.w.dirty_chunk_cache)
+
+    @inlineCallbacks
+    def test_evict_chunks_save_fails(self):
+        """
+        Evicted chunks which couldn't be saved go back into the cache, still
+        dirty.
+        """
+
+        def save_chunks(chunks):
+            raise ZeroDivisionError()
+        self.w.serializer.save_chunks = save_chunks
+
+        self.w.chunk_cache.size = 1
+        first = yield self.w.request_chunk(0, 0)
+        first.set_block((1, 2, 3), 1)
+        first.dirty = True
+        since = self.w.dirty_since[0, 0] = 1.0
+        yield self.w.request_chunk(1, 0)
+        yield self.w.evict_chunks()
+
+        self.assertEqual(len(self.flushLoggedErrors(ZeroDivisionError)), 1)
+        self.assertTrue(first.dirty)
+        self.assertTrue(self.w.chunk_cache.get((0, 0)) is first)
+        self.assertTrue(self.w.dirty_chunk_cache[0, 0] is first)
+        self.assertEqual(self.w.dirty_since[0, 0], since)
+
+    @inlineCallbacks
+    def test_evict_chunks_live(self):
+        """
+        Evicted chunks which are still in use aren't loaded again.
+        """
+
+        self.w.chunk_cache.size = 1
+        first = yield self.w.request_chunk(0, 0)
+        yield self.w.request_chunk(1, 0)
+        self.w.sort_chunks()
+        self.assertFalse((0, 0) in self.w.chunk_cache)
+
+        chunk = yield self.w.request_chunk(0, 0)
+        self.assertTrue(chunk is first)
+        self.assertTrue((0, 0) in self.w.chunk_cache)
+
+    @inlineCallbacks
+    def test_evict_chunks_pinned(self):
+        self.w.chunk_cache.size = 1
+        self.w.chunk_cache.pin((0, 0))
+        yield self.w.request_chunk(0, 0)
+        yield self.w.request_chunk(1, 0)
+        self.w.sort_chunks()
+
+        self.assertTrue((0, 0) in self.w.chunk_cache)
+        self.assertFalse((1, 0) in self.w.chunk_cache)
+
+    @inlineCallbacks
+    def test_evict_chunks_save_off(self):
+        self.w.chunk_cache.size = 1
+        yield self.w.request_chunk(0, 0)
+        yield self.w.request_chunk(1, 0)
+        self.w.save_off()
+        self.w.sort_chunks()
+        self.assertEqual(len(self.w.chunk_cache), 2)
+
+    @inlineCallbacks
+    def test_cache_stats(self):
+        yield self.w.request_chunk(0, 0)
+        yield self.w.request_chunk(0, 0)
+        stats = self.w.cache_stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["chunks"], 1)
+
+    @inlineCallbacks
+    def test_save_dirty_chunks(self):
+        for x in range(3):
+            yield self.w.request_chunk(x, 0)
+        self.w.sort_chunks()
+
+        self.assertFalse(self.w.dirty_chunk_cache)
+        self.assertEqual(self.w.last_save_batch, 3)
+        self.assertEqual(self.w.save_stats()["backlog"], 0)
+
+    @inlineCallbacks
+    def test_save_chunks(self):
+        chunks = []
+        for x in (0, 1, 40):
+            chunk = yield self.w.request_chunk(x, 0)
+            chunk.set_block((1, 2, 3), 4)
+            chunks.append(chunk)
+
+        yield self.w.save_chunks(chunks)
+        self.assertFalse(any(chunk.dirty for chunk in chunks))
+        self.assertEqual(self.w.save_stats()["saved"], 3)
+
+    @inlineCallbacks
+    def test_save_chunks_batched(self):
+        """
+        Serializers which don't store chunks by region get a whole batch of
+        saves at once.
+        """
+
+        batches = []
+        self.w.serializer.save_chunks = lambda chunks: batches.append(
+            sorted(chunk.x for chunk in chunks))
+
+        chunks = []
+        for x in (0, 1, 40):
+            chunk = yield self.w.request_chunk(x, 0)
+            chunk.set_block((1, 2, 3), 4)
+            chunks.append(chunk)
+
+        yield self.w.save_chunks(chunks)
+        self.assertEqual(batches, [[0, 1, 40]])
+
+        for chunk in chunks:
+            chunk.set_block((1, 2, 3), 5)
+        self.w.serializer.saves_by_region = True
+        del batches[:]
+
+        yield self.w.save_chunks(chunks)
+        self.assertEqual(sorted(batches), [[0, 1], [40]])
+
+    @inlineCallbacks
+    def test_save_chunk(self):
+        chunk = yield self.w.request_chunk(0, 0)
+        chunk.set_block((1, 2, 3), 4)
+        d = self.w.save_chunk(chunk)
+        self.assertFalse(chunk.dirty)
+
+        # Changes made while the chunk is being written aren't written.
+        chunk.set_block((1, 2, 3), 5)
+        yield d
+        self.assertEqual(self.w.save_stats()["saved"], 1)
+
+        self.w.chunk_cache.clear()
+        self.w._live_chunks.clear()
+        del chunk
+        chunk = yield self.w.request_chunk(0, 0)
+        self.assertEqual(chunk.get_block((1, 2, 3)), 4)
+
+    @inlineCallbacks
+    def test_flush(self):
+        """
+        Flushing saves dirty chunks which haven't been noticed yet.
+        """
+
+        chunk = yield self.w.request_chunk(0, 0)
+        yield self.w.save_chunk(chunk)
+        chunk.set_block((1, 2, 3), 4)
+        self.w.dirty_chunk_cache.clear()
+
+        yield self.w.flush()
+        self.assertFalse(chunk.dirty)
+        self.assertEqual(self.w.save_stats()["saved"], 2)
+
+    @inlineCallbacks
+    def test_request_chunk_concurrent(self):
+        """
+        Chunks being loaded are only loaded once.
+        """
+
+        first = self.w.request_chunk(0, 0)
+        second = self.w.request_chunk(0, 0)
+        first = yield first
+        second = yield second
+        self.assertTrue(first is second)
+
+    @inlineCallbacks
+    def test_request_chunks(self):
+        coords = [(0, 0), (1, 0), (40, 40)]
+        ds = self.w.request_chunks(coords)
+        self.assertEqual(sorted(ds), sorted(coords))
+
+        for x, z in coords:
+            chunk = yield ds[x, z]
+            self.assertEqual((chunk.x, chunk.z), (x, z))
+            self.assertTrue(chunk is self.w.loaded_chunk(x, z))
+
+    @inlineCallbacks
+    def test_request_chunks_disk_order_fails(self):
+        """
+        Chunks are still loaded when they can't be put into disk order.
+        """
+
+        def disk_order(chunks):
+            raise ZeroDivisionError()
+        self.w.serializer.disk_order = disk_order
+
+        coords = [(0, 0), (1, 0)]
+        ds = self.w.request_chunks(coords)
+        for x, z in coords:
+            chunk = yield ds[x, z]
+            self.assertEqual((chunk.x, chunk.z), (x, z))
+
+        self.assertEqual(len(self.flushLoggedErrors(ZeroDivisionError)), 1)
+
+    @inlineCallbacks
+    def test_request_chunks_concurrent(self):
+        """
+        Chunks requested in bulk are shared with single requests.
+        """
+
+        first = self.w.request_chunk(0, 0)
+        ds = self.w.request_chunks([(0, 0), (1, 0)])
+        first = yield first
+        second = yield ds[0, 0]
+        self.assertTrue(first is second)
+
+        yield ds[1, 0]
+
+    @inlineCallbacks
+    def test_request_chunk_cancel(self):
+        """
+        Chunks which nobody is waiting for any more are thrown away.
+        """
+
+        d = self.w.request_chunk(0, 0)
+        d.addErrback(lambda failure: failure.trap(CancelledError))
+        d.cancel()
+
+        # Wait for the load to finish.
+        yield self.w.io.run(self.w._region(0, 0), lambda: None)
+        self.assertEqual(self.w.loaded_chunk(0, 0), None)
+        self.assertFalse((0, 0) in self.w._pending_chunks)
+
+        chunk = yield self.w.request_chunk(0, 0)
+        self.assertTrue(chunk is self.w.loaded_chunk(0, 0))
+
+    @inlineCallbacks
+    def test_generate_chunk_priority(self):
+        """
+        Chunks nearest to points of interest are generated first.
+        """
+
+        self.w.set_interest("player", 10, 0)
+
+        l = []
+        ds = []
+        for x in (0, 9, 5):
+            d = self.w.generate_chunk(bravo.chunk.Chunk(x, 0))
+            d.addCallback(lambda chunk: l.append(chunk.x))
+            ds.append(d)
+        yield DeferredList(ds)
+
+        self.assertEqual(l, [9, 5, 0])
+
+    @inlineCallbacks
+    def test_save_dirty_chunks_budget(self):
+        """
+        At least one chunk is saved, even without any time to save chunks.
+        """
+
+        self.w.save_budget = 0
+        for x in range(3):
+            yield self.w.request_chunk(x, 0)
+        self.w.sort_chunks()
+
+        self.assertEqual(self.w.last_save_batch, 1)
+        self.assertEqual(self.w.save_stats()["backlog"], 2)
+
+    @inlineCallbacks
+    def test_save_dirty_chunks_oldest(self):
+        self.w.save_budget = 0
+        chunks = []
+        for x in range(3):
+            chunk = yield self.w.request_chunk(x, 0)
+            chunks.append(chunk)
+        self.w.dirty_since[1, 0] -= 10
+        self.w.save_dirty_chunks()
+
+        self.assertFalse(chunks[1].dirty)
+        self.assertTrue(chunks[0].dirty)
+
+    @inlineCallbacks
+    def test_save_dirty_chunks_doomed(self):
+        self.w.save_budget = 0
+        self.w.chunk_cache.size = 10
+        chunks = []
+        for x in range(11):
+            chunk = yield self.w.request_chunk(x, 0)
+            chunks.append(chunk)
+        self.w.dirty_since[5, 0] -= 10
+        self.w.save_dirty_chunks()
+
+        # The least recently used chunk goes first, even though another
+        # chunk has been dirty longer.
+        self.assertFalse(chunks[0].dirty)
+        self.assertTrue(chunks[5].dirty)
+
+    @inlineCallbacks
+    def test_sync_get_block(self):
+        chunk = yield self.w.request_chunk(0, 0)
+
+        # Fill the chunk with random stuff.
+        chunk.blocks = numpy.fromstring(numpy.random.bytes(chunk.blocks.size),
+            dtype=numpy.uint8)
+        chunk.blocks.shape = (16, 16, 128)
+
+        for x, y, z in product(xrange(2), xrange(2), xrange(2)):
+            block = self.w.sync_get_block((x, y, z))
+            self.assertEqual(block, chunk.get_block((x, y, z)))
+
+    @inlineCallbacks
+    def test_sync_set_block_negative(self):
+        chunk = yield self.w.request_chunk(-1, -1)
+
+        self.w.sync_set_block((-1, 10, -16), 1)
+        self.assertEqual(chunk.get_block((15, 10, 0)), 1)
+        self.assertEqual(self.w.sync_get_block((-1, 10, -16)), 1)
+
+    def test_sync_get_block_unloaded(self):
+        self.assertRaises(bravo.errors.ChunkNotLoaded,
+            self.w.sync_get_block, (0, 0, 0))
+        self.assertEqual(self.w.loaded_chunk(0, 0), None)
+
+    @inlineCallbacks
+    def test_sync_blocks(self):
+        first = yield self.w.request_chunk(0, 0)
+        second = yield self.w.request_chunk(-1, 0)
+
+        coords = [(1, 1, 1), (-1, 2, 3), (2, 3, 4), (-16, 4, 5)]
+        changed = self.w.sync_set_blocks(coords, [1, 2, 3, 4])
+        self.assertEqual(changed, 4)
+        self.assertEqual(first.get_block((2, 3, 4)), 3)
+        self.assertEqual(second.get_block((15, 2, 3)), 2)
+        self.assertEqual(second.get_block((0, 4, 5)), 4)
+
+        blocks = self.w.sync_get_blocks(coords)
+        self.assertEqual(blocks.tolist(), [1, 2, 3, 4])
+
+    @inlineCallbacks
+    def test_sync_set_blocks_unloaded(self):
+        """
+        Nothing is changed if any of the chunks isn't loaded.
+        """
+
+        chunk = yield self.w.request_chunk(0, 0)
+
+        self.assertRaises(bravo.errors.ChunkNotLoaded,
+            self.w.sync_set_blocks, [(1, 1, 1), (16, 1, 1)], 1)
+        self.assertEqual(chunk.get_block((1, 1, 1)), 0)
+
 class TestWorldInit(unittest.TestCase):
 
     def setUp(self):
@@ -0,0 +1,58 @@
+import unittest
+
+from bravo.utilities.cache import LRUCache
+
+class TestLRUCache(unittest.TestCase):
+
+    def setUp(self):
+        self.c = LRUCache(3)
+
+    def test_trivial(self):
+        pass
+
+    def test_evict_size(self):
+        for i in range(5):
+            self.c[i] = str(i)
+        self.assertEqual(self.c.evict(), [(0, "0"), (1, "1")])
+        self.assertEqual(sorted(self.c.keys()), [2, 3, 4])
+        self.assertEqual(self.c.evictions, 2)
+
+    def test_evict_within_size(self):
+        self.c[0] = "0"
+        self.assertEqual(self.c.evict(), [])
+
+    def test_get_recent(self):
+        for i in range(4):
+            self.c[i] = str(i)
+        self.c.get(0)
+        self.assertEqual(self.c.evict(), [(1, "1")])
+
+    def test_peek_not_recent(self):
+        for i in range(4):
+            self.c[i] = str(i)
+        self.c.peek(0)
+        self.assertEqual(self.c.evict(), [(0, "0")])
+
+    def test_hits_misses(self):
+        self.c[0] = "0"
+        self.c.get(0)
+        self.c.get(1)
+        self.c.peek(2)
+        self.assertEqual(self.c.hits, 1)
+        self.assertEqual(self.c.misses, 1)
+
+    def test_pinned(self):
+        for i in range(5):
+            self.c[i] = str(i)
+        self.c.pin(0)
+        self.assertEqual(self.c.evict(), [(1, "1"), (2, "2")])
+        self.assertTrue(0 in self.c)
+
+    def test_budget(self):
+        c = LRUCache(budget=5, weigh=len)
+        c["a"] = "xxx"
+        c["b"] = "xxx"
+        c["c"] = "x"
+        self.assertEqual(c.weight(), 7)
+        self.assertEqual(c.evict(), [("a", "xxx")])
+        self.assertEqual(c.weight(), 4)
@@ -0,0 +1,74 @@
+import unittest
+
+from bravo.utilities.extents import Extents
+
+class TestExtents(unittest.TestCase):
+
+    def setUp(self):
+        self.e = Extents()
+
+    def test_trivial(self):
+        pass
+
+    def test_free(self):
+        self.e.free(2, 3)
+        self.assertEqual(list(self.e), [(2, 3)])
+        self.assertEqual(len(self.e), 3)
+
+    def test_free_merge(self):
+        self.e.free(2, 3)
+        self.e.free(8, 2)
+        self.e.free(5, 3)
+        self.assertEqual(list(self.e), [(2, 8)])
+
+    def test_free_merge_after(self):
+        self.e.free(5, 3)
+        self.e.free(2, 3)
+        self.assertEqual(list(self.e), [(2, 6)])
+
+    def test_contains(self):
+        self.e.free(2, 3)
+        self.assertFalse(1 in self.e)
+        self.assertTrue(2 in self.e)
+        self.assertTrue(4 in self.e)
+        self.assertFalse(5 in self.e)
+
+    def test_reserve_middle(self):
+        self.e.free(2, 10)
+        self.e.reserve(4, 2)
+        self.assertEqual(list(self.e), [(2, 2), (6, 6)])
+
+    def test_reserve_across(self):
+        self.e.free(2, 3)
+        self.e.free(7, 3)
+        self.e.free(12, 3)
+        self.e.reserve(3, 10)
+        self.assertEqual(list(self.e), [(2, 1), (13, 2)])
+
+    def test_reserve_not_free(self):
+        self.e.free(2, 3)
+        self.e.reserve(10, 3)
+        self.assertEqual(list(self.e), [(2, 3)])
+
+    def test_allocate_best_fit(self):
+        self.e.free(2, 5)
+        self.e.free(10, 2)
+        self.e.free(20, 3)
+        self.assertEqual(self.e.allocate(2), 10)
+        self.assertEqual(self.e.allocate(2), 20)
+        self.assertEqual(list(self.e), [(2, 5), (22, 1)])
+
+    def test_allocate_none(self):
+        self.e.free(2, 1)
+        self.assertEqual(self.e.allocate(2), None)
+
+    def test_allocate_end(self):
+        self.e.free(2, 1)
+        self.assertEqual(self.e.allocate(2, 10), 10)
+        self.assertEqual(list(self.e), [(2, 1)])
+
+    def test_allocate_extend_tail(self):
+        self.e.free(2, 1)
+        self.e.free(8, 2)
+        self.assertEqual(self.e.allocate(3, 10), 8)
+        self.assertEqual(list(self.e), [(2, 1)])
@@ -0,0 +1,195 @@
+import unittest
+
+from numpy import uint8, zeros
+from numpy.testing import assert_array_equal
+
+from bravo.blocks import blocks
+from bravo.chunk import Chunk
+from bravo.utilities.light import (LightQueue, column_skylight,
+    regenerate_blocklight, regenerate_skylight, spread_light)
+
+class TestColumnSkylight(unittest.TestCase):
+
+    def setUp(self):
+        self.blocks = zeros((16, 16, 128), dtype=uint8)
+        self.heightmap = zeros((16, 16), dtype=uint8)
+
+    def test_empty(self):
+        lightmap = column_skylight(self.blocks, self.heightmap)
+        self.assertTrue((lightmap == 15).all())
+
+    def test_floor(self):
+        self.blocks[:, :, 0].fill(blocks["stone"].slot)
+        lightmap = column_skylight(self.blocks, self.heightmap)
+        self.assertTrue((lightmap[:, :, 0] == 0).all())
+        self.assertTrue((lightmap[:, :, 1:] == 15).all())
+
+    def test_water(self):
+        self.blocks[0, 0, :10].fill(blocks["spring"].slot)
+        self.heightmap[0, 0] = 9
+        lightmap = column_skylight(self.blocks, self.heightmap)
+        assert_array_equal(lightmap[0, 0, 4:11],
+            [0, 0, 3, 6, 9, 12, 15])
+
+    def test_top_of_world(self):
+        self.blocks[0, 0, 127] = blocks["stone"].slot
+        self.heightmap[0, 0] = 127
+        lightmap = column_skylight(self.blocks, self.heightmap)
+        self.assertTrue((lightmap[0, 0] == 0).all())
+
+class TestSpreadLight(unittest.TestCase):
+
+    def setUp(self):
+        self.blocks = zeros((16, 16, 16), dtype=uint8)
+        self.lightmap = zeros((16, 16, 16), dtype=uint8)
+
+    def test_point(self):
+        self.lightmap[8, 8, 8] = 15
+        lightmap = spread_light(self.lightmap, self.blocks)
+        self.assertEqual(lightmap[8, 8, 8], 15)
+        self.assertEqual(lightmap[9, 8, 8], 14)
+        self.assertEqual(lightmap[8, 7, 8], 14)
+        self.assertEqual(lightmap[8, 8, 11], 12)
+        self.assertEqual(lightmap[10, 10, 10], 9)
+
+    def test_unmodified(self):
+        self.lightmap[8, 8, 8] = 15
+        spread_light(self.lightmap, self.blocks)
+        self.assertEqual(self.lightmap.sum(), 15)
+
+    def test_opaque(self):
+        self.blocks[9, 8, 8] = blocks["stone"].slot
+        self.lightmap[8, 8, 8] = 15
+        lightmap = spread_light(self.lightmap, self.blocks)
+        self.assertEqual(lightmap[9, 8, 8], 0)
+        # The long way around.
+        self.assertEqual(lightmap[10, 8, 8], 11)
+
+    def test_translucent(self):
+        self.blocks[9, 8, 8] = blocks["leaves"].slot
+        self.lightmap[8, 8, 8] = 15
+        lightmap = spread_light(self.lightmap, self.blocks)
+        self.assertEqual(lightmap[9, 8, 8], 13)
+
+    def test_deep_water(self):
+        """
+        Light should run out in water, rather than wrapping around.
+        """
+
+        self.blocks.fill(blocks["spring"].slot)
+        self.lightmap[8, 8, 8] = 15
+        lightmap = spread_light(self.lightmap, self.blocks)
+        self.assertEqual(lightmap[9, 8, 8], 11)
+        self.assertEqual(lightmap[12, 8, 8], 0)
+        self.assertTrue(lightmap.max() == 15)
+        self.assertEqual((lightmap == 15).sum(), 1)
+
+class TestRegenerate(unittest.TestCase):
+
+    def setUp(self):
+        self.blocks = zeros((16, 16, 128), dtype=uint8)
+        self.heightmap = zeros((16, 16), dtype=uint8)
+
+    def test_skylight_translucent_roof(self):
+        """
+        Light should spread in underneath translucent blocks.
+        """
+
+        self.blocks[:, :, 0].fill(blocks["stone"].slot)
+        self.blocks[4:12, 4:12, 3].fill(blocks["ice"].slot)
+        self.heightmap.fill(0)
+        self.heightmap[4:12, 4:12] = 3
+        lightmap = regenerate_skylight(self.blocks, self.heightmap)
+        self.assertEqual(lightmap[4, 4, 2], 14)
+        self.assertEqual(lightmap[5, 7, 2], 13)
+        self.assertEqual(lightmap[7, 7, 2], 12)
+
+    def test_blocklight_torch(self):
+        self.blocks[8, 8, 64] = blocks["torch"].slot
+        lightmap = regenerate_blocklight(self.blocks)
+        self.assertEqual(lightmap[8, 8, 64], 14)
+        self.assertEqual(lightmap[9, 8, 64], 13)
+        self.assertEqual(lightmap[8, 8, 60], 10)
+        self.assertEqual(lightmap[8, 8, 50], 0)
+
+    def test_blocklight_many(self):
+        self.blocks[2, 3, 4] = blocks["lightstone"].slot
+        self.blocks[12, 3, 40] = blocks["torch"].slot
+        self.blocks[6, 14, 60] = blocks["lava"].slot
+        lightmap = regenerate_blocklight(self.blocks)
+        self.assertEqual(lightmap[2, 3, 4], 15)
+        self.assertEqual(lightmap[12, 3, 40], 14)
+        self.assertEqual(lightmap[6, 14, 60], 15)
+        self.assertEqual(lightmap[6, 14, 50], 5)
+
+    def test_blocklight_opaque(self):
+        """
+        Block light shouldn't go through walls.
+        """
+
+        self.blocks[8, 8, 64] = blocks["torch"].slot
+        self.blocks[9, 8, 64] = blocks["stone"].slot
+        lightmap = regenerate_blocklight(self.blocks)
+        self.assertEqual(lightmap[9, 8, 64], 0)
+        self.assertEqual(lightmap[10, 8, 64], 10)
+
+class TestLightQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.chunks = {}
+        for x, z in ((0, 0), (1, 0)):
+            chunk = Chunk(x, z)
+            chunk.blocks[:, :, 0].fill(blocks["stone"].slot)
+            chunk.regenerate()
+            chunk.populated = True
+            self.chunks[x, z] = chunk
+
+        self.queue = LightQueue(lambda x, z: self.chunks.get((x, z)))
+        for chunk in self.chunks.itervalues():
+            chunk.light_queue = self.queue
+            chunk.dirty = False
+
+    def test_across_border(self):
+        first, second = self.chunks[0, 0], self.chunks[1, 0]
+        first.set_block((15, 1, 8), blocks["torch"].slot)
+        self.queue.flush()
+        self.assertEqual(second.blocklight[0, 8, 1], 13)
+        self.assertEqual(second.blocklight[3, 8, 1], 10)
+        self.assertTrue(second.dirty)
+
+    def test_removed_across_border(self):
+        first, second = self.chunks[0, 0], self.chunks[1, 0]
+        first.set_block((15, 1, 8), blocks["torch"].slot)
+        self.queue.flush()
+        first.set_block((15, 1, 8), 0)
+        self.queue.flush()
+        self.assertFalse(first.blocklight.unpack().any())
+        self.assertFalse(second.blocklight.unpack().any())
+
+    def test_skylight_across_border(self):
+        first, second = self.chunks[0, 0], self.chunks[1, 0]
+        for z in range(16):
+            for y in range(1, 4):
+                second.set_block((0, y, z), blocks["stone"].slot)
+        for x in range(0, 16):
+            for z in range(16):
+                first.set_block((x, 4, z), blocks["stone"].slot)
+        self.queue.flush()
+        self.assertEqual(first.skylight[15, 8, 1], 0)
+        self.assertEqual(first.skylight[15, 8, 3], 0)
+
+        second.set_block((0, 2, 8), 0)
+        self.queue.flush()
+        self.assertEqual(first.skylight[15, 8, 2], 13)
+        self.assertEqual(first.skylight[14, 8, 2], 12)
+
+    def test_missing_neighbor(self):
+        """
+        Light should stop at chunks which aren't available.
+        """
+
+        del self.chunks[1, 0]
+        first = self.chunks[0, 0]
+        first.set_block((15, 1, 8), blocks["torch"].slot)
+        self.queue.flush()
+        self.assertEqual(first.blocklight[15, 8, 1], 14)
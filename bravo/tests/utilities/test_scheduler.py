@@ -0,0 +1,136 @@
+from twisted.internet.defer import CancelledError, Deferred
+from twisted.trial import unittest
+
+from bravo.utilities.scheduler import Scheduler
+
+class FakeReactor(object):
+    """
+    Just enough of a reactor to run calls one iteration at a time.
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def callLater(self, delay, f, *args):
+        self.calls.append((f, args))
+        return f
+
+    def iterate(self):
+        calls, self.calls = self.calls, []
+        for f, args in calls:
+            f(*args)
+
+    def run(self):
+        while self.calls:
+            self.iterate()
+
+class TestScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeReactor()
+        self.priorities = {}
+        self.s = Scheduler(0, self.priorities.get, self.clock)
+        self.l = []
+
+    def job(self, key, steps=1):
+        for i in range(steps):
+            self.l.append(key)
+            yield
+
+    def test_trivial(self):
+        pass
+
+    def test_schedule(self):
+        d = self.s.schedule("a", self.job("a"))
+        self.assertEqual(len(self.s), 1)
+        self.clock.run()
+        self.assertEqual(self.l, ["a"])
+        self.assertEqual(len(self.s), 0)
+        self.assertEqual(self.s.completed, 1)
+        self.assertTrue(d.called)
+
+    def test_budget(self):
+        """
+        With no budget, one step is taken per iteration.
+        """
+
+        self.s.schedule("a", self.job("a", 3))
+        self.clock.iterate()
+        self.assertEqual(self.l, ["a"])
+        self.clock.iterate()
+        self.assertEqual(self.l, ["a", "a"])
+
+    def test_priority(self):
+        self.priorities.update(a=2, b=1, c=3)
+        for key in "abc":
+            self.s.schedule(key, self.job(key))
+        self.clock.run()
+        self.assertEqual(self.l, ["b", "a", "c"])
+
+    def test_reprioritize(self):
+        self.priorities.update(a=1, b=2)
+        for key in "ab":
+            self.s.schedule(key, self.job(key))
+        self.priorities.update(a=3)
+        self.s.reprioritize()
+        self.clock.iterate()
+        self.assertEqual(self.l, ["b"])
+
+    def test_cancel(self):
+        d = self.s.schedule("a", self.job("a"))
+        self.s.cancel("a")
+        self.clock.iterate()
+        self.assertEqual(self.l, [])
+        self.assertEqual(self.s.cancelled, 1)
+        self.assertFailure(d, CancelledError)
+        return d
+
+    def test_cancel_deferred(self):
+        d = self.s.schedule("a", self.job("a", 3))
+        self.clock.iterate()
+        d.cancel()
+        self.clock.iterate()
+        self.assertEqual(self.l, ["a"])
+        self.assertFalse("a" in self.s)
+        self.assertFailure(d, CancelledError)
+        return d
+
+    def test_error(self):
+        def broken():
+            raise ValueError("broken")
+            yield
+        d = self.s.schedule("a", broken())
+        self.clock.iterate()
+        self.assertFailure(d, ValueError)
+        return d
+
+    def test_waiting(self):
+        """
+        Jobs waiting on a Deferred don't hold up other jobs.
+        """
+
+        waiting = Deferred()
+        def waits():
+            self.l.append("waiting")
+            yield waiting
+            self.l.append("done")
+        self.priorities.update(a=1, b=2)
+        self.s.schedule("a", waits())
+        self.s.schedule("b", self.job("b"))
+        self.clock.iterate()
+        self.clock.iterate()
+        self.assertEqual(self.l, ["waiting", "b"])
+        waiting.callback(None)
+        self.clock.iterate()
+        self.assertEqual(self.l, ["waiting", "b", "done"])
+
+    def test_cancel_waiting(self):
+        cancelled = []
+        waiting = Deferred(cancelled.append)
+        def waits():
+            yield waiting
+        d = self.s.schedule("a", waits())
+        d.addErrback(lambda failure: failure.trap(CancelledError))
+        self.clock.iterate()
+        self.s.cancel("a")
+        self.assertEqual(cancelled, [waiting])
@@ -0,0 +1,50 @@
+from twisted.internet.defer import DeferredList, inlineCallbacks
+from twisted.trial import unittest
+
+from bravo.utilities.workers import WorkerPool
+
+class TestWorkerPool(unittest.TestCase):
+
+    def setUp(self):
+        self.p = WorkerPool(4)
+
+    def tearDown(self):
+        self.p.stop()
+
+    def test_trivial(self):
+        pass
+
+    @inlineCallbacks
+    def test_run(self):
+        result = yield self.p.run(None, lambda x: x * 2, 21)
+        self.assertEqual(result, 42)
+
+    @inlineCallbacks
+    def test_run_error(self):
+        def broken():
+            raise ValueError("broken")
+        try:
+            yield self.p.run("key", broken)
+        except ValueError:
+            pass
+        else:
+            self.fail("Error wasn't passed on")
+
+    @inlineCallbacks
+    def test_ordered(self):
+        l = []
+        yield DeferredList([self.p.run("key", l.append, i)
+            for i in range(100)])
+        self.assertEqual(l, range(100))
+        self.assertEqual(self.p.pending(), 0)
+
+    def test_inline(self):
+        p = WorkerPool(0)
+        d = p.run("key", lambda: 5)
+        self.assertEqual(self.successResultOf(d), 5)
+        self.assertTrue(p.pool is None)
+
+    def test_stopped(self):
+        self.p.stop()
+        d = self.p.run("key", lambda: 5)
+        self.assertEqual(self.successResultOf(d), 5)
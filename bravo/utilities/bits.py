@@ -1,4 +1,6 @@
-from numpy import uint8, cast, dstack, fromstring
+from numbers import Integral
+
+from numpy import uint8, cast, dstack, empty, fromstring, zeros
 
 """
 Bit-twiddling devices.
@@ -38,3 +40,152 @@ def pack_nibbles(a):
     if a.dtype != uint8:
         a = cast[uint8](a)
     return ((a[:, 1] << 4) | a[:, 0]).tostring()
+
+class NibbleArray(object):
+    """
+    An array of nibbles, packed two to a byte.
+
+    Nibbles are packed along the last axis, in exactly the same layout that
+    ``pack_nibbles()`` produces for the flattened array, so the packed bytes
+    can be written to disk or to the wire as-is.
+
+    Single nibbles can be read and written quickly by indexing with a tuple
+    of integers, or with ``item()`` and ``itemset()``. Any other kind of
+    indexing, and anything else which needs an ``ndarray``, works on an
+    unpacked copy of the array.
+
+    :ivar `ndarray` packed: packed nibbles
+    """
+
+    def __init__(self, shape, packed=None):
+        """
+        :param tuple shape: shape of the unpacked array; the last dimension
+                            must be even
+        :param packed: optional packed data, as a string, a ``buffer``, or an
+                       ``ndarray``
+        """
+
+        shape = tuple(shape)
+        packed_shape = shape[:-1] + (shape[-1] // 2,)
+
+        if packed is None:
+            packed = zeros(packed_shape, dtype=uint8)
+        elif isinstance(packed, (str, buffer)):
+            packed = fromstring(packed, dtype=uint8).reshape(packed_shape)
+        else:
+            packed = packed.reshape(packed_shape)
+
+        self._shape = shape
+        self.packed = packed
+
+    @classmethod
+    def from_array(cls, a):
+        """
+        Pack an array of nibbles.
+
+        Only the low nibble of each value is kept.
+
+        :param `ndarray` a: nibbles to pack
+        """
+
+        return cls(a.shape, fromstring(pack_nibbles(a & 0xf), dtype=uint8))
+
+    def __repr__(self):
+        return "NibbleArray(%r)" % (self._shape,)
+
+    def _get_shape(self):
+        return self._shape
+
+    def _set_shape(self, shape):
+        shape = tuple(shape)
+        packed_shape = shape[:-1] + (shape[-1] // 2,)
+        self.packed.shape = packed_shape
+        self._shape = shape
+
+    shape = property(_get_shape, _set_shape)
+
+    @property
+    def size(self):
+        return self.packed.size * 2
+
+    def item(self, *args):
+        """
+        Get a single nibble, as an int.
+        """
+
+        if len(args) == 1:
+            args = args[0]
+        x, z, y = args
+
+        return self.packed.item(x, z, y >> 1) >> ((y & 1) << 2) & 0xf
+
+    def itemset(self, *args):
+        """
+        Set a single nibble.
+        """
+
+        if len(args) == 2:
+            (x, z, y), value = args
+        else:
+            x, z, y, value = args
+
+        shift = (y & 1) << 2
+        byte = self.packed.item(x, z, y >> 1) & ~(0xf << shift)
+        self.packed.itemset(x, z, y >> 1, byte | (int(value) & 0xf) << shift)
+
+    def __getitem__(self, key):
+        if (isinstance(key, tuple) and len(key) == 3
+            and all(isinstance(i, Integral) for i in key)):
+            return self.item(key)
+        return self.unpack()[key]
+
+    def __setitem__(self, key, value):
+        if (isinstance(key, tuple) and len(key) == 3
+            and all(isinstance(i, Integral) for i in key)):
+            self.itemset(key, value)
+        else:
+            a = self.unpack()
+            a[key] = value
+            self.packed[...] = NibbleArray.from_array(a).packed
+
+    def __array__(self, dtype=None):
+        a = self.unpack()
+        if dtype is not None:
+            a = a.astype(dtype)
+        return a
+
+    def __eq__(self, other):
+        return self.unpack() == other
+
+    def __ne__(self, other):
+        return self.unpack() != other
+
+    def unpack(self):
+        """
+        Unpack this array.
+
+        :returns: new ``ndarray`` of nibbles, as uint8
+        """
+
+        a = empty(self._shape, dtype=uint8)
+        a[..., ::2] = self.packed & 0xf
+        a[..., 1::2] = self.packed >> 4
+        return a
+
+    def fill(self, value):
+        """
+        Set every nibble to the same value.
+        """
+
+        value &= 0xf
+        self.packed.fill(value << 4 | value)
+
+    def copy(self):
+        return NibbleArray(self._shape, self.packed.copy())
+
+    def tostring(self):
+        """
+        Get the packed nibbles as a string of bytes.
+        """
+
+        return self.packed.tostring()
@@ -0,0 +1,231 @@
+"""
+Caching utilities.
+"""
+
+class LRUCache(object):
+    """
+    A dictionary which remembers the order in which its entries were used,
+    and can evict the least recently used entries to stay within a size or a
+    memory budget.
+
+    Entries are never evicted behind the back of the cache's owner; instead,
+    ``evict()`` is called when convenient, and hands back everything that it
+    evicted, so that the owner can clean up after it.
+
+    Keys can be pinned, which keeps them from ever being evicted. Pins are
+    remembered even for keys which aren't currently in the cache.
+
+    :ivar int hits: number of ``get()`` calls which found an entry
+    :ivar int misses: number of ``get()`` calls which didn't
+    :ivar int evictions: number of entries evicted
+    """
+
+    def __init__(self, size=0, budget=0, weigh=None):
+        """
+        :param int size: maximum number of entries, or 0 for no maximum
+        :param int budget: maximum total weight of entries, or 0 for no
+                           maximum
+        :param callable weigh: function taking an entry and returning its
+                               weight, usually in bytes; required if there is
+                               a budget
+        """
+
+        self.size = size
+        self.budget = budget
+        self.weigh = weigh
+
+        self.pinned = set()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # Entries are kept in a circular, doubly linked list, from least to
+        # most recently used, with a dictionary of links for finding them.
+        # Each link is a list of the previous link, the next link, the key,
+        # and the value.
+        self._entries = {}
+        self._root = root = []
+        root[:] = [root, root, None, None]
+
+    def __repr__(self):
+        return "LRUCache(%d entries)" % len(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __iter__(self):
+        return self.iterkeys()
+
+    def _append(self, key, value):
+        root = self._root
+        last = root[0]
+        last[1] = root[0] = self._entries[key] = [last, root, key, value]
+
+    def _remove(self, key):
+        prev, next, key, value = self._entries.pop(key)
+        prev[1] = next
+        next[0] = prev
+        return value
+
+    def _links(self):
+        root = self._root
+        link = root[1]
+        while link is not root:
+            yield link
+            link = link[1]
+
+    def __getitem__(self, key):
+        value = self._remove(key)
+        self._append(key, value)
+        return value
+
+    def __setitem__(self, key, value):
+        if key in self._entries:
+            self._remove(key)
+        self._append(key, value)
+
+    def __delitem__(self, key):
+        self._remove(key)
+
+    def get(self, key, default=None):
+        """
+        Look up an entry, marking it as recently used.
+        """
+
+        if key in self._entries:
+            self.hits += 1
+            return self[key]
+
+        self.misses += 1
+        return default
+
+    def peek(self, key, default=None):
+        """
+        Look up an entry without marking it as used or counting the lookup.
+        """
+
+        link = self._entries.get(key)
+        if link is None:
+            return default
+        return link[3]
+
+    def pop(self, key, *args):
+        if key in self._entries:
+            return self._remove(key)
+        elif args:
+            return args[0]
+        raise KeyError(key)
+
+    def clear(self):
+        self._entries.clear()
+        root = self._root
+        root[:] = [root, root, None, None]
+
+    def keys(self):
+        return list(self.iterkeys())
+
+    def values(self):
+        return list(self.itervalues())
+
+    def items(self):
+        return list(self.iteritems())
+
+    def iterkeys(self):
+        return (link[2] for link in self._links())
+
+    def itervalues(self):
+        return (link[3] for link in self._links())
+
+    def iteritems(self):
+        return ((link[2], link[3]) for link in self._links())
+
+    def pin(self, key):
+        """
+        Keep a key from ever being evicted.
+        """
+
+        self.pinned.add(key)
+
+    def unpin(self, key):
+        """
+        Allow a key to be evicted again.
+        """
+
+        self.pinned.discard(key)
+
+    def weight(self):
+        """
+        Get the total weight of every entry.
+
+        :rtype: int
+        """
+
+        if self.weigh is None:
+            return 0
+        return sum(self.weigh(value) for value in self.itervalues())
+
+    def victims(self, size=None, budget=None):
+        """
+        Find the entries which would be evicted, without evicting them.
+
+        Other limits than the cache's own can be given, to look further
+        ahead; for example, a cache with a size of 100 can be asked which
+        entries would be evicted at a size of 90, to find out which entries
+        are going to be evicted soon.
+
+        :param int size: maximum number of entries, instead of ``size``
+        :param int budget: maximum total weight, instead of ``budget``
+
+        :returns: list of keys, least recently used first
+        """
+
+        if size is None:
+            size = self.size
+        if budget is None:
+            budget = self.budget
+
+        excess = 0
+        if size:
+            excess = len(self._entries) - size
+
+        overweight = 0
+        if budget:
+            overweight = self.weight() - budget
+
+        victims = []
+
+        if excess <= 0 and overweight <= 0:
+            return victims
+
+        for key, value in self.iteritems():
+            if excess <= 0 and overweight <= 0:
+                break
+            if key in self.pinned:
+                continue
+
+            victims.append(key)
+
+            excess -= 1
+            if budget:
+                overweight -= self.weigh(value)
+
+        return victims
+
+    def evict(self):
+        """
+        Evict the least recently used entries until the cache is back within
+        its size and budget, or only pinned entries are left.
+
+        Weights are only measured here, so entries whose weight changes over
+        time are always evicted according to their current weight.
+
+        :returns: list of evicted key-value pairs, least recently used first
+        """
+
+        evicted = [(key, self._remove(key)) for key in self.victims()]
+        self.evictions += len(evicted)
+        return evicted
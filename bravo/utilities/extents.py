@@ -0,0 +1,151 @@
+from bisect import bisect_left, insort
+
+"""
+Free space accounting.
+"""
+
+class Extents(object):
+    """
+    A set of free extents, for allocating space in files.
+
+    An extent is a run of consecutive units, like pages of a file, and is
+    described by its start and its length. Free extents are kept sorted and
+    are merged with their neighbours as soon as they touch, so that there are
+    never two free extents next to each other.
+
+    Space is allocated best-fit: the smallest free extent which is big enough
+    is used, starting at its beginning, so that big free extents are saved
+    for big allocations.
+    """
+
+    def __init__(self):
+        self.starts = []
+        self.lengths = {}
+
+    def __repr__(self):
+        return "Extents(%r)" % list(self)
+
+    def __len__(self):
+        """
+        Count the free units.
+        """
+
+        return sum(self.lengths.itervalues())
+
+    def __iter__(self):
+        """
+        Iterate over the free extents, as pairs of start and length, in order.
+        """
+
+        for start in self.starts:
+            yield start, self.lengths[start]
+
+    def __contains__(self, unit):
+        i = bisect_left(self.starts, unit + 1) - 1
+        if i < 0:
+            return False
+        start = self.starts[i]
+        return unit < start + self.lengths[start]
+
+    def _remove(self, start):
+        del self.starts[bisect_left(self.starts, start)]
+        return self.lengths.pop(start)
+
+    def free(self, start, length):
+        """
+        Free an extent.
+
+        The extent must not already be free, in part or in whole.
+        """
+
+        if length <= 0:
+            return
+
+        i = bisect_left(self.starts, start)
+
+        # Merge with the extent after...
+        if i < len(self.starts) and self.starts[i] == start + length:
+            length += self._remove(start + length)
+
+        # ...and the extent before.
+        if i > 0:
+            before = self.starts[i - 1]
+            if before + self.lengths[before] == start:
+                self.lengths[before] += length
+                return
+
+        insort(self.starts, start)
+        self.lengths[start] = length
+
+    def reserve(self, start, length):
+        """
+        Mark an extent as used.
+
+        Parts of the extent which weren't free are ignored.
+        """
+
+        end = start + length
+
+        i = max(bisect_left(self.starts, start + 1) - 1, 0)
+        while i < len(self.starts) and self.starts[i] < end:
+            first = self.starts[i]
+            last = first + self.lengths[first]
+
+            if last <= start:
+                i += 1
+                continue
+
+            self._remove(first)
+
+            if first < start:
+                self.free(first, start - first)
+                i += 1
+            if end < last:
+                self.free(end, last - end)
+
+    def allocate(self, length, end=None):
+        """
+        Allocate an extent.
+
+        If no free extent is big enough, and the end of the space is given,
+        the space is grown instead: a free extent which runs up to the end is
+        extended past it, or else the extent is allocated at the end.
+
+        :param int length: length of the extent
+        :param int end: end of the space, or None if it can't be grown
+
+        :returns: start of the extent, or None if it couldn't be allocated
+        """
+
+        best = None
+        for start in self.starts:
+            available = self.lengths[start]
+            if available == length:
+                best = start
+                break
+            elif available > length:
+                if best is None or available < self.lengths[best]:
+                    best = start
+
+        if best is not None:
+            self.reserve(best, length)
+            return best
+
+        if end is None:
+            return None
+
+        if self.starts:
+            last = self.starts[-1]
+            if last + self.lengths[last] == end:
+                self._remove(last)
+                return last
+
+        return end
+
+    def clear(self):
+        """
+        Forget every free extent.
+        """
+
+        del self.starts[:]
+        self.lengths.clear()
@@ -0,0 +1,405 @@
+from collections import deque
+
+from numpy import int16, uint8
+from numpy import (arange, cast, concatenate, cumsum, maximum, newaxis,
+    where, zeros)
+
+from bravo.blocks import blocks, glowing_blocks
+
+"""
+Lighting utilities.
+
+The regeneration functions in this module operate on entire chunk-shaped
+arrays at once, indexed as (x, z, y), rather than on individual blocks. Block
+types are translated into lighting properties through lookup tables, so that
+no Python code needs to run per-block.
+
+Small changes are handled by ``LightQueue`` instead, which only visits the
+blocks whose light might actually have changed.
+"""
+
+def _make_tables():
+    """
+    Build the per-block lookup tables for dimming and glowing.
+
+    Unknown block types are treated as opaque and dark, matching the default
+    for ``Block``.
+    """
+
+    dims = zeros((256,), dtype=uint8)
+    dims.fill(16)
+    glows = zeros((256,), dtype=uint8)
+
+    for i in xrange(256):
+        if i in blocks:
+            dims[i] = blocks[i].dim
+        if i in glowing_blocks:
+            glows[i] = glowing_blocks[i]
+
+    return dims, glows
+
+dim_table, glow_table = _make_tables()
+"""
+Lookup tables mapping block types to the amount that they dim light, and the
+amount of light that they emit.
+"""
+
+def column_skylight(blocks, heightmap):
+    """
+    Calculate direct skylight for every xz-column of a chunk.
+
+    Light starts at full strength above each column's height, and is then
+    dimmed by every block it passes through on the way down, until there is
+    no light left. This is a cumulative sum down each column.
+
+    :param `ndarray` blocks: block types
+    :param `ndarray` heightmap: height of each xz-column
+
+    :returns: lightmap of direct skylight, as uint8
+    """
+
+    # Apparently, skylights start at the block *above* the block on which the
+    # light is incident? Blocks above that point don't dim anything.
+    height = heightmap.astype(int16)[:, :, newaxis] + 1
+    dims = where(arange(blocks.shape[2]) <= height,
+        dim_table[blocks].astype(int16), 0)
+
+    # Sum the dimming from the top of each column down.
+    dimming = cumsum(dims[:, :, ::-1], axis=2)[:, :, ::-1]
+
+    return cast[uint8]((15 - dimming).clip(0, 15))
+
+def spread_light(lightmap, blocks):
+    """
+    Spread light from lit blocks to their neighbors.
+
+    Each block that light can pass through receives the brightest light of
+    its six neighbors, less one, less its own dimming. The entire lightmap is
+    spread one step at a time, and only blocks which actually got brighter on
+    the previous step are considered on the next step, until the lightmap
+    stops changing.
+
+    :param `ndarray` lightmap: initial light values; this is not modified
+    :param `ndarray` blocks: block types
+
+    :returns: spread lightmap, as uint8
+    """
+
+    light = lightmap.astype(int16)
+    dims = dim_table[blocks]
+    # Blocks which dim by 15 or more can never be lit by their neighbors.
+    lightable = dims < 15
+    cost = dims.astype(int16) + 1
+
+    # Only blocks which changed on the last step can brighten anything on
+    # the next step; at first, that's every lit block.
+    changed = light > 1
+
+    while changed.any():
+        sources = where(changed, light, 0)
+
+        brightest = zeros(light.shape, dtype=int16)
+        maximum(brightest[1:], sources[:-1], brightest[1:])
+        maximum(brightest[:-1], sources[1:], brightest[:-1])
+        maximum(brightest[:, 1:], sources[:, :-1], brightest[:, 1:])
+        maximum(brightest[:, :-1], sources[:, 1:], brightest[:, :-1])
+        maximum(brightest[:, :, 1:], sources[:, :, :-1], brightest[:, :, 1:])
+        maximum(brightest[:, :, :-1], sources[:, :, 1:], brightest[:, :, :-1])
+
+        brightest -= cost
+        changed = lightable & (brightest > light)
+        light[changed] = brightest[changed]
+
+    return cast[uint8](light)
+
+def regenerate_skylight(blocks, heightmap):
+    """
+    Calculate the ambient light map for a chunk.
+
+    The height map must be valid for this function to produce valid results.
+
+    Nothing above the tallest column can be dimmed, so the spreading is only
+    done up to one block above it, where the light is always at full
+    strength.
+
+    :param `ndarray` blocks: block types
+    :param `ndarray` heightmap: height of each xz-column
+
+    :returns: skylight lightmap, as uint8
+    """
+
+    lightmap = column_skylight(blocks, heightmap)
+
+    top = min(int(heightmap.max()) + 2, blocks.shape[2])
+    lightmap[:, :, :top] = spread_light(lightmap[:, :, :top],
+        blocks[:, :, :top])
+
+    return lightmap
+
+def regenerate_blocklight(blocks):
+    """
+    Calculate the block light map for a chunk.
+
+    Glowing blocks are found with a single table lookup, and then their light
+    is spread exactly like skylight, so that opaque blocks cast shadows and
+    removing a light source can be undone incrementally.
+
+    :param `ndarray` blocks: block types
+
+    :returns: block lightmap, as uint8
+    """
+
+    return spread_light(glow_table[blocks], blocks)
+
+def _column(chunk, x, z):
+    """
+    Get the block types of an xz-column of a chunk, section by section.
+    """
+
+    return concatenate([section.blocks[x, z] for section in chunk.sections])
+
+def _column_skylight(dims):
+    """
+    Calculate the direct skylight of columns, from their dimming along the
+    last axis.
+    """
+
+    return (15 - cumsum(dims[..., ::-1], axis=-1)[..., ::-1]).clip(0, 15)
+
+def _neighbors(x, y, z):
+    """
+    The six blocks touching a block, in world coordinates.
+    """
+
+    return ((x - 1, y, z), (x + 1, y, z), (x, y - 1, z), (x, y + 1, z),
+        (x, y, z - 1), (x, y, z + 1))
+
+class LightQueue(object):
+    """
+    A queue of pending, incremental light updates.
+
+    Blocks which have changed are queued as they change, and then all of the
+    queued blocks are relit at once when the queue is flushed. Relighting
+    first removes any light which might have come through the changed blocks,
+    and then propagates light back in from the edges of the darkened area and
+    from any light sources inside it, so only the area actually affected by
+    the changes is touched.
+
+    All coordinates in the queue are world coordinates, and light is
+    propagated across chunk boundaries into any chunk which can be looked up.
+    """
+
+    def __init__(self, lookup=None):
+        """
+        :param callable lookup: function taking chunk coordinates and
+                                returning a ``Chunk``, or None if the chunk
+                                isn't available
+        """
+
+        self.lookup = lookup
+
+        self.chunks = {}
+        self.sky = set()
+        self.block = set()
+
+    def __len__(self):
+        return len(self.sky) + len(self.block)
+
+    def enqueue(self, chunk, coords, old):
+        """
+        Queue a changed block for relighting.
+
+        This should be called after the block and the heightmap have been
+        updated.
+
+        :param `Chunk` chunk: chunk containing the block
+        :param tuple coords: coordinate triplet, relative to the chunk
+        :param int old: previous block type
+        """
+
+        x, y, z = coords
+        bigx = chunk.x * 16 + x
+        bigz = chunk.z * 16 + z
+
+        self.chunks[chunk.x, chunk.z] = chunk
+        self.block.add((bigx, y, bigz))
+        self.sky.add((bigx, y, bigz))
+
+        # If this block changed how much skylight gets through it, then the
+        # direct skylight of every block underneath it might have changed
+        # too, so queue all of those.
+        dims = dim_table[_column(chunk, x, z)].astype(int16)
+        if dims[y] != dim_table[old]:
+            after = _column_skylight(dims)
+            dims[y] = dim_table[old]
+            before = _column_skylight(dims)
+            for i in (before != after).nonzero()[0]:
+                self.sky.add((bigx, int(i), bigz))
+
+    def enqueue_mask(self, chunk, changed, old):
+        """
+        Queue many changed blocks of a chunk for relighting at once.
+
+        This is the bulk version of ``enqueue()``; the changed blocks and the
+        direct skylight underneath them are found for the whole chunk with a
+        handful of array operations.
+
+        :param `Chunk` chunk: chunk containing the blocks
+        :param `ndarray` changed: full-height boolean mask of changed blocks
+        :param `ndarray` old: full-height array of previous block types
+        """
+
+        bigx = chunk.x * 16
+        bigz = chunk.z * 16
+
+        xs, zs, ys = changed.nonzero()
+        if not len(xs):
+            return
+
+        self.chunks[chunk.x, chunk.z] = chunk
+        cells = zip((xs + bigx).tolist(), ys.tolist(), (zs + bigz).tolist())
+        self.block.update(cells)
+        self.sky.update(cells)
+
+        after = dim_table[concatenate([section.blocks
+            for section in chunk.sections], axis=2)].astype(int16)
+        before = where(changed, dim_table[old], after)
+        columns = (before != after).any(axis=2)
+        if columns.any():
+            difference = (_column_skylight(before[columns]) !=
+                _column_skylight(after[columns]))
+            xs, zs = columns.nonzero()
+            for i, y in zip(*difference.nonzero()):
+                self.sky.add((int(xs[i]) + bigx, int(y), int(zs[i]) + bigz))
+
+    def flush(self):
+        """
+        Relight every queued block.
+
+        Any chunk whose light changes is marked dirty, and has its generation
+        bumped.
+        """
+
+        if not self.sky and not self.block:
+            return
+
+        sky, self.sky = self.sky, set()
+        block, self.block = self.block, set()
+        chunks, self.chunks = self.chunks, {}
+
+        def get_chunk(x, z):
+            if (x, z) not in chunks:
+                chunks[x, z] = self.lookup and self.lookup(x, z)
+            return chunks[x, z]
+
+        columns = {}
+        def skylight_source(chunk, x, y, z):
+            if (chunk.x, chunk.z, x, z) not in columns:
+                dims = dim_table[_column(chunk, x, z)].astype(int16)
+                columns[chunk.x, chunk.z, x, z] = _column_skylight(dims)
+            return columns[chunk.x, chunk.z, x, z][y]
+
+        def blocklight_source(chunk, x, y, z):
+            return glow_table[chunk.get_block((x, y, z))]
+
+        touched = set()
+        touched.update(relight(sky, get_chunk, "skylight", skylight_source))
+        touched.update(relight(block, get_chunk, "blocklight",
+            blocklight_source))
+
+        for chunk in touched:
+            chunk.dirty = True
+            chunk.generation += 1
+
+def relight(seeds, get_chunk, name, source):
+    """
+    Incrementally relight a set of blocks in a lightmap.
+
+    This is the heart of incremental light updates. In the first pass, light
+    is removed from the seed blocks, and then from every block whose light
+    was dimmer than its neighbor's removed light, since that light might have
+    come through the seeds. Blocks at least as bright as their removed
+    neighbors have their own sources of light, and are remembered. In the
+    second pass, every darkened block is given its own light back, and light
+    is spread outwards from those blocks and the remembered blocks.
+
+    :param set seeds: world coordinates of blocks to relight
+    :param callable get_chunk: function taking chunk coordinates and
+                               returning a ``Chunk`` or None
+    :param str name: name of the lightmap attribute on each chunk
+    :param callable source: function taking a chunk and chunk coordinates,
+                            and returning the light emitted at that spot
+
+    :returns: set of chunks whose lightmaps were changed
+    """
+
+    touched = set()
+
+    def locate(x, y, z):
+        if not 0 <= y < 128:
+            return None, None, None
+        chunk = get_chunk(x >> 4, z >> 4)
+        if chunk is None:
+            return None, None, None
+        return chunk, y >> 4, (x & 0xf, z & 0xf, y & 0xf)
+
+    dims = dim_table.tolist()
+
+    removals = deque()
+    darkened = []
+    spreading = deque()
+
+    for x, y, z in seeds:
+        chunk, i, index = locate(x, y, z)
+        if chunk is None:
+            continue
+        lightmap = getattr(chunk.own_section(i), name)
+        removals.append((x, y, z, lightmap.item(index)))
+        darkened.append((x, y, z))
+        lightmap.itemset(index, 0)
+        touched.add(chunk)
+
+    while removals:
+        x, y, z, level = removals.popleft()
+        for coords in _neighbors(x, y, z):
+            chunk, i, index = locate(*coords)
+            if chunk is None:
+                continue
+            neighbor = getattr(chunk.sections[i], name).item(index)
+            if not neighbor:
+                continue
+            elif neighbor < level:
+                getattr(chunk.own_section(i), name).itemset(index, 0)
+                removals.append(coords + (neighbor,))
+                darkened.append(coords)
+                touched.add(chunk)
+            else:
+                spreading.append(coords)
+
+    for x, y, z in darkened:
+        chunk, i, index = locate(x, y, z)
+        light = source(chunk, index[0], y, index[1])
+        if light:
+            getattr(chunk.own_section(i), name).itemset(index, light)
+            spreading.append((x, y, z))
+
+    while spreading:
+        x, y, z = spreading.popleft()
+        chunk, i, index = locate(x, y, z)
+        level = getattr(chunk.sections[i], name).item(index)
+        if level <= 1:
+            continue
+        for coords in _neighbors(x, y, z):
+            chunk, i, index = locate(*coords)
+            if chunk is None:
+                continue
+            section = chunk.sections[i]
+            light = level - 1 - dims[section.blocks.item(index)]
+            if light <= 0:
+                continue
+            if light > getattr(section, name).item(index):
+                getattr(chunk.own_section(i), name).itemset(index, light)
+                spreading.append(coords)
+                touched.add(chunk)
+
+    return touched
@@ -0,0 +1,202 @@
+from heapq import heapify, heappop, heappush
+from itertools import count
+from time import time
+
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred
+from twisted.python.failure import Failure
+
+"""
+Utilities for spreading expensive work out over time.
+"""
+
+class Job(object):
+    """
+    A piece of work which has been handed to a ``Scheduler``.
+    """
+
+    cancelled = False
+
+    def __init__(self, key, iterator, seq):
+        self.key = key
+        self.iterator = iterator
+        self.seq = seq
+        self.deferred = None
+        self.waiting = None
+
+class Scheduler(object):
+    """
+    A queue of prioritized, cancellable jobs, which are run a little at a
+    time.
+
+    Jobs are iterators, and are run one step, or call to ``next()``, at a
+    time. Whenever the reactor gets around to the scheduler, steps are taken
+    from the jobs with the lowest priority values, until the scheduler has
+    used up its budget of time; then the reactor is allowed to get on with
+    everything else. A single step is never interrupted, so jobs should take
+    small steps.
+
+    If a step yields a ``Deferred``, the job is put aside until the
+    ``Deferred`` fires, and other jobs are run in the meantime. Cancelling
+    the job cancels the ``Deferred`` too.
+
+    Each job is identified by a key, which is handed to the priority function
+    to find out how urgent the job is. Priorities are only looked up when a
+    job is scheduled and when ``reprioritize()`` is called, so they can
+    depend on things which change over time, like the positions of players.
+
+    :ivar int completed: number of jobs finished
+    :ivar int cancelled: number of jobs cancelled
+    """
+
+    def __init__(self, budget, priority=None, clock=reactor):
+        """
+        :param float budget: the most seconds to spend on jobs per reactor
+                             iteration; at least one step is always taken
+        :param callable priority: function taking a key and returning its
+                                  priority, lowest first; by default, jobs are
+                                  run in the order in which they were
+                                  scheduled
+        :param clock: provider of ``callLater()``, for testing
+        """
+
+        self.budget = budget
+        self.priority = priority
+        self.clock = clock
+
+        self.jobs = {}
+
+        self.completed = 0
+        self.cancelled = 0
+
+        self._queue = []
+        self._counter = count()
+        self._stale = False
+        self._call = None
+
+    def __len__(self):
+        return len(self.jobs)
+
+    def __contains__(self, key):
+        return key in self.jobs
+
+    def schedule(self, key, iterator):
+        """
+        Add a job to the queue.
+
+        The returned ``Deferred`` can be cancelled, which cancels the job.
+
+        :param key: hashable key for the job, not shared with any other job
+                    in the queue
+        :param iterator: the job
+
+        :returns: ``Deferred`` which fires with None when the job is finished
+        """
+
+        job = Job(key, iter(iterator), self._counter.next())
+        job.deferred = Deferred(lambda d: self._drop(job))
+
+        self.jobs[key] = job
+        self._push(job)
+
+        return job.deferred
+
+    def cancel(self, key):
+        """
+        Cancel a job, if it is still in the queue.
+
+        The job's ``Deferred`` fails with ``CancelledError``.
+        """
+
+        job = self.jobs.get(key)
+        if job is not None:
+            job.deferred.cancel()
+
+    def reprioritize(self):
+        """
+        Look up the priorities of all of the jobs in the queue again, before
+        the next step is taken.
+        """
+
+        self._stale = True
+
+    def _priority(self, key):
+        if self.priority is None:
+            return 0
+        return self.priority(key)
+
+    def _push(self, job):
+        heappush(self._queue, (self._priority(job.key), job.seq, job))
+
+        if self._call is None:
+            self._call = self.clock.callLater(0, self._run)
+
+    def _drop(self, job):
+        """
+        Forget about a cancelled job.
+
+        Its entry in the queue is left behind, and skipped when it comes up.
+        """
+
+        job.cancelled = True
+        if self.jobs.get(job.key) is job:
+            del self.jobs[job.key]
+        self.cancelled += 1
+
+        if job.waiting is not None:
+            job.waiting.cancel()
+
+    def _resume(self, result, job):
+        job.waiting = None
+        if not job.cancelled:
+            self._push(job)
+
+    def _fail(self, failure, job):
+        job.waiting = None
+        if not job.cancelled:
+            del self.jobs[job.key]
+            job.deferred.errback(failure)
+
+    def _run(self):
+        """
+        Take steps from the most urgent jobs, until the budget is used up.
+        """
+
+        self._call = None
+
+        if self._stale:
+            self._stale = False
+            self._queue = [(self._priority(job.key), seq, job)
+                for chaff, seq, job in self._queue if not job.cancelled]
+            heapify(self._queue)
+
+        end = time() + self.budget
+
+        while self._queue:
+            chaff, chaff, job = heappop(self._queue)
+            if job.cancelled:
+                continue
+
+            try:
+                result = job.iterator.next()
+            except StopIteration:
+                del self.jobs[job.key]
+                self.completed += 1
+                job.deferred.callback(None)
+            except:
+                del self.jobs[job.key]
+                job.deferred.errback(Failure())
+            else:
+                if isinstance(result, Deferred):
+                    job.waiting = result
+                    result.addCallbacks(self._resume, self._fail,
+                        callbackArgs=(job,), errbackArgs=(job,))
+                else:
+                    heappush(self._queue, (self._priority(job.key), job.seq,
+                        job))
+
+            if time() >= end:
+                break
+
+        if self._queue and self._call is None:
+            self._call = self.clock.callLater(0, self._run)
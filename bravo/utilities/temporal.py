@@ -14,16 +14,27 @@ class PendingEvent(object):
     fires many multiple Deferreds.
 
     This code came from Epsilon and should go into Twisted at some point.
+
+    Each of the Deferreds can be cancelled without affecting the others. Once
+    all of them have been cancelled, nobody is waiting for the event any
+    longer, and the event's own canceller, if any, is called with the event.
     """
 
-    def __init__(self):
+    def __init__(self, canceller=None):
         self.listeners = []
+        self.canceller = canceller
 
     def deferred(self):
-        d = Deferred()
+        d = Deferred(self._cancel)
         self.listeners.append(d)
         return d
 
+    def _cancel(self, d):
+        if d in self.listeners:
+            self.listeners.remove(d)
+            if not self.listeners and self.canceller is not None:
+                self.canceller(self)
+
     def callback(self, result):
         l = self.listeners
         self.listeners = []
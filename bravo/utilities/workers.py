@@ -0,0 +1,145 @@
+from collections import deque
+from threading import Lock
+
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, maybeDeferred
+from twisted.python.failure import Failure
+from twisted.python.threadpool import ThreadPool
+
+"""
+Utilities for getting blocking work off of the reactor.
+"""
+
+class WorkerPool(object):
+    """
+    A bounded pool of threads for blocking work, like disk I/O.
+
+    Work is grouped by key. Work with the same key is always done in the
+    order in which it was handed to the pool, one piece at a time, while
+    work with different keys is done in parallel. For example, keying writes
+    by file keeps each file's writes in order.
+
+    Ordering is done entirely in the worker threads, so that any work which
+    was handed to the pool is finished when the pool is stopped, even while
+    the reactor is shutting down.
+
+    A pool with no threads, or a pool which has been stopped, does all of its
+    work immediately, on the calling thread.
+    """
+
+    def __init__(self, size, name="workers"):
+        """
+        :param int size: the most threads to run at once
+        :param str name: name of the pool, for debugging
+        """
+
+        self.size = size
+        self.name = name
+
+        self.pool = None
+        self.stopped = False
+
+        self._lock = Lock()
+        self._queues = {}
+
+    def start(self):
+        """
+        Start the threads.
+
+        This is done automatically the first time that any work is handed to
+        the pool. The threads are stopped when the reactor shuts down.
+        """
+
+        if self.pool is not None or not self.size:
+            return
+
+        self.pool = ThreadPool(1, self.size, self.name)
+        self.pool.start()
+        reactor.addSystemEventTrigger("after", "shutdown", self.stop)
+
+    def stop(self):
+        """
+        Finish any outstanding work, and stop the threads.
+        """
+
+        self.stopped = True
+
+        if self.pool is not None:
+            pool, self.pool = self.pool, None
+            pool.stop()
+
+    def run(self, key, f, *args, **kwargs):
+        """
+        Do some work in the pool.
+
+        :param key: hashable key ordering this work, or None if it doesn't
+                    need to be done in any particular order
+        :param callable f: the work
+
+        :returns: ``Deferred`` which fires with the result of the work
+        """
+
+        if not self.size or self.stopped:
+            return maybeDeferred(f, *args, **kwargs)
+
+        self.start()
+
+        d = Deferred()
+        job = f, args, kwargs, d
+
+        if key is None:
+            self.pool.callInThread(self._work, job)
+            return d
+
+        with self._lock:
+            queue = self._queues.get(key)
+            if queue is None:
+                queue = self._queues[key] = deque()
+                start = True
+            else:
+                start = False
+            queue.append(job)
+
+        if start:
+            self.pool.callInThread(self._drain, key)
+
+        return d
+
+    def _work(self, job):
+        """
+        Do a single piece of work, in a worker thread.
+        """
+
+        f, args, kwargs, d = job
+
+        try:
+            result = f(*args, **kwargs)
+        except:
+            reactor.callFromThread(d.errback, Failure())
+        else:
+            reactor.callFromThread(d.callback, result)
+
+    def _drain(self, key):
+        """
+        Do all of the work for a key, in order, in a worker thread.
+        """
+
+        while True:
+            with self._lock:
+                queue = self._queues[key]
+                if not queue:
+                    del self._queues[key]
+                    return
+                job = queue.popleft()
+
+            self._work(job)
+
+    def pending(self):
+        """
+        Count the pieces of work waiting for an ordered key.
+
+        :rtype: int
+        """
+
+        with self._lock:
+            return sum(len(queue) for queue in self._queues.itervalues())
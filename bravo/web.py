@@ -89,13 +89,25 @@ class BravoWorldElement(Element):
     def status(self, request, tag):
         world = self.factory.world
         l = []
-        total = (len(world.chunk_cache) + len(world.dirty_chunk_cache) +
-            len(world._pending_chunks))
+        cache = world.cache_stats()
+        total = cache["chunks"] + len(world._pending_chunks)
         l.append(tags.li("Total chunks: %d" % total))
-        l.append(tags.li("Clean chunks: %d" % len(world.chunk_cache)))
-        l.append(tags.li("Dirty chunks: %d" % len(world.dirty_chunk_cache)))
+        l.append(tags.li("Clean chunks: %d" % (cache["chunks"] -
+            cache["dirty"])))
+        l.append(tags.li("Dirty chunks: %d" % cache["dirty"]))
+        l.append(tags.li("Chunk cache: %d KiB, %d evicted, %.1f%% hit rate" %
+            (cache["bytes"] // 1024, cache["evictions"],
+            cache["hit_rate"] * 100)))
+        saving = world.save_stats()
+        l.append(tags.li("Save backlog: %d chunks (%.1f s latency)" %
+            (saving["backlog"], saving["latency"])))
         l.append(tags.li("Chunks being generated: %d" %
             len(world._pending_chunks)))
+        stats = world.hibernation_stats()
+        l.append(tags.li("Hibernating chunks: %d (%d KiB saved)" %
+            (stats["hibernating"], stats["bytes_saved"] // 1024)))
+        l.append(tags.li("Hibernation hit rate: %.1f%%" %
+            (stats["hit_rate"] * 100)))
         if world.permanent_cache:
             l.append(tags.li("Permanent cache: enabled, %d chunks" %
                 len(world.permanent_cache)))
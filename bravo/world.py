@@ -1,25 +1,35 @@
 from functools import wraps
 from itertools import product
+from operator import attrgetter
 import random
 import sys
+from time import time
 import weakref
 
-from numpy import fromstring, uint8
+from numpy import argsort, asarray, bincount, cumsum, empty, int64, uint8
+from numpy import unique
 
-from twisted.internet.defer import (inlineCallbacks, maybeDeferred,
-                                    returnValue, succeed)
-from twisted.internet.task import coiterate, LoopingCall
+from twisted.internet import reactor
+from twisted.internet.defer import (Deferred, DeferredList, maybeDeferred,
+    succeed)
+from twisted.internet.task import LoopingCall
 from twisted.python import log
+from twisted.python.failure import Failure
 
 from bravo.chunk import Chunk
 from bravo.config import configuration
 from bravo.entity import Player
-from bravo.errors import SerializerReadException
+from bravo.errors import ChunkNotLoaded, SerializerReadException
 from bravo.ibravo import ISerializer, ISerializerFactory
 from bravo.plugin import (retrieve_named_plugins, verify_plugin,
     PluginException)
+from bravo.remote import GenerationPool
+from bravo.utilities.cache import LRUCache
 from bravo.utilities.coords import split_coords
+from bravo.utilities.light import LightQueue
+from bravo.utilities.scheduler import Scheduler
 from bravo.utilities.temporal import PendingEvent
+from bravo.utilities.workers import WorkerPool
 
 def coords_to_chunk(f):
     """
@@ -41,6 +51,26 @@ def coords_to_chunk(f):
 
     return decorated
 
+def sync_coords_to_chunk(f):
+    """
+    Look up the chunk for the coordinates, but only if it is already loaded,
+    and convert world coordinates to chunk coordinates.
+
+    The decorated method is called immediately, and its result is returned
+    directly. If the chunk isn't loaded, ``ChunkNotLoaded`` is raised
+    instead; the chunk is not loaded or generated.
+    """
+
+    @wraps(f)
+    def decorated(self, coords, *args, **kwargs):
+        x, y, z = coords
+
+        bigx, smallx, bigz, smallz = split_coords(x, z)
+        chunk = self.sync_request_chunk(bigx, bigz)
+        return f(self, chunk, (smallx, y, smallz), *args, **kwargs)
+
+    return decorated
+
 class World(object):
     """
     Object representing a world on disk.
@@ -59,9 +89,10 @@ class World(object):
     Whether objects belonging to this world may be written out to disk.
     """
 
-    async = False
+    generation_pool = None
     """
-    Whether this world is using multiprocessing methods to generate geometry.
+    The ``GenerationPool`` which this world uses to generate geometry in
+    other processes, if any.
     """
 
     dimension = 0
@@ -75,7 +106,8 @@ class World(object):
     """
     A permanent cache of chunks which are never evicted from memory.
 
-    This cache is used to speed up logins near the spawn point.
+    This cache is used to speed up logins near the spawn point. The chunks in
+    it are pinned in ``chunk_cache``.
     """
 
     def __init__(self, name):
@@ -98,24 +130,95 @@ class World(object):
             log.msg(pe)
             raise RuntimeError("Fatal error: Couldn't set up serializer!")
 
-        self.chunk_cache = weakref.WeakValueDictionary()
+        # Every loaded chunk is kept in the chunk cache, up to a limit on the
+        # number of chunks and, optionally, on their total size in bytes;
+        # past that, the least recently used chunks are evicted, and written
+        # back to disk first if they're dirty. The dirty chunks are also kept
+        # in their own dictionary, so that they can be found quickly.
+        self.chunk_cache = LRUCache(
+            configuration.getintdefault(self.config_name, "cache_size",
+                1024),
+            configuration.getintdefault(self.config_name, "cache_budget", 0),
+            attrgetter("nbytes"))
         self.dirty_chunk_cache = dict()
 
+        # Dirty chunks are saved a few at a time, for up to this many
+        # milliseconds per second, starting with the ones which are about to
+        # be evicted and then the ones which have been dirty the longest.
+        self.save_budget = configuration.getintdefault(self.config_name,
+            "save_budget", 50) / 1000.0
+        self.dirty_since = dict()
+        self.chunks_saved = 0
+        self.save_time = 0.0
+        self.save_latency = 0.0
+        self.last_save_batch = 0
+
+        # Evicted chunks might still be in use, by players or plugins; as
+        # long as they are, they have to be found again instead of being
+        # loaded a second time.
+        self._live_chunks = weakref.WeakValueDictionary()
+
         self._pending_chunks = dict()
 
+        # Chunks are generated a stage at a time, nearest to the players
+        # first, for up to this many milliseconds per reactor iteration.
+        self.interests = dict()
+        self.generation = Scheduler(configuration.getintdefault(
+            self.config_name, "generate_budget", 10) / 1000.0,
+            self._generation_priority)
+
+        # Chunk and player files are read and written on a pool of threads,
+        # so that disk access and compression don't hold up the reactor.
+        # Chunks in the same region are always read and written in order.
+        self.io = WorkerPool(configuration.getintdefault(self.config_name,
+            "io_threads", 4), "world-io")
+
+        # Serializers which write files can be told how hard to try to get
+        # their writes onto the disk.
+        if hasattr(self.serializer, "fsync"):
+            fsync = configuration.getdefault(self.config_name, "fsync",
+                "none")
+            if fsync not in ("none", "batch", "interval"):
+                log.msg("Unknown fsync policy %r; not syncing" % fsync)
+                fsync = "none"
+            self.serializer.fsync = fsync
+            self.serializer.fsync_interval = configuration.getintdefault(
+                self.config_name, "fsync_interval", 5)
+
+        # Once the last of the disk access is done, the serializer can close
+        # any files which it has been keeping open.
+        reactor.addSystemEventTrigger("after", "shutdown", self.close)
+
+        self.light_queue = LightQueue(self.loaded_chunk)
+
+        # Templates for identical chunks are kept for as long as any chunk is
+        # using them, and so are the chunks which might turn out to have a
+        # twin. Both are keyed by heightmap, which is much cheaper to compare
+        # than the whole chunk.
+        self.templates = weakref.WeakValueDictionary()
+        self.template_candidates = weakref.WeakValueDictionary()
+
+        # Idle chunks are compressed in memory after this many seconds, if
+        # they're big enough to be worth compressing.
+        self.hibernate_idle = configuration.getintdefault(self.config_name,
+            "hibernate_idle", 300)
+        self.hibernate_size = configuration.getintdefault(self.config_name,
+            "hibernate_size", 16384)
+        self.chunk_hits = 0
+        self.chunk_misses = 0
+
         self.spawn = (0, 0, 0)
         self.seed = random.randint(0, sys.maxint)
         self.time = 0
 
-        # Check if we should offload chunk requests to ampoule.
-        if configuration.getbooleandefault("bravo", "ampoule", False):
-            try:
-                import ampoule
-            except ImportError:
-                pass
-            else:
-                self.async = True
-
+        # Chunks can be generated in other processes, which hand them back
+        # through shared memory. The processes are started right away, before
+        # there are any threads around to confuse them.
+        workers = configuration.getintdefault(self.config_name,
+            "generate_workers", 0)
+        if workers:
+            self.generation_pool = GenerationPool(workers)
+            self.generation_pool.start()
 
         # First, try loading the level, to see if there's any data out there
         # which we can use. If not, don't worry about it.
@@ -136,7 +239,23 @@ class World(object):
 
         log.msg("World started on %s, using serializer %s" %
             (world_url, self.serializer.name))
-        log.msg("Using Ampoule: %s" % self.async)
+        if self.generation_pool is not None:
+            log.msg("Generating chunks in %d processes" %
+                self.generation_pool.size)
+
+    def close(self):
+        """
+        Finish any outstanding disk access, and close the serializer.
+
+        Serializers don't have to be closable; those which aren't are left
+        alone.
+        """
+
+        self.io.stop()
+
+        close = getattr(self.serializer, "close", None)
+        if close is not None:
+            close()
 
     def enable_cache(self, size):
         """
@@ -157,39 +276,257 @@ class World(object):
         self.permanent_cache = set()
         def assign(chunk):
             self.permanent_cache.add(chunk)
+            self.chunk_cache.pin((chunk.x, chunk.z))
 
         x = self.spawn[0] // 16
         z = self.spawn[2] // 16
 
         rx = xrange(x - size, x + size)
         rz = xrange(z - size, z + size)
-        d = coiterate(self.request_chunk(x, z).addCallback(assign)
-            for x, z in product(rx, rz))
+        d = DeferredList([d.addCallback(assign)
+            for d in self.request_chunks(product(rx, rz)).itervalues()])
         d.addCallback(lambda chaff: log.msg("Cache size is now %d" % size))
 
     def sort_chunks(self):
         """
         Sort out the internal caches.
 
-        This method will always block when there are dirty chunks.
+        Newly dirtied chunks are noticed and queued for saving, and then a
+        batch of dirty chunks is saved, blocking for up to ``save_budget``
+        seconds.
+
+        Any chunks which have had their full-height arrays pulled out since
+        the last sort are compacted again.
         """
 
-        first = True
+        now = time()
 
-        all_chunks = dict(self.dirty_chunk_cache)
-        all_chunks.update(self.chunk_cache)
-        self.chunk_cache.clear()
-        self.dirty_chunk_cache.clear()
-        for coords, chunk in all_chunks.iteritems():
+        for coords, chunk in self.chunk_cache.items():
+            chunk.compact()
             if chunk.dirty:
-                if first:
-                    first = False
-                    self.save_chunk(chunk)
-                    self.chunk_cache[coords] = chunk
-                else:
-                    self.dirty_chunk_cache[coords] = chunk
+                self.dirty_chunk_cache[coords] = chunk
+                self.dirty_since.setdefault(coords, now)
             else:
-                self.chunk_cache[coords] = chunk
+                self.dirty_chunk_cache.pop(coords, None)
+                self.dirty_since.pop(coords, None)
+
+        self.save_dirty_chunks()
+        self.evict_chunks()
+        self.hibernate_chunks()
+
+    def save_dirty_chunks(self):
+        """
+        Save a batch of dirty chunks.
+
+        Chunks which are going to be evicted soon are saved first, so that
+        they don't have to be saved while being evicted, and then chunks are
+        saved in the order in which they became dirty. Chunks are saved until
+        ``save_budget`` runs out, but at least one chunk is always saved, so
+        that the backlog drains eventually even if saving is slow.
+
+        :returns: number of chunks saved
+        """
+
+        if not self.saving or not self.dirty_chunk_cache:
+            self.last_save_batch = 0
+            return 0
+
+        # Look ahead to the chunks which would be evicted if the cache were a
+        # tenth smaller.
+        cache = self.chunk_cache
+        doomed = [coords for coords in
+            cache.victims(cache.size * 9 // 10, cache.budget * 9 // 10)
+            if coords in self.dirty_chunk_cache]
+        rest = sorted(set(self.dirty_chunk_cache).difference(doomed),
+            key=lambda coords: self.dirty_since.get(coords, 0))
+
+        before = time()
+        count = 0
+        saves = []
+
+        # Lighting and snapshotting the chunks is what takes time here; the
+        # snapshots are written together afterwards, on the I/O threads.
+        for coords in doomed + rest:
+            chunk = self.dirty_chunk_cache.pop(coords)
+            if chunk.dirty:
+                saves.append(self._snapshot(chunk, before))
+            count += 1
+            if time() - before >= self.save_budget:
+                break
+
+        self._write_snapshots(saves, before)
+
+        self.last_save_batch = count
+        return count
+
+    def save_stats(self):
+        """
+        Get statistics on saving chunks.
+
+        The backlog is the number of chunks waiting to be saved. Latency is
+        measured from when a chunk was noticed to be dirty until it was
+        saved. If the serializer commits its writes in groups, the bytes it
+        has written, the number of commits, and the average time per commit
+        are included as well.
+
+        :returns: dict of statistics
+        """
+
+        if self.chunks_saved:
+            save_time = self.save_time / self.chunks_saved
+            latency = self.save_latency / self.chunks_saved
+        else:
+            save_time = latency = 0.0
+
+        stats = {
+            "backlog": len(self.dirty_chunk_cache),
+            "saved": self.chunks_saved,
+            "last_batch": self.last_save_batch,
+            "save_time": save_time,
+            "latency": latency,
+            "bytes_written": 0,
+            "commits": 0,
+            "commit_time": 0.0,
+        }
+
+        # Serializers which commit their writes in groups can say how that's
+        # going.
+        write_stats = getattr(self.serializer, "write_stats", None)
+        if write_stats is not None:
+            stats.update(write_stats())
+
+        return stats
+
+    def load_stats(self):
+        """
+        Get statistics on loading chunks.
+
+        If the serializer keeps track, the number of chunks it has read, and
+        the average times spent reading each chunk off of the disk and
+        decoding it, are included.
+
+        :returns: dict of statistics
+        """
+
+        stats = {
+            "read": 0,
+            "read_time": 0.0,
+            "decode_time": 0.0,
+        }
+
+        read_stats = getattr(self.serializer, "read_stats", None)
+        if read_stats is not None:
+            stats.update(read_stats())
+
+        return stats
+
+    def evict_chunks(self):
+        """
+        Evict the least recently used chunks from the chunk cache, if it's
+        over its limits.
+
+        Dirty chunks are saved as they're evicted. Nothing is evicted while
+        saving is off, since dirty chunks couldn't be saved.
+
+        :returns: ``Deferred`` which fires when the evicted chunks are saved
+        """
+
+        if not self.saving:
+            return succeed(None)
+
+        evicted = self.chunk_cache.evict()
+        for coords, chunk in evicted:
+            self.dirty_chunk_cache.pop(coords, None)
+        return self.save_chunks([chunk for coords, chunk in evicted])
+
+    def cache_chunk(self, chunk):
+        """
+        Put a chunk into the chunk cache.
+        """
+
+        coords = chunk.x, chunk.z
+        self.chunk_cache[coords] = chunk
+        self._live_chunks[coords] = chunk
+        if chunk.dirty:
+            self.dirty_chunk_cache[coords] = chunk
+            self.dirty_since.setdefault(coords, time())
+
+    def cache_stats(self):
+        """
+        Get statistics on the chunk cache.
+
+        Requests for chunks are hits if the chunk was in the cache, and misses
+        if it wasn't.
+
+        :returns: dict of statistics
+        """
+
+        cache = self.chunk_cache
+
+        requests = cache.hits + cache.misses
+        if requests:
+            hit_rate = cache.hits / float(requests)
+        else:
+            hit_rate = 1.0
+
+        return {
+            "chunks": len(cache),
+            "dirty": len(self.dirty_chunk_cache),
+            "size": cache.size,
+            "bytes": cache.weight(),
+            "budget": cache.budget,
+            "hits": cache.hits,
+            "misses": cache.misses,
+            "evictions": cache.evictions,
+            "hit_rate": hit_rate,
+        }
+
+    def hibernate_chunks(self):
+        """
+        Compress any clean chunks which haven't been used in a while.
+
+        Hibernating chunks are woken up again as soon as they're needed, so
+        this is always safe to do.
+        """
+
+        if not self.hibernate_idle:
+            return
+
+        cutoff = time() - self.hibernate_idle
+
+        for chunk in self.chunk_cache.values():
+            if (chunk.hibernating or chunk.dirty or chunk.last_used > cutoff
+                or chunk.nbytes < self.hibernate_size):
+                continue
+            chunk.hibernate()
+
+    def hibernation_stats(self):
+        """
+        Get statistics on hibernating chunks.
+
+        Requests for loaded chunks are hits if the chunk was awake, and misses
+        if it had to be woken up.
+
+        :returns: dict of statistics
+        """
+
+        hibernating = [chunk for chunk in self.chunk_cache.itervalues()
+            if chunk.hibernating]
+
+        requests = self.chunk_hits + self.chunk_misses
+        if requests:
+            hit_rate = self.chunk_hits / float(requests)
+        else:
+            hit_rate = 1.0
+
+        return {
+            "hibernating": len(hibernating),
+            "bytes_saved": sum(chunk.hibernation_savings
+                for chunk in hibernating),
+            "hits": self.chunk_hits,
+            "misses": self.chunk_misses,
+            "hit_rate": hit_rate,
+        }
 
     def save_off(self):
         """
@@ -202,8 +539,6 @@ class World(object):
         if not self.saving:
             return
 
-        d = dict(self.chunk_cache)
-        self.chunk_cache = d
         self.saving = False
 
     def save_on(self):
@@ -214,19 +549,98 @@ class World(object):
         if self.saving:
             return
 
-        d = weakref.WeakValueDictionary(self.chunk_cache)
-        self.chunk_cache = d
         self.saving = True
 
+    def loaded_chunk(self, x, z):
+        """
+        Look up a chunk, but only if it is already in memory.
+
+        :returns: ``Chunk``, or None if the chunk isn't loaded
+        """
+
+        chunk = self.chunk_cache.peek((x, z))
+        if chunk is None:
+            chunk = self._live_chunks.get((x, z))
+            if chunk is not None:
+                self.cache_chunk(chunk)
+        return chunk
+
+    def sync_request_chunk(self, x, z):
+        """
+        Get a chunk which is already in memory, right away.
+
+        :raises ChunkNotLoaded: the chunk isn't loaded
+        :returns: ``Chunk``
+        """
+
+        chunk = self.loaded_chunk(x, z)
+        if chunk is None:
+            raise ChunkNotLoaded("Chunk (%d, %d) isn't loaded" % (x, z))
+        return chunk
+
+    def share_template(self, chunk):
+        """
+        Make a chunk share its contents with any other chunks which are
+        exactly the same, like the chunks of flat worlds and oceans.
+
+        Only chunks with the same heightmap as another chunk are compared in
+        full, and a chunk only becomes a template once a second chunk with
+        the same contents turns up; most chunks have no twin, and they're
+        left alone.
+        """
+
+        key = chunk.heightmap.tostring()
+        template = self.templates.get(key)
+        candidate = self.template_candidates.get(key)
+
+        if template is None and (candidate is None or candidate is chunk):
+            self.template_candidates[key] = chunk
+            return
+
+        # Light that hasn't been spread yet would change the digest later.
+        chunk.update_light()
+        digest = chunk.digest()
+
+        if template is not None and template.digest == digest:
+            chunk.use_template(template)
+            return
+
+        if (candidate is not None and candidate is not chunk
+            and not candidate.hibernating):
+            candidate.update_light()
+            if candidate.digest() == digest:
+                template = candidate.make_template()
+                chunk.use_template(template)
+                self.templates[key] = template
+                del self.template_candidates[key]
+                return
+
+        self.template_candidates[key] = chunk
+
     def postprocess_chunk(self, chunk):
         """
         Do a series of final steps to bring a chunk into the world.
         """
 
+        # Share our light queue, so that lighting changes in this chunk can
+        # spill over into its neighbors.
+        chunk.light_queue = self.light_queue
+
+        # Generating and loading chunks both work on full-height arrays;
+        # squeeze out the empty sections now that we're done with them.
+        chunk.compact()
+
         # Apply the current season to the chunk.
         if self.season:
             self.season.transform(chunk)
 
+        # Apply the season's lighting changes, unless the chunk is going to be
+        # lit from scratch anyway, and then share storage with any identical
+        # chunks. Chunks which might be shared are lit first.
+        if not chunk.light_dirty:
+            chunk.update_light()
+        self.share_template(chunk)
+
         # Since this chunk hasn't been given to any player yet, there's no
         # conceivable way that any meaningful damage has been accumulated;
         # anybody loading any part of this chunk will want the entire thing.
@@ -240,106 +654,420 @@ class World(object):
         # Return the chunk, in case we are in a Deferred chain.
         return chunk
 
-    @inlineCallbacks
-    def request_chunk(self, x, z):
+    def _requested_chunk(self, x, z):
         """
-        Request a ``Chunk`` to be delivered later.
+        Get a ``Deferred`` for a chunk which is already loaded, or which is
+        already being loaded.
 
-        :returns: ``Deferred`` that will be called with the ``Chunk``
+        :returns: ``Deferred`` that will be called with the ``Chunk``, or None
+                  if the chunk has to be loaded
         """
 
-        if (x, z) in self.chunk_cache:
-            returnValue(self.chunk_cache[x, z])
-        elif (x, z) in self.dirty_chunk_cache:
-            returnValue(self.dirty_chunk_cache[x, z])
+        chunk = self.chunk_cache.get((x, z))
+        if chunk is None:
+            chunk = self.loaded_chunk(x, z)
+        if chunk is not None:
+            if chunk.hibernating:
+                self.chunk_misses += 1
+            else:
+                self.chunk_hits += 1
+            chunk.last_used = time()
+            return succeed(chunk)
         elif (x, z) in self._pending_chunks:
             # Rig up another Deferred and wrap it up in a to-go box.
-            retval = yield self._pending_chunks[x, z].deferred()
-            returnValue(retval)
+            return self._pending_chunks[x, z].deferred()
 
-        chunk = Chunk(x, z)
-        yield maybeDeferred(self.serializer.load_chunk, chunk)
+        return None
 
-        if chunk.populated:
-            self.chunk_cache[x, z] = chunk
-            self.postprocess_chunk(chunk)
-            returnValue(chunk)
-
-        if self.async:
-            from ampoule import deferToAMPProcess
-            from bravo.remote import MakeChunk
-
-            d = deferToAMPProcess(MakeChunk,
-                x=x,
-                z=z,
-                seed=self.seed,
-                generators=configuration.getlist(self.config_name, "generators")
-            )
-
-            # Get chunk data into our chunk object.
-            def fill_chunk(kwargs):
-                chunk.blocks = fromstring(kwargs["blocks"],
-                    dtype=uint8).reshape(chunk.blocks.shape)
-                chunk.heightmap = fromstring(kwargs["heightmap"],
-                    dtype=uint8).reshape(chunk.heightmap.shape)
-                chunk.metadata = fromstring(kwargs["metadata"],
-                    dtype=uint8).reshape(chunk.metadata.shape)
-                chunk.skylight = fromstring(kwargs["skylight"],
-                    dtype=uint8).reshape(chunk.skylight.shape)
-                chunk.blocklight = fromstring(kwargs["blocklight"],
-                    dtype=uint8).reshape(chunk.blocklight.shape)
-
-                return chunk
-            d.addCallback(fill_chunk)
-        else:
-            # Populate the chunk the slow way. :c
-            for stage in self.pipeline:
-                stage.populate(chunk, self.seed)
+    def _pend_chunk(self, x, z):
+        """
+        Start waiting for a chunk to be loaded.
 
-            chunk.regenerate()
-            d = succeed(chunk)
+        :returns: tuple of the ``PendingEvent`` for the chunk and a
+                  ``Deferred`` from it
+        """
 
         # Set up our event and generate our return-value Deferred. It has to
         # be done early becaues PendingEvents only fire exactly once and it
-        # might fire immediately in certain cases.
-        pe = PendingEvent()
+        # might fire immediately in certain cases. Loading takes a while, too,
+        # so anybody else asking for this chunk waits for the same load.
+        pe = PendingEvent(lambda pe: self._cancel_chunk(x, z, pe))
         retval = pe.deferred()
         self._pending_chunks[x, z] = pe
 
-        def pp(chunk):
+        return pe, retval
+
+    def _finish_chunk(self, d, chunk, pe):
+        """
+        Once a chunk has been loaded, cache it, or generate it if it wasn't
+        on disk, and then fire its ``PendingEvent``.
+
+        :param `Deferred` d: ``Deferred`` which fires when the chunk is loaded
+        """
+
+        x, z = chunk.x, chunk.z
+
+        def loaded(none):
+            if self._pending_chunks.get((x, z)) is not pe:
+                # Everybody gave up on this chunk while it was loading, and
+                # somebody else might be loading it again by now, so it's
+                # thrown away.
+                return None
+
+            if chunk.populated:
+                self.cache_chunk(chunk)
+                self.postprocess_chunk(chunk)
+                return chunk
+
+            return self.generate_chunk(chunk)
+
+        def finished(result):
+            if self._pending_chunks.get((x, z)) is pe:
+                del self._pending_chunks[x, z]
+            return result
+
+        d.addCallback(loaded)
+        d.addBoth(finished)
+        d.chainDeferred(pe)
+
+    def request_chunk(self, x, z):
+        """
+        Request a ``Chunk`` to be delivered later.
+
+        The returned ``Deferred`` can be cancelled; once everybody who asked
+        for a chunk has cancelled their request, the chunk isn't generated.
+
+        :returns: ``Deferred`` that will be called with the ``Chunk``
+        """
+
+        retval = self._requested_chunk(x, z)
+        if retval is not None:
+            return retval
+
+        pe, retval = self._pend_chunk(x, z)
+
+        chunk = Chunk(x, z)
+        d = self.io.run(self._region(x, z), self.serializer.load_chunk, chunk)
+        self._finish_chunk(d, chunk, pe)
+
+        return retval
+
+    def request_chunks(self, coords):
+        """
+        Request many ``Chunk``s at once.
+
+        This is like calling ``request_chunk()`` for every chunk, but chunks
+        which have to be loaded are loaded a region at a time; if the
+        serializer knows how its chunks are laid out on disk, each region's
+        chunks are read in that order, instead of jumping back and forth
+        through the region's file. Each chunk is delivered as soon as it's
+        ready, without waiting for the rest of its region.
+
+        :param iterable coords: pairs of chunk coordinates
+
+        :returns: dict of coordinates to ``Deferred``s that will be called
+                  with the ``Chunk``s
+        """
+
+        retval = {}
+        regions = {}
+
+        for x, z in coords:
+            if (x, z) in retval:
+                continue
+
+            d = self._requested_chunk(x, z)
+            if d is None:
+                pe, d = self._pend_chunk(x, z)
+                chunk = Chunk(x, z)
+                loaded = Deferred()
+                self._finish_chunk(loaded, chunk, pe)
+                regions.setdefault(self._region(x, z), []).append(
+                    (chunk, pe, loaded))
+
+            retval[x, z] = d
+
+        for region, loads in regions.iteritems():
+            d = self.io.run(region, self._load_chunks, loads)
+            d.addErrback(log.err)
+
+        return retval
+
+    def _load_chunks(self, loads):
+        """
+        Load several chunks from the same region, in the worker threads.
+
+        :param list loads: tuples of a ``Chunk``, its ``PendingEvent``, and a
+                           ``Deferred`` to fire when the chunk is loaded
+        """
+
+        # Serializers which keep their chunks in files of their own don't
+        # have any particular order.
+        order = getattr(self.serializer, "disk_order", None)
+        if order is not None:
+            try:
+                chunks = order([chunk for chunk, pe, d in loads])
+                position = dict(((chunk.x, chunk.z), i)
+                    for i, chunk in enumerate(chunks))
+                loads = sorted(loads,
+                    key=lambda load: position[load[0].x, load[0].z])
+            except:
+                # The order is only a nicety; the chunks still need loading.
+                log.err(Failure(), "Couldn't sort chunks into disk order")
+
+        for chunk, pe, d in loads:
+            # Chunks which everybody has given up on aren't worth reading.
+            # This is only a hint, since it's racing with the reactor;
+            # loaded() has the final say.
+            if self._pending_chunks.get((chunk.x, chunk.z)) is not pe:
+                reactor.callFromThread(d.callback, None)
+                continue
+
+            try:
+                self.serializer.load_chunk(chunk)
+            except:
+                reactor.callFromThread(d.errback, Failure())
+            else:
+                reactor.callFromThread(d.callback, None)
+
+    def _cancel_chunk(self, x, z, pe):
+        """
+        Stop loading or generating a chunk which nobody is waiting for.
+        """
+
+        if self._pending_chunks.get((x, z)) is pe:
+            del self._pending_chunks[x, z]
+            self.generation.cancel((x, z))
+
+    def set_interest(self, key, x, z):
+        """
+        Note that somebody, usually a player, is interested in the chunks
+        around a certain chunk.
+
+        Chunks are generated in order of their distance to the nearest point
+        of interest.
+
+        :param key: hashable key for whoever is interested
+        :param int x: X coordinate of the chunk
+        :param int z: Z coordinate of the chunk
+        """
+
+        if self.interests.get(key) != (x, z):
+            self.interests[key] = x, z
+            self.generation.reprioritize()
+
+    def clear_interest(self, key):
+        """
+        Forget about a point of interest.
+        """
+
+        if self.interests.pop(key, None) is not None:
+            self.generation.reprioritize()
+
+    def _generation_priority(self, coords):
+        """
+        Get the squared distance from a chunk to the nearest point of
+        interest.
+        """
+
+        if not self.interests:
+            return 0
+
+        x, z = coords
+        return min((x - i) ** 2 + (z - j) ** 2
+            for i, j in self.interests.itervalues())
+
+    def generate_chunk(self, chunk):
+        """
+        Generate the geometry of a chunk which hasn't been populated yet.
+
+        Generation is queued, and done a stage at a time, for the chunks
+        nearest to players first.
+
+        :returns: ``Deferred`` that will be called with the ``Chunk``
+        """
+
+        d = self.generation.schedule((chunk.x, chunk.z),
+            self._generate(chunk))
+
+        def pp(none):
             chunk.populated = True
             chunk.dirty = True
 
             self.postprocess_chunk(chunk)
 
-            self.dirty_chunk_cache[x, z] = chunk
-            del self._pending_chunks[x, z]
+            self.cache_chunk(chunk)
 
             return chunk
 
-        # Set up callbacks.
         d.addCallback(pp)
-        d.chainDeferred(pe)
+        return d
+
+    def _generate(self, chunk):
+        """
+        Run the generator pipeline on a chunk, yielding after each stage.
+        """
+
+        if self.generation_pool is not None:
+            # The scheduler carries on with other chunks while this one is
+            # being generated in another process.
+            yield self.generation_pool.generate(chunk, self.seed,
+                [stage.name for stage in self.pipeline])
+        else:
+            # Populate the chunk the slow way. :c
+            for stage in self.pipeline:
+                stage.populate(chunk, self.seed)
+                yield
+
+            # Light is only spread once the chunk is actually sent or saved.
+            chunk.regenerate(lazy=True)
 
-        # Because multiple people might be attached to this callback, we're
-        # going to do something magical here. We will yield a forked version
-        # of our Deferred. This means that we will wait right here, for a
-        # long, long time, before actually returning with the chunk, *but*,
-        # when we actually finish, we'll be ready to return the chunk
-        # immediately. Our caller cannot possibly care because they only see a
-        # Deferred either way.
-        retval = yield retval
-        returnValue(retval)
+    def _region(self, x, z):
+        """
+        Get the key used to keep disk access in order for a chunk.
+
+        Chunks are grouped into regions of 32x32 chunks, like the regions of
+        Beta worlds.
+        """
+
+        return x >> 5, z >> 5
 
     def save_chunk(self, chunk):
+        """
+        Write a dirty chunk to disk.
 
-        if not chunk.dirty or not self.saving:
-            return
+        The chunk is lit, and then a snapshot of it is written out on the I/O
+        threads, so it can carry on changing in the meantime; it's clean as
+        soon as the snapshot is taken.
+
+        :returns: ``Deferred`` which fires when the chunk has been written
+        """
 
-        self.serializer.save_chunk(chunk)
+        return self.save_chunks([chunk])
+
+    def save_chunks(self, chunks):
+        """
+        Write dirty chunks to disk.
+
+        This is like calling ``save_chunk()`` for every chunk, but if the
+        serializer can save many chunks at once, the chunks are handed to it
+        together, or a region at a time if it stores chunks by region, so
+        that it can commit them as a group.
+
+        :returns: ``Deferred`` which fires when the chunks have been written
+        """
+
+        if not self.saving:
+            return succeed(None)
+
+        now = time()
+        saves = [self._snapshot(chunk, now) for chunk in chunks
+            if chunk.dirty]
+
+        return self._write_snapshots(saves, now)
+
+    def flush(self):
+        """
+        Write every dirty chunk in memory to disk.
+
+        Unlike ``save_dirty_chunks()``, this doesn't stop at the save budget,
+        and it doesn't wait for ``sort_chunks()`` to notice chunks which have
+        only just been dirtied. This is meant for shutting down.
+
+        :returns: ``Deferred`` which fires when the chunks have been written
+        """
 
+        chunks = [chunk for chunk in self._live_chunks.values()
+            if chunk.dirty]
+        for chunk in chunks:
+            self.dirty_chunk_cache.pop((chunk.x, chunk.z), None)
+
+        return self.save_chunks(chunks)
+
+    def _snapshot(self, chunk, now):
+        """
+        Take a snapshot of a dirty chunk for saving, and mark it clean.
+
+        :returns: tuple of the chunk, its snapshot, and when it became dirty
+        """
+
+        chunk.update_light()
+        snapshot = chunk.snapshot()
         chunk.dirty = False
 
+        since = self.dirty_since.pop((chunk.x, chunk.z), now)
+        return chunk, snapshot, since
+
+    def _write_snapshots(self, saves, now):
+        """
+        Write snapshots out on the I/O threads.
+
+        Serializers which store chunks by region are handed the snapshots a
+        region at a time; the rest are handed all of them in one go.
+
+        :param list saves: tuples from ``_snapshot()``
+        :param float now: when saving started
+
+        :returns: ``Deferred`` which fires when the snapshots are written
+        """
+
+        regions = {}
+        if getattr(self.serializer, "saves_by_region", False):
+            for chunk, snapshot, since in saves:
+                regions.setdefault(self._region(chunk.x, chunk.z),
+                    []).append((chunk, snapshot, since))
+        elif saves:
+            # Whole batches still have to be written in order, so that an
+            # older snapshot never lands on top of a newer one. Loads aren't
+            # kept in order with them, but chunks stay live until they're
+            # saved, so they're never loaded from disk in the meantime.
+            regions["chunks"] = saves
+
+        save = getattr(self.serializer, "save_chunks", None)
+        if save is None:
+            save = self._save_each
+
+        def saved(none, group):
+            after = time()
+            for chunk, snapshot, since in group:
+                self.chunks_saved += 1
+                self.save_time += (after - now) / len(group)
+                self.save_latency += after - since
+
+        def failed(failure, group):
+            # Try again later. Evicted chunks are only held by this group, so
+            # they go back into the cache, or their changes would be lost.
+            for chunk, snapshot, since in group:
+                coords = chunk.x, chunk.z
+                self.dirty_since[coords] = min(since,
+                    self.dirty_since.get(coords, since))
+                chunk.dirty = True
+                self.cache_chunk(chunk)
+            log.err(failure)
+
+        ds = []
+        for region, group in regions.iteritems():
+            d = self.io.run(region, save,
+                [snapshot for chunk, snapshot, since in group])
+            d.addCallbacks(saved, failed, callbackArgs=(group,),
+                errbackArgs=(group,))
+            ds.append(d)
+
+        if not ds:
+            return succeed(None)
+        elif len(ds) == 1:
+            return ds[0]
+        return DeferredList(ds).addCallback(lambda chaff: None)
+
+    def _save_each(self, chunks):
+        """
+        Save chunks one at a time, for serializers which can't save many
+        chunks at once.
+        """
+
+        for chunk in chunks:
+            self.serializer.save_chunk(chunk)
+
     def load_player(self, username):
         """
         Retrieve player data.
@@ -353,13 +1081,25 @@ class World(object):
         player.location.stance = self.spawn[1]
         player.location.z = self.spawn[2]
 
-        d = maybeDeferred(self.serializer.load_player, player)
+        d = self.io.run(("player", username), self.serializer.load_player,
+            player)
         d.addCallback(lambda none: player)
         return d
 
     def save_player(self, username, player):
-        if self.saving:
-            self.serializer.save_player(player)
+        """
+        Write a player to disk, on the I/O threads.
+
+        :returns: ``Deferred`` which fires when the player has been written
+        """
+
+        if not self.saving:
+            return succeed(None)
+
+        d = self.io.run(("player", username), self.serializer.save_player,
+            player)
+        d.addErrback(log.err)
+        return d
 
     # World-level geometry access.
     # These methods let external API users refrain from going through the
@@ -424,3 +1164,165 @@ class World(object):
         """
 
         chunk.dirty = True
+
+    # Synchronous geometry access.
+    # These methods are for simulations, like fluids and redstone, which make
+    # many accesses at once and only care about chunks which are already in
+    # memory. They never wait; instead, they raise ``ChunkNotLoaded`` when a
+    # chunk isn't loaded, and leave it up to the caller whether to skip that
+    # spot or to fall back to the asynchronous methods above.
+
+    @sync_coords_to_chunk
+    def sync_get_block(self, chunk, coords):
+        """
+        Get a block from a loaded chunk.
+
+        :raises ChunkNotLoaded: the chunk isn't loaded
+        :returns: the requested block type
+        """
+
+        return chunk.get_block(coords)
+
+    @sync_coords_to_chunk
+    def sync_set_block(self, chunk, coords, value):
+        """
+        Set a block in a loaded chunk.
+
+        :raises ChunkNotLoaded: the chunk isn't loaded
+        """
+
+        chunk.set_block(coords, value)
+
+    @sync_coords_to_chunk
+    def sync_get_metadata(self, chunk, coords):
+        """
+        Get a block's metadata from a loaded chunk.
+
+        :raises ChunkNotLoaded: the chunk isn't loaded
+        :returns: the requested metadata
+        """
+
+        return chunk.get_metadata(coords)
+
+    @sync_coords_to_chunk
+    def sync_set_metadata(self, chunk, coords, value):
+        """
+        Set a block's metadata in a loaded chunk.
+
+        :raises ChunkNotLoaded: the chunk isn't loaded
+        """
+
+        chunk.set_metadata(coords, value)
+
+    @sync_coords_to_chunk
+    def sync_destroy(self, chunk, coords):
+        """
+        Destroy a block in a loaded chunk.
+
+        :raises ChunkNotLoaded: the chunk isn't loaded
+        """
+
+        chunk.destroy(coords)
+
+    def _group_coords(self, coords):
+        """
+        Sort world coordinates by the chunks which contain them.
+
+        Every chunk is looked up before anything is returned, so that nothing
+        is done with the coordinates unless all of their chunks are loaded.
+
+        :raises ChunkNotLoaded: any of the chunks isn't loaded
+        :returns: list of chunks, indices into the coordinates, and the
+                  coordinates relative to the chunk
+        """
+
+        coords = asarray(coords, dtype=int).reshape(-1, 3)
+        if not len(coords):
+            return []
+
+        # Each chunk gets a single key, with its X coordinate in the high
+        # bits and its Z coordinate in the low bits, so that grouping is
+        # done on a flat array.
+        bigx = coords[:, 0].astype(int64) >> 4
+        bigz = coords[:, 2].astype(int64) >> 4
+        keys, inverse = unique((bigx << 32) | (bigz & 0xffffffff),
+            return_inverse=True)
+
+        # A stable sort keeps the coordinates of each chunk in their original
+        # order, so that later writes to the same block still win.
+        order = argsort(inverse, kind="mergesort")
+        ends = cumsum(bincount(inverse))
+
+        # Shifting the Z coordinates up and back down again restores their
+        # signs.
+        chunks = [self.sync_request_chunk(x, z) for x, z in
+            zip((keys >> 32).tolist(), ((keys << 32) >> 32).tolist())]
+
+        small = coords.copy()
+        small[:, 0] &= 0xf
+        small[:, 2] &= 0xf
+
+        groups = []
+        start = 0
+        for chunk, end in zip(chunks, ends.tolist()):
+            indices = order[start:end]
+            groups.append((chunk, indices, small[indices]))
+            start = end
+
+        return groups
+
+    def sync_get_blocks(self, coords):
+        """
+        Get many blocks from loaded chunks at once.
+
+        The coordinates are grouped by chunk, and each chunk is only looked
+        up once.
+
+        :param coords: sequence of coordinate triplets, or an array of them
+                       with shape (n, 3)
+        :raises ChunkNotLoaded: any of the chunks isn't loaded
+        :rtype: :py:class:`numpy.ndarray`
+        :returns: block types, in the same order as the coordinates
+        """
+
+        groups = self._group_coords(coords)
+
+        count = sum(len(indices) for chunk, indices, small in groups)
+
+        blocks = empty((count,), dtype=uint8)
+        for chunk, indices, small in groups:
+            blocks[indices] = chunk.get_blocks(small)
+
+        return blocks
+
+    def sync_set_blocks(self, coords, blocks=None, metadata=None):
+        """
+        Set many blocks in loaded chunks at once.
+
+        The coordinates are grouped by chunk, and each chunk is only looked
+        up and updated once. If any of the chunks isn't loaded, then nothing
+        is changed at all.
+
+        :param coords: sequence of coordinate triplets, or an array of them
+                       with shape (n, 3)
+        :param blocks: block type, or sequence of block types, one for each
+                       coordinate; None to leave the blocks alone
+        :param metadata: metadata, or sequence of metadata, one for each
+                         coordinate; None to leave the metadata alone
+        :raises ChunkNotLoaded: any of the chunks isn't loaded
+        :returns: number of blocks changed
+        """
+
+        groups = self._group_coords(coords)
+
+        def select(values, indices):
+            if values is None or not asarray(values).ndim:
+                return values
+            return asarray(values)[indices]
+
+        changed = 0
+        for chunk, indices, small in groups:
+            changed += chunk.set_blocks(small, select(blocks, indices),
+                select(metadata, indices))
+
+        return changed
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+"""
+Compare generating chunks in the server process to generating them in a
+GenerationPool.
+
+Usage: genbench.py [chunks] [workers]
+"""
+
+import time
+import sys
+
+from twisted.internet import reactor
+from twisted.internet.defer import gatherResults, inlineCallbacks
+
+from bravo.chunk import Chunk
+from bravo.config import configuration
+from bravo.ibravo import ITerrainGenerator
+from bravo.plugin import retrieve_sorted_plugins
+from bravo.remote import GenerationPool
+
+chunks = 100
+workers = 4
+
+if len(sys.argv) > 1:
+    chunks = int(sys.argv[1])
+if len(sys.argv) > 2:
+    workers = int(sys.argv[2])
+
+generators = configuration.getlist("bravo", "generators")
+
+def local():
+
+    pipeline = retrieve_sorted_plugins(ITerrainGenerator, generators)
+
+    before = time.time()
+
+    for i in range(chunks):
+        chunk = Chunk(i, i)
+        for stage in pipeline:
+            stage.populate(chunk, 0)
+        chunk.regenerate()
+
+    after = time.time()
+
+    return after - before
+
+@inlineCallbacks
+def pooled():
+
+    pool = GenerationPool(workers)
+    pool.start()
+
+    # Warm up the processes, so that they've loaded their plugins.
+    yield gatherResults([pool.generate(Chunk(-i, -i), 0, generators)
+        for i in range(workers)])
+
+    before = time.time()
+
+    yield gatherResults([pool.generate(Chunk(i, i), 0, generators)
+        for i in range(chunks)])
+
+    after = time.time()
+
+    pool.stop()
+
+    t = after - before
+    print "Pooled, %d workers: %f seconds, %f chunks/second" % (workers, t,
+        chunks / t)
+
+t = local()
+print "In-process: %f seconds, %f chunks/second" % (t, chunks / t)
+
+d = pooled()
+d.addErrback(lambda failure: failure.printTraceback())
+d.addBoth(lambda chaff: reactor.stop())
+reactor.run()
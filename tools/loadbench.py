@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+"""
+Time loading the chunks in a region file, reading them off of the disk
+separately from decoding them.
+
+Usage: loadbench.py <region file>
+"""
+
+import tempfile
+import time
+import sys
+
+from twisted.python.filepath import FilePath
+
+from bravo.chunk import Chunk
+from bravo.nbt import parse_nbt
+from bravo.plugins.serializers import Alpha, Region
+
+if len(sys.argv) < 2:
+    print "Usage: %s <region file>" % sys.argv[0]
+    sys.exit(1)
+
+# Only the chunk decoder is needed, so the world folder can be anywhere.
+serializer = Alpha("file://" + tempfile.mkdtemp())
+
+def read():
+
+    region = Region(FilePath(sys.argv[1]))
+
+    before = time.time()
+
+    payloads = [region.read(x, z) for x, z in sorted(region.positions)]
+
+    after = time.time()
+
+    region.close()
+
+    return payloads, after - before
+
+def parse(payloads):
+
+    before = time.time()
+
+    tags = [parse_nbt(payload) for payload in payloads]
+
+    after = time.time()
+
+    return tags, after - before
+
+def decode(tags):
+
+    before = time.time()
+
+    for tag in tags:
+        level = tag["Level"]
+        chunk = Chunk(level["xPos"].value, level["zPos"].value)
+        serializer._load_chunk_from_tag(chunk, tag)
+
+    after = time.time()
+
+    return after - before
+
+payloads, t = read()
+count = len(payloads)
+print "%d chunks" % count
+print "Read: %f seconds, %f ms/chunk" % (t, t * 1000 / count)
+
+tags, t = parse(payloads)
+print "Parse: %f seconds, %f ms/chunk" % (t, t * 1000 / count)
+
+t = decode(tags)
+print "Decode: %f seconds, %f ms/chunk" % (t, t * 1000 / count)
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+
+"""
+Convert the chunks of a world between MCRegion and the native format.
+
+Level, player, and plugin data are shared by both formats, and are left
+alone. Chunks already in the destination format are overwritten.
+
+Usage: nativeconvert.py import|export <world folder>
+"""
+
+import os
+import sys
+
+from bravo.chunk import Chunk
+from bravo.plugins.serializers import Beta, Native
+
+if len(sys.argv) < 3 or sys.argv[1] not in ("import", "export"):
+    print "Usage: %s import|export <world folder>" % sys.argv[0]
+    sys.exit(1)
+
+url = "file://" + os.path.abspath(sys.argv[2])
+
+if sys.argv[1] == "import":
+    source, destination = Beta(url), Native(url)
+else:
+    source, destination = Native(url), Beta(url)
+
+count = 0
+chunks = []
+
+for x, z in source.stored_chunks():
+    chunk = Chunk(x, z)
+    source.load_chunk(chunk)
+    chunks.append(chunk)
+
+    # Save a region's worth at a time.
+    if len(chunks) >= 1024:
+        destination.save_chunks(chunks)
+        count += len(chunks)
+        chunks = []
+
+destination.save_chunks(chunks)
+count += len(chunks)
+
+source.close()
+destination.close()
+
+print "Converted %d chunks" % count
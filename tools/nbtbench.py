@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+
+"""
+Compare the NBT parsers on the chunks in a region file.
+
+Usage: nbtbench.py <region file>
+"""
+
+import time
+import sys
+from StringIO import StringIO
+
+from twisted.python.filepath import FilePath
+
+from bravo.nbt import NBTFile, parse_nbt
+from bravo.plugins.serializers import Region
+
+if len(sys.argv) < 2:
+    print "Usage: %s <region file>" % sys.argv[0]
+    sys.exit(1)
+
+region = Region(FilePath(sys.argv[1]))
+payloads = [region.read(x, z) for x, z in sorted(region.positions)]
+region.close()
+
+print "%d chunks, %d KiB of NBT" % (len(payloads),
+    sum(len(payload) for payload in payloads) // 1024)
+
+def file_parser():
+
+    before = time.time()
+
+    for payload in payloads:
+        NBTFile(buffer=StringIO(payload))
+
+    after = time.time()
+
+    return after - before
+
+def buffer_parser():
+
+    before = time.time()
+
+    for payload in payloads:
+        parse_nbt(payload)
+
+    after = time.time()
+
+    return after - before
+
+t = file_parser()
+print "NBTFile: %f seconds" % t
+
+t = buffer_parser()
+print "parse_nbt: %f seconds" % t